@@ -1,18 +1,24 @@
 from dotenv import load_dotenv
 import os
 from src.model.bot import ThucChienAIBot
+from src.model.log import configure_logging
 load_dotenv()
 
 
 if __name__ == "__main__":
+   configure_logging()
    api_key = os.getenv("THUC_CHIEN_API_KEY")
    bot = ThucChienAIBot(api_key)
    key_info = bot.get_key_info()
-   total_spent = 50
    if key_info:
+           # Budget lấy từ THUC_CHIEN_BUDGET (như CostAccountant), nếu không có thì dùng max_budget của key.
+           total_budget = bot.budget.budget if bot.budget.budget is not None else key_info['info'].get('max_budget')
            print("Thông tin Key:")
            print(f"  - Tên Key: {key_info['info']['key_name']}")
            print(f"  - Chi tiêu: ${key_info['info']['spend']:.6f}")
-           print(f"  - Hạn mức chi tiêu: ${total_spent - key_info['info']['spend']:.6f}")
+           if total_budget is not None:
+               print(f"  - Hạn mức chi tiêu: ${total_budget - key_info['info']['spend']:.6f}")
+           else:
+               print("  - Hạn mức chi tiêu: không giới hạn")
            print(f"  - Models được phép: {key_info['info']['models']}")
 
@@ -1,167 +1,121 @@
 import dotenv
 import os
-from src.model.bot import ThucChienAIBot
 from langchain_core.runnables import RunnableConfig
-from src.graph.state import State
-from src.graph.builder import build_graph
+from src.graph.batch import completed_ids, load_jobs, run_batch
+from src.graph.storyboard import (
+    image_scenario_messages,
+    load_scenarios,
+    render_storyboard,
+    render_storyboard_stream,
+    stream_scenarios,
+    summarize,
+)
+from src.graph.checkpoint import DEFAULT_CHECKPOINT_DB, SqliteCheckpointer
+from src.model.artifact_store import ArtifactStore
+from src.model.async_bot import AsyncThucChienAIBot
+from src.model.log import configure_logging
+from src.model.metrics import METRICS
+from src.model.response_cache import ResponseCache
+import argparse
+import asyncio
 import json
 
 def main():
     dotenv.load_dotenv()
-
-    bot = ThucChienAIBot(api_key=os.getenv("THUC_CHIEN_API_KEY"))
-
-    config = RunnableConfig(
-        configurable={"bot": bot}
-    )
-
-    decision = "textimg2img"
-    image_input = ""
-#     content = """
-# Yêu cầu: Từ các thông tin dưới đây sinh cho tôi ảnh của nhân vật này với phong cách truyện tranh phong cách việt nam, cổ điển
-# Ảnh: ảnh đen trắng
-# Quan trọng: Không được thêm chữ vào ảnh và chỉ sinh một nhân vật duy nhất, không có background
-# Mô tả nhân vật:
-# Tên: Minh
-# Tuổi: 14 tuổi
-# Lớp: 8 (học sinh THCS)
-# Ngoại hình: Minh có vóc dáng vừa phải, nhanh nhẹn và luôn mang một vẻ ngoài năng động. Cậu thường diện áo phông đơn giản, quần jeans và giày thể thao, đúng phong cách của một cậu học sinh đang tuổi lớn
-# """
-#     plan = """
-# Tiêu đề: "Mật Mã Của Bố"
-# Tóm tắt cốt truyện: Minh, một học sinh THCS, nhận được tin nhắn từ một tài khoản Facebook giả mạo bố mình, yêu cầu khẩn cấp chuyển tiền vào một tài khoản lạ để giải quyết "sự cố gấp" và dặn dò không được nói với mẹ. Minh lo lắng và định làm theo, nhưng may mắn nhớ lại lời dặn của thầy cô về việc xác minh thông tin. Minh đã gọi điện trực tiếp cho bố để kiểm tra và phát hiện ra đây là chiêu trò lừa đảo giả danh người thân.
-# Thông điệp chính: Luôn xác minh thông tin trực tiếp với người thân qua kênh liên lạc chính thức (gọi điện, gặp mặt) khi nhận được yêu cầu chuyển tiền hoặc thông tin quan trọng.
-# Điểm nhấn cho học sinh: Tình huống giả danh người thân, lợi dụng sự tin tưởng và lo lắng của con cái.
-
-# Trả ra cho tôi 10 kịch bản cho câu chuyện trên ở ngôi kể chuyện thứ 3 mỗi scenario là 1 bối cảnh và kịch bản có sự liên kết đến nhau như một câu chuyện dưới dạng file json với cấu trúc như sau:
-# {
-#     "scenarios": [
-#         {
-#             "scene": "Scene 1",
-#             "scenario": "Detail of Scenario 1"
-#         },
-#         {
-#             "scene": "Scene 2",
-#             "scenario": "Detail of Scenario 2"
-#         },
-#         {
-#             "scene": "Scene 3",
-#             "scenario": "Detail of Scenario 3"
-#         },
-#         {
-#             "scene": "Scene 4",
-#             "scenario": "Detail of Scenario 4"
-#         },
-#         {
-#             "scene": "Scene 5",
-#             "scenario": "Detail of Scenario 5"
-#         },
-#         {
-#             "scene": "Scene 6",
-#             "scenario": "Detail of Scenario 6"
-#         },
-#         {
-#             "scene": "Scene 7",
-#             "scenario": "Detail of Scenario 7"
-#         },
-#         {
-#             "scene": "Scene 8",
-#             "scenario": "Detail of Scenario 8"
-#         },
-#         {
-#             "scene": "Scene 9",
-#             "scenario": "Detail of Scenario 9"
-#         },
-#         {
-#             "scene": "Scene 10",
-#             "scenario": "Detail of Scenario 10"
-#         }
-#     ]
-# }
-# """
-
-#     with open("scenarios.json", "r", encoding="utf-8") as f:
-#         scenarios = json.load(f)
-#         scenarios = scenarios["scenarios"]
-
-#     convert_to_image_prompt = """With the provided scenarios, create a scenarios of prompt for image generation with the following structure:
-# {
-#     "scenarios": [
-#         {
-#             "scene": "Scene 1",
-#             "scenario": "Prompt for image generation for the scene 1"
-#         },
-#         {
-#             "scene": "Scene 2",
-#             "scenario": "Prompt for image generation for the scene 2"
-#         },
-#         {
-#             "scene": "Scene 3",
-#             "scenario": "Prompt for image generation for the scene 3"
-#         }
-#     ]
-# }
-# """
-#     convert_to_image_prompt += f"Here is the scenarios:\n{scenarios}"
-
-    app = build_graph(decision)
-
-#     state = State(
-#         t2t_question=convert_to_image_prompt
-#     )
-#     result = app.invoke(state, config)
-#     print(result)
-
-    with open("image_scenario.json", "r", encoding="utf-8") as f:
-        scenarios = json.load(f)
-
-
-    for i, scenario in enumerate(scenarios["scenarios"]):
-        scene = scenario["scene"]
-        scenario = scenario["scenario"]
-
-        prompt = f"With the provided character image, CREATE black and white image for the scene {scene} with the following scenario:\n{scenario}"
-
-        state = State(
-            ti2i_image_paths=["output/images/generated_image_1761387977_1.png"],
-            ti2i_question=prompt,
-            ti2i_aspect_ratio="3:4",
-            ti2i_output_path=f"output/image/scene_{i}.png"
+    # LOG_LEVEL / LOG_FORMAT (text|json) / LOG_MAX_CHARS có thể được đặt trong .env.
+    configure_logging(force=True)
+
+    parser = argparse.ArgumentParser(description="Chạy các graph sinh nội dung của ThucChienAI.")
+    commands = parser.add_subparsers(dest="command")
+
+    batch = commands.add_parser("batch", help="Chạy một file job JSONL/JSON qua graph router.")
+    batch.add_argument("jobs", help="File job: mỗi dòng một object có 'decision' và các trường của State.")
+    batch.add_argument("--output", default="output/batch/results.jsonl", help="File JSONL kết quả (ghi nối tiếp).")
+    batch.add_argument("--max-concurrency", type=int, default=int(os.getenv("MAX_IN_FLIGHT", "4")))
+    batch.add_argument("--deadline", type=float, help="Thời gian tối đa (giây) cho mỗi job.")
+    batch.add_argument("--resume", action="store_true", help="Bỏ qua các job đã thành công trong file kết quả.")
+
+    storyboard = commands.add_parser("storyboard", help="Render toàn bộ scene của một file kịch bản.")
+    storyboard.add_argument("--scenario-file", default="image_scenario.json")
+    storyboard.add_argument("--reference-image", default="output/images/generated_image_1761387977_1.png")
+    storyboard.add_argument("--max-in-flight", type=int, default=int(os.getenv("MAX_IN_FLIGHT", "4")))
+    storyboard.add_argument("--from-story", help="File kịch bản gốc (vd. scenarios.json): sinh prompt ảnh bằng chat stream, "
+                                                 "render từng scene ngay khi nhận được và lưu kết quả vào --scenario-file.")
+
+    # Không có lệnh con: giữ hành vi cũ (render storyboard với các giá trị mặc định).
+    parser.set_defaults(**vars(storyboard.parse_args([])))
+    args = parser.parse_args()
+    if args.command == "batch":
+        summary = asyncio.run(run_batch_async(args.jobs, args.output, args.max_concurrency, args.deadline, args.resume))
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        reports = asyncio.run(render_storyboard_async(
+            scenario_file=args.scenario_file,
+            reference_image=args.reference_image,
+            max_in_flight=args.max_in_flight,
+            story_file=args.from_story,
+        ))
+        print(json.dumps(summarize(reports), ensure_ascii=False, indent=2))
+    # Đặt METRICS_FILE (ví dụ output/metrics.json hoặc output/metrics.prom) để lưu histogram latency của lần chạy.
+    if os.getenv("METRICS_FILE"):
+        METRICS.dump(os.getenv("METRICS_FILE"))
+
+
+def _response_cache():
+    # Đặt RESPONSE_CACHE_DIR để không phải trả tiền lại cho các request có payload không đổi.
+    cache_dir = os.getenv("RESPONSE_CACHE_DIR")
+    return ResponseCache(cache_dir) if cache_dir else None
+
+
+def _artifact_store():
+    # Đặt ARTIFACT_DIR để lưu kết quả theo nội dung (dedupe + manifest run/scene/node),
+    # ARTIFACT_MAX_BYTES để giới hạn dung lượng (xóa artifact ít dùng nhất).
+    artifact_dir = os.getenv("ARTIFACT_DIR")
+    if not artifact_dir:
+        return None
+    max_bytes = os.getenv("ARTIFACT_MAX_BYTES")
+    return ArtifactStore(artifact_dir, max_bytes=int(max_bytes) if max_bytes else None)
+
+
+async def run_batch_async(job_file: str, output_file: str, max_concurrency: int, deadline, resume: bool):
+    skip_ids = completed_ids(output_file) if resume else None
+    async with AsyncThucChienAIBot(api_key=os.getenv("THUC_CHIEN_API_KEY"), cache=_response_cache()) as bot:
+        return await run_batch(
+            load_jobs(job_file),
+            output_file,
+            RunnableConfig(configurable={"bot": bot, "artifact_store": _artifact_store()}),
+            max_concurrency=max_concurrency,
+            deadline=deadline,
+            skip_ids=skip_ids,
         )
-        result = app.invoke(state, config)
-        print(result)
-
-    # if decision == "text2text":
-    #     state = State(
-    #         t2t_question=plan
-    #     )
-    # elif decision == "text2img":
-    #     state = State(
-    #         t2i_question=content,
-    #         t2i_aspect_ratio="3:4",
-    #         t2i_size="2480x3508",
-    #         t2i_output_path="output/image.jpg"
-    #     )
-    # elif decision == "textimg2img":
-    #     state = State(
-    #         ti2i_image_paths=["output/images/generated_image_1761386492_1.png"],
-    #         ti2i_question="The cat jump out of the chair",
-    #         ti2i_aspect_ratio="3:4",
-    #         ti2i_output_path="path/to/image1.jpg"
-    #     )
-    # elif decision == "textimg2text":
-    #     state = State(
-    #         ti2t_question="Describe the image",
-    #         ti2t_image_path="path/to/image.jpg"
-    #         )
-    # else:
-    #     raise ValueError(f"Invalid decision: {decision}")
-
-    
-    result = app.invoke(state, config)
-    print(result)
 
 
+async def render_storyboard_async(scenario_file: str, reference_image: str, max_in_flight: int, story_file=None):
+    cache = _response_cache()
+    # Đặt RUN_ID để chạy lại một storyboard bị lỗi giữa chừng mà chỉ render các scene chưa xong.
+    run_id = os.getenv("RUN_ID")
+    checkpointer = SqliteCheckpointer(os.getenv("CHECKPOINT_DB", DEFAULT_CHECKPOINT_DB)) if run_id else None
+    async with AsyncThucChienAIBot(api_key=os.getenv("THUC_CHIEN_API_KEY"), cache=cache) as bot:
+        config = RunnableConfig(configurable={"bot": bot, "artifact_store": _artifact_store()})
+        if story_file:
+            # Scene 1 bắt đầu render trong khi model còn đang viết các scene sau.
+            scenarios = stream_scenarios(bot, image_scenario_messages(load_scenarios(story_file)), save_to=scenario_file)
+            return await render_storyboard_stream(
+                scenarios,
+                reference_image,
+                config,
+                max_in_flight=max_in_flight,
+                run_id=run_id,
+                checkpointer=checkpointer,
+            )
+        return await render_storyboard(
+            scenario_file,
+            reference_image,
+            config,
+            max_in_flight=max_in_flight,
+            run_id=run_id,
+            checkpointer=checkpointer,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,395 @@
+# File: src/bench/benchmark.py
+
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+
+# Ảnh đầu vào cho kịch bản edit: kích thước (byte) của mỗi ảnh tham chiếu.
+DEFAULT_INPUT_IMAGE_BYTES = 1_000_000
+
+# Profile của mock server khi benchmark: video "render" 1 giây để kịch bản video có polling thật.
+BENCH_PROFILE: Dict[str, Any] = {"video_submit": {"video_seconds": 1.0}}
+
+# Model giả cho các node (chúng đọc tên model từ biến môi trường).
+BENCH_MODELS = {
+   "TEXT_MODEL_NAME": "gemini-2.5-flash",
+   "IMAGE_MODEL_NAME": "imagen-4",
+   "MULTIMODAL_MODEL_NAME": "gemini-2.5-flash-image-preview",
+   "VIDEO_MODEL_NAME": "veo-3.0-generate-001",
+   "TTS_MODEL_NAME": "gemini-2.5-flash-preview-tts",
+}
+
+
+def _text_state(i: int, inputs: List[str]) -> Dict[str, Any]:
+   return {"t2t_question": f"Benchmark question {i}: describe a detective in three sentences."}
+
+
+def _image_state(i: int, inputs: List[str]) -> Dict[str, Any]:
+   return {"t2i_question": f"Benchmark image {i}: a detective in a rainy street", "t2i_aspect_ratio": "3:4"}
+
+
+def _edit_state(i: int, inputs: List[str]) -> Dict[str, Any]:
+   return {
+       "ti2i_question": f"Benchmark edit {i}: put the character in a library",
+       "ti2i_image_paths": inputs,
+       "ti2i_output_path": f"output/bench/edit_{i}.png",
+   }
+
+
+def _video_state(i: int, inputs: List[str]) -> Dict[str, Any]:
+   return {"t2v_question": f"Benchmark video {i}: a detective walks away", "t2v_output_path": f"output/bench/video_{i}.mp4"}
+
+
+def _tts_state(i: int, inputs: List[str]) -> Dict[str, Any]:
+   return {"t2s_question": f"Benchmark speech {i}: xin chào", "t2s_output_path": f"output/bench/speech_{i}.mp3"}
+
+
+# modality -> (graph của build_graph, hàm tạo state cho lần chạy thứ i).
+MODALITIES: Dict[str, Any] = {
+   "text": ("text2text", _text_state),
+   "image": ("text2img", _image_state),
+   "edit": ("textimg2img", _edit_state),
+   "video": ("text2vid", _video_state),
+   "tts": ("text2voice", _tts_state),
+}
+
+# Pipeline nhiều bước (build_story_flow) được đo như một modality riêng.
+STORY = "story"
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+   """p50/p95/p99 (nearest-rank), mean và max của các mẫu latency."""
+   if not samples:
+       return {}
+   ordered = sorted(samples)
+
+   def rank(q: float) -> float:
+       return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+   return {
+       "p50": rank(0.50),
+       "p95": rank(0.95),
+       "p99": rank(0.99),
+       "mean": statistics.fmean(ordered),
+       "max": ordered[-1],
+   }
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+   """Đọc một trường (kB) của /proc/self/status, đổi ra MB; None nếu không có (không phải Linux)."""
+   try:
+       with open("/proc/self/status", "r") as f:
+           for line in f:
+               if line.startswith(f"{field}:"):
+                   return int(line.split()[1]) / 1024
+   except OSError:
+       pass
+   return None
+
+
+def _rss_mb() -> float:
+   return _proc_status_mb("VmRSS") or 0.0
+
+
+def _peak_rss_mb() -> float:
+   # VmHWM chỉ tính process hiện tại; ru_maxrss trên Linux còn giữ RSS của process cha lúc fork.
+   peak = _proc_status_mb("VmHWM")
+   if peak is not None:
+       return peak
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   # ru_maxrss là KB trên Linux, byte trên macOS.
+   return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def _succeeded(modality: str, result: Dict[str, Any]) -> bool:
+   """Kiểm tra kết quả của graph: node lưu đường dẫn file (hoặc câu trả lời) khi thành công."""
+   if modality == "text":
+       return bool(result.get("t2t_answer"))
+   if modality == "image":
+       path = result.get("t2i_output_path")
+       return isinstance(path, (str, list)) and all(os.path.exists(p) for p in ([path] if isinstance(path, str) else path))
+   if modality == "edit":
+       path = result.get("ti2i_output_path")
+       return isinstance(path, list) and all(os.path.exists(p) for p in path)
+   if modality == "video":
+       return os.path.exists(str(result.get("t2v_output_path")))
+   if modality == "tts":
+       return os.path.exists(str(result.get("t2s_output_path")))
+   if modality == STORY:
+       return bool(result.get("final_outputs"))
+   return True
+
+
+def _make_inputs(count: int, size: int) -> List[str]:
+   os.makedirs("output/bench/inputs", exist_ok=True)
+   paths = []
+   for i in range(count):
+       path = f"output/bench/inputs/reference_{i}.png"
+       with open(path, "wb") as f:
+           f.write(os.urandom(size))
+       paths.append(path)
+   return paths
+
+
+def _run_sync(modality: str, requests: int, concurrency: int, base_url: str,
+              inputs: List[str], poll_interval: float) -> List[Dict[str, Any]]:
+   from src.graph.builder import build_graph
+   from src.model.bot import ThucChienAIBot
+   from src.model.video_poller import VideoOperationPoller
+
+   bot = ThucChienAIBot("bench-key", base_url=base_url)
+   bot._video_poller = VideoOperationPoller(bot, initial_interval=poll_interval, max_interval=max(poll_interval, 1.0))
+   if modality == STORY:
+       from src.graph.story_flow import build_story_flow
+       app = build_story_flow()
+       make_state: Callable[[int, List[str]], Dict[str, Any]] = lambda i, paths: {}
+   else:
+       graph, make_state = MODALITIES[modality]
+       app = build_graph(graph)
+   config = RunnableConfig(configurable={"bot": bot}, max_concurrency=concurrency)
+
+   def one(i: int) -> Dict[str, Any]:
+       started = time.perf_counter()
+       try:
+           ok = _succeeded(modality, app.invoke(make_state(i, inputs), config))
+       except Exception:
+           ok = False
+       return {"latency": time.perf_counter() - started, "ok": ok}
+
+   try:
+       with ThreadPoolExecutor(max_workers=concurrency) as pool:
+           return list(pool.map(one, range(requests)))
+   finally:
+       bot.video_poller.close()
+
+
+def _run_async(modality: str, requests: int, concurrency: int, base_url: str,
+               inputs: List[str], poll_interval: float) -> List[Dict[str, Any]]:
+   from src.graph.builder import build_graph
+   from src.model.async_bot import AsyncThucChienAIBot
+
+   if modality == STORY:
+       raise ValueError("Story flow chỉ hỗ trợ client đồng bộ.")
+   graph, make_state = MODALITIES[modality]
+   app = build_graph(graph)
+
+   async def main() -> List[Dict[str, Any]]:
+       semaphore = asyncio.Semaphore(concurrency)
+       async with AsyncThucChienAIBot("bench-key", base_url=base_url, video_poll_interval=poll_interval) as bot:
+           config = RunnableConfig(configurable={"bot": bot})
+
+           async def one(i: int) -> Dict[str, Any]:
+               async with semaphore:
+                   started = time.perf_counter()
+                   try:
+                       ok = _succeeded(modality, await app.ainvoke(make_state(i, inputs), config))
+                   except Exception:
+                       ok = False
+                   return {"latency": time.perf_counter() - started, "ok": ok}
+
+           return await asyncio.gather(*(one(i) for i in range(requests)))
+
+   return asyncio.run(main())
+
+
+def _scenario(modality: str, client: str, requests: int, concurrency: int, base_url: str,
+              workdir: str, input_images: int, input_image_bytes: int, poll_interval: float) -> Dict[str, Any]:
+   """Chạy một kịch bản trong process hiện tại (process con riêng cho mỗi kịch bản) và trả số liệu."""
+   from src.model.log import configure_logging
+   from src.model.metrics import METRICS
+
+   os.chdir(workdir)
+   os.environ.update(BENCH_MODELS)
+   configure_logging(level=os.getenv("BENCH_LOG_LEVEL", "ERROR"), force=True)
+   inputs = _make_inputs(input_images, input_image_bytes) if modality in ("edit", STORY) else []
+   if modality == STORY:
+       # build_story_flow dùng ảnh nhân vật có sẵn ở đường dẫn cố định.
+       os.makedirs("output/images", exist_ok=True)
+       shutil.copyfile(inputs[0], "output/images/generated_image_1761237726_1.png")
+
+   baseline_rss = _rss_mb()
+   cpu_started = time.process_time()
+   started = time.perf_counter()
+   runner = _run_async if client == "async" else _run_sync
+   samples = runner(modality, requests, concurrency, base_url, inputs, poll_interval)
+   wall = time.perf_counter() - started
+   cpu = time.process_time() - cpu_started
+
+   latencies = [sample["latency"] for sample in samples]
+   return {
+       "modality": modality,
+       "client": client,
+       "requests": requests,
+       "concurrency": concurrency,
+       "errors": sum(1 for sample in samples if not sample["ok"]),
+       "wall_seconds": wall,
+       "rps": requests / wall if wall else 0.0,
+       "latency_seconds": _percentiles(latencies),
+       "cpu_seconds_per_request": cpu / requests if requests else 0.0,
+       "baseline_rss_mb": baseline_rss,
+       "peak_rss_mb": _peak_rss_mb(),
+       "metrics": METRICS.snapshot(),
+   }
+
+
+def _scenario_entry(queue: "multiprocessing.Queue", kwargs: Dict[str, Any]) -> None:
+   try:
+       queue.put(_scenario(**kwargs))
+   except Exception as e:
+       queue.put({"modality": kwargs["modality"], "client": kwargs["client"], "error": f"{type(e).__name__}: {e}"})
+
+
+def run_scenario_isolated(**kwargs: Any) -> Dict[str, Any]:
+   """
+   Chạy _scenario trong một process mới (spawn) để peak RSS và CPU time chỉ tính cho kịch bản đó,
+   không lẫn với mock server hay các kịch bản trước.
+   """
+   context = multiprocessing.get_context("spawn")
+   queue = context.Queue()
+   process = context.Process(target=_scenario_entry, args=(queue, kwargs))
+   process.start()
+   result = queue.get()
+   process.join()
+   return result
+
+
+def _git_commit() -> Optional[str]:
+   try:
+       return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+       return None
+
+
+def run_benchmarks(
+   modalities: List[str],
+   clients: List[str],
+   requests: int,
+   concurrency: int,
+   base_url: Optional[str] = None,
+   profile: Optional[Dict[str, Any]] = None,
+   seed: int = 0,
+   latency_scale: float = 1.0,
+   input_images: int = 2,
+   input_image_bytes: int = DEFAULT_INPUT_IMAGE_BYTES,
+   poll_interval: float = 0.25
+) -> Dict[str, Any]:
+   """
+   Chạy các kịch bản benchmark và trả về kết quả (dạng dict, ghi được ra JSON).
+
+   Không truyền base_url thì một MockServer (src/mock/server.py) được khởi động với profile/seed/latency_scale.
+   Mỗi (modality, client) chạy trong process riêng, trong một thư mục làm việc tạm.
+   """
+   from src.mock.server import MockServer, merge_profile
+
+   profile = merge_profile(BENCH_PROFILE, profile)
+   server = None
+   if base_url is None:
+       server = MockServer(profile=profile, seed=seed, latency_scale=latency_scale).start()
+       base_url = server.url
+
+   workdir = tempfile.mkdtemp(prefix="thucchien-bench-")
+   results = []
+   try:
+       for modality in modalities:
+           for client in clients:
+               if modality == STORY and client == "async":
+                   continue
+               result = run_scenario_isolated(
+                   modality=modality, client=client, requests=requests, concurrency=concurrency,
+                   base_url=base_url, workdir=workdir, input_images=input_images,
+                   input_image_bytes=input_image_bytes, poll_interval=poll_interval,
+               )
+               results.append(result)
+               if "error" in result:
+                   print(f"{modality:6s} {client:5s} FAILED: {result['error']}")
+               else:
+                   latency = result["latency_seconds"]
+                   print(
+                       f"{modality:6s} {client:5s} {result['rps']:8.1f} req/s  "
+                       f"p50 {latency['p50'] * 1000:8.1f}ms  p95 {latency['p95'] * 1000:8.1f}ms  "
+                       f"p99 {latency['p99'] * 1000:8.1f}ms  cpu/req {result['cpu_seconds_per_request'] * 1000:7.2f}ms  "
+                       f"peak RSS {result['peak_rss_mb']:7.1f}MB  errors {result['errors']}"
+                   )
+   finally:
+       mock_stats = server.state.stats() if server else None
+       if server is not None:
+           server.stop()
+       shutil.rmtree(workdir, ignore_errors=True)
+
+   return {
+       "meta": {
+           "timestamp": time.time(),
+           "git_commit": _git_commit(),
+           "python": platform.python_version(),
+           "platform": platform.platform(),
+           "cpu_count": os.cpu_count(),
+           "requests": requests,
+           "concurrency": concurrency,
+           "latency_scale": latency_scale,
+           "seed": seed,
+           "base_url": None if server else base_url,
+           "profile": profile if server else None,
+           "mock_stats": mock_stats,
+       },
+       "results": results,
+   }
+
+
+def main() -> None:
+   parser = argparse.ArgumentParser(description="Benchmark ThucChienAIBot và các graph trên mock server.")
+   parser.add_argument("--modalities", default="text,image,edit,video,tts",
+                       help=f"Danh sách modality, chọn trong: {', '.join(list(MODALITIES) + [STORY])}.")
+   parser.add_argument("--clients", default="sync,async", help="sync, async hoặc cả hai.")
+   parser.add_argument("--requests", type=int, default=50, help="Số lần chạy graph cho mỗi kịch bản.")
+   parser.add_argument("--concurrency", type=int, default=8)
+   parser.add_argument("--latency-scale", type=float, default=0.1, help="Nhân latency của mock server (0 = chỉ đo client).")
+   parser.add_argument("--seed", type=int, default=0)
+   parser.add_argument("--profile", help="File JSON ghi đè profile của mock server.")
+   parser.add_argument("--base-url", help="Dùng server có sẵn thay vì khởi động mock server.")
+   parser.add_argument("--input-images", type=int, default=2, help="Số ảnh đầu vào cho kịch bản edit.")
+   parser.add_argument("--input-image-bytes", type=int, default=DEFAULT_INPUT_IMAGE_BYTES)
+   parser.add_argument("--output", default="output/bench/results.json", help="File JSON kết quả.")
+   args = parser.parse_args()
+
+   profile = None
+   if args.profile:
+       with open(args.profile, "r", encoding="utf-8") as f:
+           profile = json.load(f)
+
+   report = run_benchmarks(
+       modalities=[m.strip() for m in args.modalities.split(",") if m.strip()],
+       clients=[c.strip() for c in args.clients.split(",") if c.strip()],
+       requests=args.requests,
+       concurrency=args.concurrency,
+       base_url=args.base_url,
+       profile=profile,
+       seed=args.seed,
+       latency_scale=args.latency_scale,
+       input_images=args.input_images,
+       input_image_bytes=args.input_image_bytes,
+   )
+   directory = os.path.dirname(args.output)
+   if directory:
+       os.makedirs(directory, exist_ok=True)
+   with open(args.output, "w", encoding="utf-8") as f:
+       json.dump(report, f, ensure_ascii=False, indent=2)
+   print(f"Kết quả đã được ghi vào {args.output}")
+
+
+if __name__ == "__main__":
+   main()
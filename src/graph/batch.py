@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+
+from src.graph.builder import NODES, build_graph
+from src.graph.state import State
+from src.model.log import get_logger, log_context
+
+
+logger = get_logger(__name__)
+
+
+# Keys of a job that are not State fields.
+JOB_KEYS = ("id", "deadline")
+
+# State fields written by the nodes; these are copied to the result record.
+OUTPUT_KEYS = (
+    "t2t_answer",
+    "t2i_output_path",
+    "t2v_output_path",
+    "t2v_operation_name",
+    "t2s_output_path",
+    "ti2v_output_path",
+    "ti2v_operation_name",
+    "ti2i_output_path",
+    "ti2t_answer",
+)
+
+# Output of each decision: the nodes store an error message in the same field on failure.
+DECISION_OUTPUT = {
+    "text2text": "t2t_answer",
+    "text2img": "t2i_output_path",
+    "text2vid": "t2v_output_path",
+    "text2voice": "t2s_output_path",
+    "text_img2vid": "ti2v_output_path",
+    "textimg2img": "ti2i_output_path",
+    "textimg2text": "ti2t_answer",
+}
+
+_ANSWER_FAILURES = ("Error:", "API call failed", "No text content")
+
+
+def load_jobs(job_file: str) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Yield `(job_id, job, error)` for every job of a JSONL file (one job per line) or of a JSON
+    file holding a list of jobs or `{"jobs": [...]}`.
+
+    JSONL files are read lazily so a file with thousands of jobs is never loaded at once. A job
+    without an "id" gets its 1-based line (or list) number; a line that is not a JSON object is
+    yielded with `job=None` and the parse error.
+    """
+    if job_file.endswith(".json"):
+        with open(job_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        jobs = data["jobs"] if isinstance(data, dict) else data
+        for n, job in enumerate(jobs, 1):
+            yield _job_entry(n, job)
+        return
+
+    with open(job_file, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield str(n), None, f"Invalid JSON: {e}"
+                continue
+            yield _job_entry(n, job)
+
+
+def _job_entry(n: int, job: Any) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+    if not isinstance(job, dict):
+        return str(n), None, "A job must be a JSON object"
+    return str(job.get("id", n)), job, None
+
+
+def job_state(job: Dict[str, Any]) -> State:
+    """Build the graph input from a job: every key except `id`/`deadline` must be a State field."""
+    decision = job.get("decision")
+    if decision not in NODES:
+        raise ValueError(f"Invalid decision: {decision}")
+    unknown = sorted(k for k in job if k not in JOB_KEYS and k not in State.__annotations__)
+    if unknown:
+        raise ValueError(f"Unknown State fields: {', '.join(unknown)}")
+    return State(**{k: v for k, v in job.items() if k not in JOB_KEYS})
+
+
+def job_succeeded(decision: str, result: Dict[str, Any]) -> bool:
+    """A job succeeded when its node stored an answer, or file paths that exist on disk."""
+    output = result.get(DECISION_OUTPUT[decision])
+    if decision in ("text2text", "textimg2text"):
+        return isinstance(output, str) and bool(output) and not output.startswith(_ANSWER_FAILURES)
+    paths = output if isinstance(output, list) else [output]
+    return bool(paths) and all(isinstance(p, str) and os.path.exists(p) for p in paths)
+
+
+def completed_ids(output_file: str) -> Set[str]:
+    """Ids of the jobs already recorded as successful in an output JSONL (used to resume a batch)."""
+    done: Set[str] = set()
+    if not os.path.exists(output_file):
+        return done
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a batch that was killed mid-write.
+                continue
+            if record.get("status") == "success":
+                done.add(str(record["id"]))
+    return done
+
+
+async def run_batch(
+    jobs: Iterable[Tuple[str, Optional[Dict[str, Any]], Optional[str]]],
+    output_file: str,
+    config: RunnableConfig,
+    max_concurrency: int = 4,
+    deadline: Optional[float] = None,
+    skip_ids: Optional[Set[str]] = None,
+    handle_signals: bool = True,
+) -> Dict[str, Any]:
+    """
+    Run jobs (as yielded by `load_jobs`) through the router graph with a pool of workers.
+
+    At most `max_concurrency` jobs are in flight. A result record is appended to `output_file`
+    (JSONL) as soon as each job finishes, so completion order may differ from input order.
+    `deadline` (seconds) bounds each job; a job may override it with its own "deadline" key.
+    Jobs whose id is in `skip_ids` (see `completed_ids`) are not run again.
+
+    With `handle_signals`, the first SIGINT/SIGTERM stops taking new jobs and lets the jobs in
+    flight finish; a second one cancels them. Jobs that were never started are not written, so
+    rerunning with `completed_ids(output_file)` picks them up.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be >= 1")
+
+    app = build_graph()
+    stop = asyncio.Event()
+    queue: "asyncio.Queue[Optional[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]]" = asyncio.Queue(max_concurrency * 2)
+    in_flight: Set[asyncio.Task] = set()
+    counts: Dict[str, int] = {}
+    skip_ids = skip_ids or set()
+
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    out = open(output_file, "a", encoding="utf-8")
+
+    def write(record: Dict[str, Any]) -> None:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+        out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        out.flush()
+
+    def on_signal() -> None:
+        if not stop.is_set():
+            logger.warning("Shutdown requested: draining %d job(s) in flight (signal again to cancel them)", len(in_flight))
+            stop.set()
+        else:
+            logger.warning("Cancelling %d job(s) in flight", len(in_flight))
+            for task in in_flight:
+                task.cancel()
+
+    async def run_job(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"id": job_id, "decision": job.get("decision")}
+        started = time.perf_counter()
+        try:
+            state = job_state(job)
+        except ValueError as e:
+            record.update(status="invalid", error=str(e), elapsed=0.0)
+            return record
+
+        timeout = job.get("deadline", deadline)
+        # The job id labels its outputs in an ArtifactStore manifest (configurable "artifact_store").
+        job_config = {**config, "configurable": {**config.get("configurable", {}), "run_id": job_id}}
+        task = asyncio.ensure_future(app.ainvoke(state, job_config))
+        in_flight.add(task)
+        try:
+            result = await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            record.update(status="timeout", error=f"Deadline of {timeout}s exceeded")
+        except asyncio.CancelledError:
+            record.update(status="cancelled", error="Cancelled during shutdown")
+        except Exception as e:
+            record.update(status="failed", error=f"{type(e).__name__}: {e}")
+        else:
+            outputs = {k: result[k] for k in OUTPUT_KEYS if result.get(k) is not None}
+            if job_succeeded(record["decision"], result):
+                record.update(status="success", error=None)
+            else:
+                record.update(status="failed", error=result.get(DECISION_OUTPUT[record["decision"]]))
+            record["outputs"] = outputs
+        finally:
+            in_flight.discard(task)
+        record["elapsed"] = time.perf_counter() - started
+        return record
+
+    async def worker() -> None:
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            job_id, job, error = entry
+            if stop.is_set():
+                # Not started: left for the next run.
+                continue
+            with log_context(job=job_id):
+                if job is None:
+                    record = {"id": job_id, "decision": None, "status": "invalid", "error": error, "elapsed": 0.0}
+                else:
+                    record = await run_job(job_id, job)
+                level = logging.INFO if record["status"] == "success" else logging.WARNING
+                logger.log(level, "[%s] job %s (%s) - %.1fs", record["status"], job_id, record["decision"], record["elapsed"])
+            record["finished_at"] = time.time()
+            write(record)
+
+    loop = asyncio.get_running_loop()
+    signals = []
+    if handle_signals:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, on_signal)
+                signals.append(sig)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not running in the main thread.
+                pass
+
+    started = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrency)]
+    skipped = 0
+    try:
+        for entry in jobs:
+            if stop.is_set():
+                break
+            if entry[0] in skip_ids:
+                skipped += 1
+                continue
+            await queue.put(entry)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        out.close()
+
+    return {
+        "counts": counts,
+        "skipped": skipped,
+        "interrupted": stop.is_set(),
+        "elapsed": time.perf_counter() - started,
+    }
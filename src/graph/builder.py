@@ -1,49 +1,111 @@
-from src.nodes.text2text import text2text
-from src.nodes.text2img import text2img
-from src.nodes.text2vid import text2vid
-from src.nodes.text2voice import text2voice
-from src.nodes.text_img2vid import text_img2vid
-from src.nodes.textimg2img import text_img2img
-from src.nodes.textimg2text import textimg2text
+from src.nodes.text2text import text2text, atext2text
+from src.nodes.text2img import text2img, atext2img
+from src.nodes.text2vid import text2vid, atext2vid
+from src.nodes.text2voice import text2voice, atext2voice
+from src.nodes.text_img2vid import text_img2vid, atext_img2vid
+from src.nodes.textimg2img import text_img2img, atext_img2img
+from src.nodes.textimg2text import textimg2text, atextimg2text
 from src.graph.state import State
-from langgraph.graph import StateGraph, END
+from src.model.tracing import default_metrics
+from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
+from typing import Any, Dict, Optional
+import functools
+import threading
 
 
-def build_graph(decision: str):
+# Tên node (cũng là giá trị của decision) -> (bản đồng bộ, bản async).
+NODES = {
+    "text2text": (text2text, atext2text),
+    "text2img": (text2img, atext2img),
+    "text2vid": (text2vid, atext2vid),
+    "text2voice": (text2voice, atext2voice),
+    "text_img2vid": (text_img2vid, atext_img2vid),
+    "textimg2img": (text_img2img, atext_img2img),
+    "textimg2text": (textimg2text, atextimg2text),
+}
+
+# Key của graph router trong cache (không trùng với tên node nào).
+ROUTER = "router"
+
+# Graph đã compile (không có checkpointer) được dùng lại giữa các lần gọi (graph compile xong có thể
+# chạy đồng thời). Key: decision hoặc ROUTER.
+_compiled_graphs: Dict[str, object] = {}
+_compile_lock = threading.Lock()
+
+
+def _node(func, afunc):
+    # invoke() chạy bản đồng bộ, ainvoke() chạy bản async (dùng AsyncThucChienAIBot).
+    # Thời gian chạy của mỗi node được ghi vào histogram node_seconds{node} (metrics của bot).
+    name = func.__name__
+
+    @functools.wraps(func)
+    def timed(state, config):
+        with default_metrics(config.get("configurable", {}).get("bot")).timer("node_seconds", node=name):
+            return func(state, config)
+
+    @functools.wraps(afunc)
+    async def atimed(state, config):
+        with default_metrics(config.get("configurable", {}).get("bot")).timer("node_seconds", node=name):
+            return await afunc(state, config)
+
+    return RunnableLambda(timed, atimed, name=name)
+
+
+def _add_nodes(workflow: StateGraph) -> None:
+    for name, (func, afunc) in NODES.items():
+        workflow.add_node(name, _node(func, afunc))
+
+
+def _route(state: State) -> str:
+    decision = state.get("decision")
+    if decision not in NODES:
+        raise ValueError(f"Invalid decision: {decision}")
+    return decision
+
+
+def _compile(decision: str, checkpointer: Any = None):
     workflow = StateGraph(State)
+    _add_nodes(workflow)
+
+    if decision == ROUTER:
+        # Một graph cho mọi loại tác vụ: chọn node theo trường "decision" của state.
+        workflow.add_conditional_edges(START, _route, {name: name for name in NODES})
+        for name in NODES:
+            workflow.add_edge(name, END)
+    else:
+        workflow.set_entry_point(decision)
+        workflow.add_edge(decision, END)
+
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def build_graph(decision: Optional[str] = None, checkpointer: Any = None):
+    """
+    Trả về graph đã compile cho decision (ví dụ "text2img"), compile một lần rồi cache.
+
+    decision=None trả về graph router: state đầu vào cần có "decision" để chọn node,
+    phù hợp cho service chạy lâu, compile một lần khi khởi động.
+    checkpointer (ví dụ SqliteCheckpointer) cho phép chạy lại một run theo thread_id. Graph có
+    checkpointer không được cache: cache sẽ giữ checkpointer (và kết nối SQLite của nó) mãi mãi.
+    """
+    name = ROUTER if decision is None else decision
+    if name != ROUTER and name not in NODES:
+        raise ValueError(f"Invalid decision: {decision}")
+
+    if checkpointer is not None:
+        return _compile(name, checkpointer)
+
+    graph = _compiled_graphs.get(name)
+    if graph is None:
+        with _compile_lock:
+            graph = _compiled_graphs.get(name)
+            if graph is None:
+                graph = _compile(name)
+                _compiled_graphs[name] = graph
+    return graph
+
 
-    workflow.add_node("text2text", text2text)
-    workflow.add_node("text2img", text2img)
-    workflow.add_node("text2vid", text2vid)
-    workflow.add_node("text2voice", text2voice)
-    workflow.add_node("text_img2vid", text_img2vid)
-    workflow.add_node("textimg2img", text_img2img)
-    workflow.add_node("textimg2text", textimg2text)
-  
-    if decision == "text2text":
-        workflow.set_entry_point("text2text")
-        workflow.add_edge("text2text", END)
-    elif decision == "text2img":
-        workflow.set_entry_point("text2img")
-        workflow.add_edge("text2img", END)
-    elif decision == "text2vid":
-        workflow.set_entry_point("text2vid")
-        workflow.add_edge("text2vid", END)
-    elif decision == "text2voice":
-        workflow.set_entry_point("text2voice")
-        workflow.add_edge("text2voice", END)
-    elif decision == "text_img2vid":
-        workflow.set_entry_point("text_img2vid")
-        workflow.add_edge("text_img2vid", END)
-    elif decision == "textimg2img":
-        workflow.set_entry_point("textimg2img")
-        workflow.add_edge("textimg2img", END)
-    elif decision == "textimg2text":
-        workflow.set_entry_point("textimg2text")
-        workflow.add_edge("textimg2text", END)
-    
-    
-    return workflow.compile()
-
-
-    
\ No newline at end of file
+def build_router_graph(checkpointer: Any = None):
+    """Graph router dùng chung cho mọi decision (tương đương build_graph(None))."""
+    return build_graph(None, checkpointer)
@@ -0,0 +1,78 @@
+import time
+from typing import Any, Callable, Dict, List, Mapping, Sequence
+
+from src.model.tracing import default_metrics
+
+
+# stage -> {"start": epoch giây, "end": epoch giây}. Một stage chạy nhiều nhánh (ví dụ render_scene)
+# được ghi với tên "stage[nhánh]".
+StageTimings = Dict[str, Dict[str, float]]
+
+
+def timed_stage(name: str, func: Callable[..., Dict[str, Any]], instance_key: str = None) -> Callable[..., Dict[str, Any]]:
+    """
+    Bọc một node trả về dict cập nhật để ghi thời điểm bắt đầu/kết thúc vào "stage_timings"
+    và thời gian chạy vào histogram node_seconds{node} (metrics của bot trong config).
+
+    instance_key (tùy chọn) là key trong input của node dùng để phân biệt các nhánh song song,
+    ví dụ "scene_step" cho render_scene -> "render_scene[step1]".
+    """
+    def wrapper(state, config):
+        start = time.time()
+        update = func(state, config) or {}
+        end = time.time()
+        label = f"{name}[{state[instance_key]}]" if instance_key else name
+        update["stage_timings"] = {label: {"start": start, "end": end}}
+        default_metrics(config.get("configurable", {}).get("bot")).observe("node_seconds", end - start, node=name)
+        return update
+
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
+
+
+def _instances(timings: StageTimings, stage: str) -> List[str]:
+    return [label for label in timings if label == stage or label.startswith(f"{stage}[")]
+
+
+def critical_path(timings: StageTimings, dependencies: Mapping[str, Sequence[str]], final_stage: str) -> List[Dict[str, Any]]:
+    """
+    Tìm đường găng (critical path) của một lần chạy: đi ngược từ final_stage, mỗi bước chọn
+    dependency kết thúc muộn nhất (chính là dependency đã giữ stage sau phải chờ).
+
+
+    Returns:
+        List[Dict[str, Any]]: Các stage theo thứ tự chạy, mỗi phần tử có stage, start, end, duration.
+    """
+    path = []
+    stage = final_stage
+    labels = _instances(timings, stage)
+    while labels:
+        label = max(labels, key=lambda item: timings[item]["end"])
+        timing = timings[label]
+        path.append({
+            "stage": label,
+            "start": timing["start"],
+            "end": timing["end"],
+            "duration": timing["end"] - timing["start"],
+        })
+        candidates = [dep_label for dep in dependencies.get(stage, ()) for dep_label in _instances(timings, dep)]
+        if not candidates:
+            break
+        label = max(candidates, key=lambda item: timings[item]["end"])
+        stage = label.split("[", 1)[0]
+        labels = [label]
+    path.reverse()
+    return path
+
+
+def format_critical_path(path: List[Dict[str, Any]]) -> str:
+    """Mô tả đường găng dạng text, đánh dấu stage chiếm nhiều thời gian nhất."""
+    if not path:
+        return "Critical path: (không có dữ liệu)"
+    total = path[-1]["end"] - path[0]["start"]
+    dominant = max(path, key=lambda item: item["duration"])
+    lines = [f"Critical path ({total:.2f}s):"]
+    for item in path:
+        marker = "  <-- dominant" if item is dominant else ""
+        lines.append(f"  {item['stage']}: {item['duration']:.2f}s{marker}")
+    return "\n".join(lines)
@@ -1,9 +1,16 @@
 from typing import Annotated, TypedDict, Optional, List, Any
 
 
+def merge_dicts(left: Optional[dict], right: Optional[dict]) -> dict:
+   """Reducer gộp dict do các nhánh chạy song song trả về (scene_images, stage_timings)."""
+   return {**(left or {}), **(right or {})}
+
+
 # State TypedDict including new fields for the subquery workflow
 class State(TypedDict):
+   decision: Optional[str]
    t2t_question: Optional[str]
+   t2t_context: Optional[str]
    t2t_answer: Optional[str]
    t2i_question: Optional[str]
    t2i_output_path: Optional[Any]
@@ -14,6 +21,8 @@ class State(TypedDict):
    t2v_output_path: Optional[Any]
    t2v_aspect_ratio: Optional[str]
    t2v_resolution: Optional[str]
+   t2v_operation_name: Optional[str]
+   t2v_job_id: Optional[str]
    i2t_image_path: Optional[Any]
    i2t_answer: Optional[str]
    ti2v_question: Optional[str]
@@ -22,6 +31,8 @@ class State(TypedDict):
    ti2v_aspect_ratio: Optional[str]
    ti2v_negative_question: Optional[str]
    ti2v_output_path: Optional[Any]
+   ti2v_operation_name: Optional[str]
+   ti2v_job_id: Optional[str]
    ti2i_image_paths: Optional[List]
    ti2i_question: Optional[str]
    ti2i_aspect_ratio: Optional[str]
@@ -29,6 +40,7 @@ class State(TypedDict):
    t2s_question: Optional[str]
    t2s_voice: Optional[str]
    t2s_audio_path: Optional[Any]
+   t2s_output_path: Optional[Any]
    ti2t_question: Optional[str]
    ti2t_image_path: Optional[Any]
    ti2t_answer: Optional[str]
@@ -36,6 +48,7 @@ class State(TypedDict):
    small_story: Optional[str]
    character_image: Optional[str]
    story_plan: Optional[str]
-   scene_images: Optional[List[str]]
+   scene_images: Annotated[Optional[dict], merge_dicts]
    final_outputs: Optional[dict]
-   complete_story: Optional[dict]
\ No newline at end of file
+   complete_story: Optional[dict]
+   stage_timings: Annotated[Optional[dict], merge_dicts]
\ No newline at end of file
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+from src.graph.builder import build_graph
+from src.graph.state import State
+from src.model.chat_stream import JSONItemExtractor
+from src.model.log import get_logger, log_context
+from src.model.transfer import write_file_atomic
+
+
+logger = get_logger(__name__)
+
+
+SCENE_PROMPT = (
+    "With the provided character image, CREATE black and white image for the scene {scene} "
+    "with the following scenario:\n{scenario}"
+)
+
+
+IMAGE_SCENARIO_PROMPT = (
+    "Here are the scenes of a story:\n{scenarios}\n\n"
+    "For every scene, write a prompt for image generation. Keep the scene names and write the prompts in English. "
+    "Answer in JSON format with the following structure:\n{template}\n"
+)
+
+
+def load_scenarios(scenario_file: str) -> List[Dict[str, Any]]:
+    """Read the `scenarios` list from a scenario JSON file (e.g. image_scenario.json)."""
+    with open(scenario_file, "r", encoding="utf-8") as f:
+        return json.load(f)["scenarios"]
+
+
+def image_scenario_messages(story_scenarios: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Chat messages asking the model to turn story scenes (e.g. scenarios.json) into image prompts."""
+    template = {"scenarios": [
+        {"scene": f"Scene {i}", "scenario": f"Prompt for image generation for the scene {i}"}
+        for i in range(1, len(story_scenarios) + 1)
+    ]}
+    prompt = IMAGE_SCENARIO_PROMPT.format(
+        scenarios=json.dumps(story_scenarios, ensure_ascii=False, indent=2),
+        template=json.dumps(template, ensure_ascii=False, indent=4),
+    )
+    return [{"role": "user", "content": prompt}]
+
+
+async def stream_scenarios(
+    bot: Any,
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    save_to: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Request a `{"scenarios": [...]}` answer as a streamed chat completion and yield each
+    scenario object as soon as its closing brace arrives, while the model is still writing
+    the next ones. `bot` must be an AsyncThucChienAIBot.
+
+    With `save_to`, the scenarios received are written there (same format as image_scenario.json)
+    once the answer is complete, so the storyboard can be re-rendered without asking again.
+    Raises RuntimeError if the request fails.
+    """
+    extractor = JSONItemExtractor()
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    def on_delta(text: str) -> None:
+        for item in extractor.feed(text):
+            queue.put_nowait(item)
+
+    request = asyncio.create_task(bot.create_chat_completion(
+        model=model or os.getenv("TEXT_MODEL_NAME"),
+        messages=messages,
+        stream=True,
+        on_delta=on_delta,
+    ))
+    request.add_done_callback(lambda _: queue.put_nowait(None))
+
+    scenarios = []
+    try:
+        while (item := await queue.get()) is not None:
+            if not isinstance(item, dict) or "scene" not in item or "scenario" not in item:
+                logger.warning("Ignoring malformed scenario: %.200s", item)
+                continue
+            scenarios.append(item)
+            yield item
+        response = await request
+    finally:
+        request.cancel()
+    if response is None:
+        raise RuntimeError(f"Scenario generation failed after {len(scenarios)} scenes")
+    if save_to:
+        payload = json.dumps({"scenarios": scenarios}, ensure_ascii=False, indent=4)
+        write_file_atomic(save_to, payload.encode("utf-8"))
+        logger.info("Saved %d generated scenarios to %s", len(scenarios), save_to)
+
+
+async def render_storyboard(
+    scenario_file: str,
+    reference_image: str,
+    config: RunnableConfig,
+    output_dir: str = "output/image",
+    max_in_flight: int = 4,
+    aspect_ratio: str = "3:4",
+    prompt_template: str = SCENE_PROMPT,
+    run_id: Optional[str] = None,
+    checkpointer: Any = None,
+) -> List[Dict[str, Any]]:
+    """
+    Render every scene of a scenario file concurrently with the textimg2img graph.
+
+    At most `max_in_flight` scenes are rendered at the same time. Scene i is always
+    written to `{output_dir}/scene_{i}.png`, and the returned report keeps the
+    scenario order regardless of completion order.
+
+    With a `run_id` and a `checkpointer` (e.g. SqliteCheckpointer), each scene is checkpointed
+    under the thread `{run_id}/scene_{i}`; rerunning the same run_id skips scenes whose image
+    was already saved and only renders the failed or missing ones.
+    """
+    render_scene = _scene_renderer(
+        reference_image, config, output_dir, max_in_flight, aspect_ratio, prompt_template, run_id, checkpointer
+    )
+    scenarios = load_scenarios(scenario_file)
+    return await asyncio.gather(*(render_scene(i, s) for i, s in enumerate(scenarios)))
+
+
+async def render_storyboard_stream(
+    scenarios: AsyncIterator[Dict[str, Any]],
+    reference_image: str,
+    config: RunnableConfig,
+    output_dir: str = "output/image",
+    max_in_flight: int = 4,
+    aspect_ratio: str = "3:4",
+    prompt_template: str = SCENE_PROMPT,
+    run_id: Optional[str] = None,
+    checkpointer: Any = None,
+) -> List[Dict[str, Any]]:
+    """
+    Same as render_storyboard, but scenes come from an async iterator (e.g. stream_scenarios)
+    and scene i starts rendering as soon as it is received instead of after the whole list.
+    """
+    render_scene = _scene_renderer(
+        reference_image, config, output_dir, max_in_flight, aspect_ratio, prompt_template, run_id, checkpointer
+    )
+    tasks: List["asyncio.Task[Dict[str, Any]]"] = []
+    try:
+        async for scenario in scenarios:
+            logger.info("Received scene_%d (%s), rendering it now", len(tasks), scenario["scene"])
+            tasks.append(asyncio.create_task(render_scene(len(tasks), scenario)))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return list(await asyncio.gather(*tasks))
+
+
+def _scene_renderer(
+    reference_image: str,
+    config: RunnableConfig,
+    output_dir: str,
+    max_in_flight: int,
+    aspect_ratio: str,
+    prompt_template: str,
+    run_id: Optional[str],
+    checkpointer: Any,
+) -> Callable[[int, Dict[str, Any]], Awaitable[Dict[str, Any]]]:
+    """Coroutine function rendering scene i; all scenes share one graph and in-flight limit."""
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be >= 1")
+
+    os.makedirs(output_dir, exist_ok=True)
+    app = build_graph("textimg2img", checkpointer if run_id else None)
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def render_scene(i: int, scenario: Dict[str, Any]) -> Dict[str, Any]:
+        # Every log line of this scene (bot retries, node output, ...) carries run_id and scene.
+        with log_context(run_id=run_id, scene=i):
+            return await _render_scene(i, scenario)
+
+    async def _render_scene(i: int, scenario: Dict[str, Any]) -> Dict[str, Any]:
+        output_path = f"{output_dir}/scene_{i}.png"
+        state = State(
+            ti2i_image_paths=[reference_image],
+            ti2i_question=prompt_template.format(scene=scenario["scene"], scenario=scenario["scenario"]),
+            ti2i_aspect_ratio=aspect_ratio,
+            ti2i_output_path=output_path,
+        )
+        report = {"index": i, "scene": scenario["scene"], "output_path": output_path}
+        # run_id/scene label the images recorded in an ArtifactStore manifest (configurable "artifact_store").
+        scene_config = {**config, "configurable": {**config.get("configurable", {}), "run_id": run_id, "scene": i}}
+        if run_id and checkpointer is not None:
+            scene_config["configurable"]["thread_id"] = f"{run_id}/scene_{i}"
+            snapshot = await app.aget_state(scene_config)
+            if _scene_done(snapshot.values):
+                report.update(status="success", error=None, elapsed=0.0, resumed=True)
+                logger.info("[skipped] scene_%d (%s) - already rendered in run %s", i, report["scene"], run_id)
+                return report
+
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await app.ainvoke(state, scene_config)
+            except Exception as e:
+                report.update(status="failed", error=f"{type(e).__name__}: {e}")
+            else:
+                # textimg2img stores a list of saved paths on success, an error/text message otherwise.
+                output = result.get("ti2i_output_path")
+                if _scene_done(result):
+                    report.update(status="success", error=None)
+                else:
+                    report.update(status="failed", error=output)
+            report["elapsed"] = time.perf_counter() - started
+
+        level = logging.INFO if report["status"] == "success" else logging.WARNING
+        logger.log(level, "[%s] scene_%d (%s) - %.1fs", report["status"], i, report["scene"], report["elapsed"])
+        return report
+
+    return render_scene
+
+
+def _scene_done(values: Dict[str, Any]) -> bool:
+    """A scene is done when textimg2img stored a list of saved paths that still exist on disk."""
+    output = (values or {}).get("ti2i_output_path")
+    return isinstance(output, list) and bool(output) and all(os.path.exists(path) for path in output)
+
+
+def summarize(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Count successes/failures of a render_storyboard report."""
+    failed = [r for r in reports if r["status"] != "success"]
+    return {
+        "total": len(reports),
+        "succeeded": len(reports) - len(failed),
+        "failed": [{"index": r["index"], "scene": r["scene"], "error": r["error"]} for r in failed],
+    }
@@ -0,0 +1,762 @@
+# File: src/mock/server.py
+
+
+import argparse
+import base64
+import copy
+import json
+import math
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.model.gemini_files import parse_timestamp
+from src.model.transfer import operation_type
+
+
+# Cấu hình mặc định theo loại thao tác (cùng cách phân loại với timeout: src/model/transfer.py).
+# latency: phân phối thời gian chờ trước khi trả header, dạng {"dist": ..., tham số}:
+#   fixed(value), uniform(low, high), normal(mean, stddev), lognormal(median, sigma), exponential(mean).
+# payload_bytes: kích thước dữ liệu nhị phân trả về (ảnh/audio/video, trước khi mã hóa base64).
+# bandwidth: giới hạn tốc độ gửi body (byte/giây), None = không giới hạn.
+# errors: rate (xác suất trả lỗi HTTP), statuses (chọn ngẫu nhiên), disconnect_rate (ngắt kết nối giữa body).
+# cost: số tiền cộng vào "spend" của /key/info sau mỗi request thành công.
+# file_ttl (upload): số giây file upload lên Files API còn dùng được (server thật: 48 giờ).
+# context (không phải loại thao tác): chi phí/thời gian xử lý prompt theo token cho chat và generateContent
+#   (prefill_per_1k_tokens giây, cost_per_1k_tokens USD); token lấy từ cachedContent chỉ tốn
+#   cached_prefill_ratio thời gian và cached_cost_ratio chi phí. ttl/min_tokens: mặc định của cachedContents.
+# chars_per_second (chat): tốc độ model "viết" câu trả lời; stream=True gửi từng đoạn stream_chunk_chars
+#   ký tự theo tốc độ này (SSE, Transfer-Encoding: chunked), không stream thì chờ viết xong. None = tức thì.
+# max_budget (khóa cấp cao nhất, tùy chọn): trả trong /key/info; khi spend đã chạm mức này,
+#   request có cost bị từ chối với 400 như server thật.
+DEFAULT_PROFILE: Dict[str, Any] = {
+   "chat": {"latency": {"dist": "lognormal", "median": 0.8, "sigma": 0.4}, "response_chars": 1200, "cost": 0.0005,
+            "chars_per_second": None, "stream_chunk_chars": 16},
+   "generate": {"latency": {"dist": "lognormal", "median": 6.0, "sigma": 0.3}, "payload_bytes": 1_500_000, "cost": 0.04},
+   "speech": {"latency": {"dist": "lognormal", "median": 2.0, "sigma": 0.3}, "payload_bytes": 400_000, "cost": 0.01},
+   "video_submit": {"latency": {"dist": "uniform", "low": 0.2, "high": 0.6}, "video_seconds": 30.0, "cost": 0.5},
+   "status": {"latency": {"dist": "uniform", "low": 0.02, "high": 0.1}},
+   "upload": {"latency": {"dist": "uniform", "low": 0.05, "high": 0.2}, "file_ttl": 48 * 3600},
+   "download": {"latency": {"dist": "fixed", "value": 0.1}, "payload_bytes": 8_000_000, "bandwidth": None},
+   "default": {"latency": {"dist": "fixed", "value": 0.05}},
+   "context": {"prefill_per_1k_tokens": 0.02, "cost_per_1k_tokens": 0.0003, "cached_prefill_ratio": 0.1,
+               "cached_cost_ratio": 0.25, "ttl": 3600, "min_tokens": 1024},
+   "errors": {"rate": 0.0, "statuses": [429, 500, 503], "retry_after": 1, "disconnect_rate": 0.0},
+}
+
+# Kích thước khối khi gửi body (và đơn vị điều tiết bandwidth).
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def merge_profile(base: Dict[str, Any], override: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+   """Gộp đệ quy override vào một bản sao của base."""
+   merged = copy.deepcopy(base)
+   for key, value in (override or {}).items():
+       if isinstance(value, dict) and isinstance(merged.get(key), dict):
+           merged[key] = merge_profile(merged[key], value)
+       else:
+           merged[key] = value
+   return merged
+
+
+def sample_latency(spec: Optional[Dict[str, Any]], rng: random.Random) -> float:
+   """Lấy một mẫu thời gian chờ (giây, không âm) từ phân phối spec."""
+   if not spec:
+       return 0.0
+   dist = spec.get("dist", "fixed")
+   if dist == "fixed":
+       value = spec.get("value", 0.0)
+   elif dist == "uniform":
+       value = rng.uniform(spec["low"], spec["high"])
+   elif dist == "normal":
+       value = rng.gauss(spec["mean"], spec["stddev"])
+   elif dist == "lognormal":
+       value = rng.lognormvariate(math.log(spec["median"]), spec["sigma"])
+   elif dist == "exponential":
+       value = rng.expovariate(1.0 / spec["mean"])
+   else:
+       raise ValueError(f"Phân phối latency không hợp lệ: {dist}")
+   return max(0.0, value)
+
+
+def _filler_text(chars: int) -> str:
+   return ("Lorem ipsum dolor sit amet. " * (chars // 28 + 1))[:chars]
+
+
+def _timestamp(epoch: float) -> str:
+   """Thời điểm RFC 3339 với 9 chữ số thập phân như các API Google."""
+   return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch)) + f".{int(epoch % 1 * 1e9):09d}Z"
+
+
+def _json_answer(prompt: str) -> Optional[str]:
+   """
+   Prompt yêu cầu JSON và có kèm mẫu JSON (ví dụ kế hoạch step1..stepN của story flow):
+   trả lại chính mẫu đó trong khối ```json``` như model thật, để các bước parse phía sau chạy được.
+   """
+   if "json" not in prompt.lower():
+       return None
+   # Mẫu là object JSON cuối cùng trong prompt (phía trước có thể là dữ liệu đầu vào, vd. danh sách scenario).
+   decoder = json.JSONDecoder()
+   template = None
+   pos = prompt.find("{")
+   while pos >= 0:
+       try:
+           template, end = decoder.raw_decode(prompt, pos)
+       except json.JSONDecodeError:
+           end = pos + 1
+       pos = prompt.find("{", end)
+   if template is None:
+       return None
+   return f"```json\n{json.dumps(template, ensure_ascii=False, indent=2)}\n```"
+
+
+class MockState:
+   """Trạng thái dùng chung của mock server: cấu hình, bộ sinh ngẫu nhiên, tác vụ video, thống kê."""
+
+   def __init__(self, profile: Optional[Dict[str, Any]] = None, seed: Optional[int] = None, latency_scale: float = 1.0):
+       self.profile = merge_profile(DEFAULT_PROFILE, profile)
+       self.latency_scale = latency_scale
+       self.rng = random.Random(seed)
+       self.lock = threading.Lock()
+       self.operations: Dict[str, float] = {}
+       self.requests: Dict[str, int] = {}
+       self.errors: Dict[str, int] = {}
+       self.spend = 0.0
+       # Byte nhận được theo loại thao tác (để so sánh băng thông upload).
+       self.received: Dict[str, int] = {}
+       # id file đã upload -> {"size", "mime", "expires_at"}.
+       self.files: Dict[str, Dict[str, Any]] = {}
+       # id cachedContent -> {"model", "tokens", "created_at", "expires_at"}.
+       self.caches: Dict[str, Dict[str, Any]] = {}
+       # Token prompt đã xử lý (tổng) và phần lấy từ cachedContent.
+       self.tokens = {"prompt": 0, "cached": 0}
+       self._blobs: Dict[int, bytes] = {}
+       self._encoded: Dict[int, str] = {}
+
+
+   def config(self, op: str) -> Dict[str, Any]:
+       return self.profile.get(op) or self.profile["default"]
+
+
+   def latency(self, op: str) -> float:
+       with self.lock:
+           return sample_latency(self.config(op).get("latency"), self.rng) * self.latency_scale
+
+
+   def inject(self, op: str) -> Tuple[Optional[int], bool]:
+       """Quyết định lỗi cho một request: (status lỗi hoặc None, có ngắt kết nối giữa body không)."""
+       errors = merge_profile(self.profile["errors"], self.config(op).get("errors"))
+       with self.lock:
+           status = self.rng.choice(errors["statuses"]) if self.rng.random() < errors["rate"] else None
+           disconnect = status is None and self.rng.random() < errors["disconnect_rate"]
+       return status, disconnect
+
+
+   def blob(self, size: int) -> bytes:
+       """Dữ liệu nhị phân ngẫu nhiên (sinh một lần cho mỗi kích thước)."""
+       with self.lock:
+           if size not in self._blobs:
+               self._blobs[size] = random.Random(size).randbytes(size)
+           return self._blobs[size]
+
+
+   def encoded(self, size: int) -> str:
+       data = self.blob(size)
+       with self.lock:
+           if size not in self._encoded:
+               self._encoded[size] = base64.b64encode(data).decode("ascii")
+           return self._encoded[size]
+
+
+   def record(self, op: str, error: bool = False) -> None:
+       with self.lock:
+           self.requests[op] = self.requests.get(op, 0) + 1
+           if error:
+               self.errors[op] = self.errors.get(op, 0) + 1
+           else:
+               self.spend += self.config(op).get("cost", 0.0)
+
+
+   def prefill(self, prompt_tokens: int, cached_tokens: int = 0) -> float:
+       """Tính phí xử lý prompt_tokens (cached_tokens trong số đó lấy từ cache) và trả về thời gian xử lý."""
+       context = self.profile["context"]
+       fresh = prompt_tokens - cached_tokens
+       with self.lock:
+           self.tokens["prompt"] += prompt_tokens
+           self.tokens["cached"] += cached_tokens
+           self.spend += (fresh + cached_tokens * context["cached_cost_ratio"]) * context["cost_per_1k_tokens"] / 1000
+       seconds = (fresh + cached_tokens * context["cached_prefill_ratio"]) * context["prefill_per_1k_tokens"] / 1000
+       return seconds * self.latency_scale
+
+
+   def stats(self) -> Dict[str, Any]:
+       with self.lock:
+           return {
+               "requests": dict(self.requests),
+               "errors": dict(self.errors),
+               "spend": self.spend,
+               "request_bytes": dict(self.received),
+               "files": len(self.files),
+               "cached_contents": len(self.caches),
+               "tokens": dict(self.tokens),
+           }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+   """Giả lập các endpoint thucchien.ai mà ThucChienAIBot/AsyncThucChienAIBot sử dụng."""
+
+   protocol_version = "HTTP/1.1"
+   server: "MockServer"
+
+
+   def log_message(self, format: str, *args: Any) -> None:
+       pass
+
+
+   # --- Gửi phản hồi ---
+
+   def _send(self, status: int, body: bytes, content_type: str = "application/json",
+             headers: Optional[Dict[str, str]] = None, op: str = "default", disconnect: bool = False) -> None:
+       self.send_response(status)
+       self.send_header("Content-Type", content_type)
+       self.send_header("Content-Length", str(len(body)))
+       for key, value in (headers or {}).items():
+           self.send_header(key, value)
+       self.end_headers()
+       if self.command == "HEAD":
+           return
+
+       # Ngắt kết nối giữa chừng: gửi một nửa body rồi đóng socket.
+       limit = len(body) // 2 if disconnect else len(body)
+       bandwidth = self.server.state.config(op).get("bandwidth")
+       for offset in range(0, limit, WRITE_CHUNK_SIZE):
+           chunk = body[offset:min(offset + WRITE_CHUNK_SIZE, limit)]
+           self.wfile.write(chunk)
+           if bandwidth:
+               time.sleep(len(chunk) / bandwidth)
+       if disconnect:
+           self.wfile.flush()
+           self.connection.shutdown(socket.SHUT_RDWR)
+           self.close_connection = True
+
+
+   def _json(self, status: int, payload: Any, op: str = "default", disconnect: bool = False, headers: Optional[Dict[str, str]] = None) -> None:
+       self._send(status, json.dumps(payload).encode("utf-8"), headers=headers, op=op, disconnect=disconnect)
+
+
+   def _error(self, status: int, message: str, op: str = "default") -> None:
+       headers = {}
+       if status == 429:
+           headers["Retry-After"] = str(self.server.state.profile["errors"].get("retry_after", 1))
+       self._json(status, {"error": {"message": message, "code": status}}, op=op, headers=headers)
+
+
+   # --- Xử lý request ---
+
+   def do_GET(self) -> None:
+       self._handle()
+
+
+   def do_POST(self) -> None:
+       self._handle()
+
+
+   def do_DELETE(self) -> None:
+       self._handle()
+
+
+   def do_PATCH(self) -> None:
+       self._handle()
+
+
+   def _handle(self) -> None:
+       state = self.server.state
+       length = int(self.headers.get("Content-Length") or 0)
+       raw = self.rfile.read(length) if length else b""
+       path = self.path.split("?", 1)[0]
+
+       if path == "/mock/stats":
+           self._json(200, state.stats())
+           return
+
+       op = operation_type(self.command, path)
+       with state.lock:
+           state.received[op] = state.received.get(op, 0) + len(raw)
+       if not self.headers.get("Authorization") and not self.headers.get("x-goog-api-key"):
+           state.record(op, error=True)
+           self._error(401, "Missing API key", op)
+           return
+
+       max_budget = state.profile.get("max_budget")
+       if max_budget is not None and state.config(op).get("cost") and state.stats()["spend"] >= max_budget:
+           state.record(op, error=True)
+           self._error(400, f"Budget has been exceeded! Current cost: {state.stats()['spend']}, Max budget: {max_budget}", op)
+           return
+
+       time.sleep(state.latency(op))
+       status, disconnect = state.inject(op)
+       if status is not None:
+           state.record(op, error=True)
+           self._error(status, f"Injected error {status}", op)
+           return
+
+       try:
+           # Upload Files API: body là nội dung thô của file.
+           data = {"size": len(raw)} if op == "upload" else json.loads(raw) if raw else {}
+       except json.JSONDecodeError:
+           state.record(op, error=True)
+           self._error(400, "Invalid JSON body", op)
+           return
+
+       route = self._route(path)
+       if route is None:
+           state.record(op, error=True)
+           self._error(404, f"Unknown endpoint: {self.command} {path}", op)
+           return
+       state.record(op, error=disconnect)
+       route(path, data, op, disconnect)
+
+
+   def _route(self, path: str):
+       if self.command == "POST":
+           if path == "/chat/completions":
+               return self._chat
+           if path == "/images/generations":
+               return self._images
+           if path == "/audio/speech":
+               return self._speech
+           if path.endswith(":generateContent"):
+               return self._generate_content
+           if path.endswith(":predictLongRunning"):
+               return self._predict_long_running
+           if path == "/gemini/upload/v1beta/files":
+               return self._upload_file
+           if path == "/gemini/v1beta/cachedContents":
+               return self._create_cached_content
+       elif self.command == "DELETE":
+           if path.startswith("/gemini/v1beta/files/"):
+               return self._delete_file
+           if path.startswith("/gemini/v1beta/cachedContents/"):
+               return self._delete_cached_content
+       elif self.command == "PATCH":
+           if path.startswith("/gemini/v1beta/cachedContents/"):
+               return self._update_cached_content
+       else:
+           if path == "/key/info":
+               return self._key_info
+           if path.startswith("/gemini/download/") and path.endswith(":download"):
+               return self._download
+           if "/operations/" in path:
+               return self._operation
+           if path.startswith("/gemini/v1beta/files/"):
+               return self._file
+           if path.startswith("/gemini/v1beta/cachedContents/"):
+               return self._cached_content
+       return None
+
+
+   def _chat(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       chars = self.server.state.config(op).get("response_chars", 1200)
+       prompt_tokens = len(json.dumps(data.get("messages", []))) // 4
+       messages = data.get("messages") or [{}]
+       content = _json_answer(str(messages[-1].get("content", ""))) or _filler_text(chars)
+       time.sleep(self.server.state.prefill(prompt_tokens))
+       completion_tokens = len(content) // 4
+       usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+       chunk = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": data.get("model")}
+       rate = self.server.state.config(op).get("chars_per_second")
+       if data.get("stream"):
+           self._chat_stream(chunk, content, usage if (data.get("stream_options") or {}).get("include_usage") else None, op, disconnect)
+           return
+       if rate:
+           time.sleep(len(content) / rate * self.server.state.latency_scale)
+       self._json(200, {
+           **chunk,
+           "object": "chat.completion",
+           "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+           "usage": usage,
+       }, op=op, disconnect=disconnect)
+
+
+   def _chat_stream(self, chunk: Dict[str, Any], content: str, usage: Optional[Dict[str, Any]], op: str, disconnect: bool) -> None:
+       """Câu trả lời dạng chat.completion.chunk qua SSE, từng đoạn stream_chunk_chars ký tự theo chars_per_second."""
+       config = self.server.state.config(op)
+       size = config.get("stream_chunk_chars", 16)
+       rate = config.get("chars_per_second")
+       interval = size / rate * self.server.state.latency_scale if rate else 0.0
+
+       def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+           return {**chunk, "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+       events = [event({"role": "assistant"})]
+       events += [event({"content": content[i:i + size]}) for i in range(0, len(content), size)]
+       events.append(event({}, "stop"))
+       if usage is not None:
+           events.append({**chunk, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+       self._sse([json.dumps(e, ensure_ascii=False) for e in events] + ["[DONE]"], interval, disconnect)
+
+
+   def _sse(self, events: List[str], interval: float, disconnect: bool) -> None:
+       """Gửi các event text/event-stream bằng Transfer-Encoding: chunked, mỗi event cách nhau interval giây."""
+       self.send_response(200)
+       self.send_header("Content-Type", "text/event-stream")
+       self.send_header("Cache-Control", "no-cache")
+       self.send_header("Transfer-Encoding", "chunked")
+       self.end_headers()
+       # Ngắt kết nối giữa chừng: gửi một nửa số event rồi đóng socket.
+       limit = len(events) // 2 if disconnect else len(events)
+       for i, data in enumerate(events[:limit]):
+           if i and interval:
+               time.sleep(interval)
+           body = f"data: {data}\n\n".encode("utf-8")
+           self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+       if disconnect:
+           self.wfile.flush()
+           self.connection.shutdown(socket.SHUT_RDWR)
+           self.close_connection = True
+           return
+       self.wfile.write(b"0\r\n\r\n")
+
+
+   def _images(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       encoded = self.server.state.encoded(self.server.state.config(op).get("payload_bytes", 1_500_000))
+       self._json(200, {
+           "created": int(time.time()),
+           "data": [{"b64_json": encoded} for _ in range(int(data.get("n") or 1))],
+       }, op=op, disconnect=disconnect)
+
+
+   def _generate_content(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       config = self.server.state.config(op)
+       cached_tokens = 0
+       if data.get("cachedContent"):
+           cache_id = data["cachedContent"].rsplit("/", 1)[-1]
+           cache = self._live_cache(cache_id)
+           if cache is None:
+               # Như server thật: cache hết hạn/không tồn tại trả 403 PERMISSION_DENIED.
+               self._error(403, f"CachedContent not found (or permission denied): {data['cachedContent']}", op)
+               return
+           model = path.rsplit("/", 1)[-1].split(":", 1)[0]
+           if cache["model"] != f"models/{model}":
+               self._error(400, f"Model {model} does not match the model of cached content {cache_id}.", op)
+               return
+           if "systemInstruction" in data:
+               self._error(400, "CachedContent can not be used with GenerateContent request setting system_instruction.", op)
+               return
+           cached_tokens = cache["tokens"]
+       for content in data.get("contents", []):
+           for part in content.get("parts", []):
+               uri = part.get("fileData", {}).get("fileUri")
+               if uri and self._live_file(uri.rsplit("/", 1)[-1]) is None:
+                   # Như server thật: file hết hạn/không tồn tại trả 403 PERMISSION_DENIED.
+                   self._error(403, f"You do not have permission to access the File {uri.rsplit('/', 1)[-1]} or it may not exist.", op)
+                   return
+       generation = data.get("generationConfig", {})
+       if "AUDIO" in generation.get("responseModalities", []):
+           part = {"inlineData": {"mimeType": "audio/L16;rate=24000", "data": self.server.state.encoded(self.server.state.config("speech").get("payload_bytes", 400_000))}}
+       elif "imageConfig" in generation or "image" in path:
+           part = {"inlineData": {"mimeType": "image/png", "data": self.server.state.encoded(config.get("payload_bytes", 1_500_000))}}
+       else:
+           chars = self.server.state.config("chat").get("response_chars", 1200)
+           texts = [p.get("text", "") for c in data.get("contents", []) for p in c.get("parts", [])]
+           part = {"text": (_json_answer(texts[-1]) if texts else None) or _filler_text(chars)}
+       prompt_tokens = len(json.dumps([data.get("systemInstruction"), data.get("contents", [])])) // 4 + cached_tokens
+       time.sleep(self.server.state.prefill(prompt_tokens, cached_tokens))
+       usage = {"promptTokenCount": prompt_tokens}
+       if cached_tokens:
+           usage["cachedContentTokenCount"] = cached_tokens
+       self._json(200, {
+           "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP"}],
+           "usageMetadata": usage,
+       }, op=op, disconnect=disconnect)
+
+
+   def _live_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+       state = self.server.state
+       with state.lock:
+           file = state.files.get(file_id)
+           if file is not None and file["expires_at"] <= time.time():
+               del state.files[file_id]
+               file = None
+       return file
+
+
+   def _file_resource(self, file_id: str, file: Dict[str, Any]) -> Dict[str, Any]:
+       host = self.headers.get("Host", f"127.0.0.1:{self.server.server_port}")
+       return {
+           "name": f"files/{file_id}",
+           "uri": f"http://{host}/gemini/v1beta/files/{file_id}",
+           "mimeType": file["mime"],
+           "sizeBytes": str(file["size"]),
+           "expirationTime": _timestamp(file["expires_at"]),
+           "state": "ACTIVE",
+       }
+
+
+   def _upload_file(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       state = self.server.state
+       file_id = uuid.uuid4().hex[:12]
+       file = {
+           "size": data["size"],
+           "mime": self.headers.get("Content-Type", "application/octet-stream"),
+           "expires_at": time.time() + state.config(op).get("file_ttl", 48 * 3600),
+       }
+       with state.lock:
+           state.files[file_id] = file
+       self._json(200, {"file": self._file_resource(file_id, file)}, op=op, disconnect=disconnect)
+
+
+   def _file(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       file_id = path.rsplit("/", 1)[-1]
+       file = self._live_file(file_id)
+       if file is None:
+           self._error(403, f"You do not have permission to access the File {file_id} or it may not exist.", op)
+           return
+       self._json(200, self._file_resource(file_id, file), op=op, disconnect=disconnect)
+
+
+   def _delete_file(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       with self.server.state.lock:
+           self.server.state.files.pop(path.rsplit("/", 1)[-1], None)
+       self._json(200, {}, op=op, disconnect=disconnect)
+
+
+   # --- cachedContents (context caching) ---
+
+   def _live_cache(self, cache_id: str) -> Optional[Dict[str, Any]]:
+       state = self.server.state
+       with state.lock:
+           cache = state.caches.get(cache_id)
+           if cache is not None and cache["expires_at"] <= time.time():
+               del state.caches[cache_id]
+               cache = None
+           return cache
+
+
+   def _cache_resource(self, cache_id: str, cache: Dict[str, Any]) -> Dict[str, Any]:
+       return {
+           "name": f"cachedContents/{cache_id}",
+           "model": cache["model"],
+           "createTime": _timestamp(cache["created_at"]),
+           "updateTime": _timestamp(cache["updated_at"]),
+           "expireTime": _timestamp(cache["expires_at"]),
+           "usageMetadata": {"totalTokenCount": cache["tokens"]},
+       }
+
+
+   def _cache_ttl(self, data: Dict[str, Any]) -> float:
+       if data.get("expireTime"):
+           return (parse_timestamp(data["expireTime"]) or time.time()) - time.time()
+       if data.get("ttl"):
+           return float(str(data["ttl"]).rstrip("s"))
+       return self.server.state.profile["context"]["ttl"]
+
+
+   def _create_cached_content(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       state = self.server.state
+       context = state.profile["context"]
+       tokens = len(json.dumps([data.get("systemInstruction"), data.get("contents", [])])) // 4
+       if tokens < context["min_tokens"]:
+           self._error(400, f"Cached content is too small. total_token_count={tokens}, min_total_token_count={context['min_tokens']}", op)
+           return
+       # Tạo cache cũng phải xử lý toàn bộ prefix một lần.
+       time.sleep(state.prefill(tokens))
+       now = time.time()
+       cache_id = uuid.uuid4().hex[:12]
+       cache = {"model": data.get("model"), "tokens": tokens, "created_at": now, "updated_at": now,
+                "expires_at": now + self._cache_ttl(data)}
+       with state.lock:
+           state.caches[cache_id] = cache
+       self._json(200, self._cache_resource(cache_id, cache), op=op, disconnect=disconnect)
+
+
+   def _cached_content(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       cache_id = path.rsplit("/", 1)[-1]
+       cache = self._live_cache(cache_id)
+       if cache is None:
+           self._error(403, f"CachedContent not found (or permission denied): cachedContents/{cache_id}", op)
+           return
+       self._json(200, self._cache_resource(cache_id, cache), op=op, disconnect=disconnect)
+
+
+   def _update_cached_content(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       cache_id = path.rsplit("/", 1)[-1]
+       cache = self._live_cache(cache_id)
+       if cache is None:
+           self._error(403, f"CachedContent not found (or permission denied): cachedContents/{cache_id}", op)
+           return
+       now = time.time()
+       with self.server.state.lock:
+           cache["updated_at"] = now
+           cache["expires_at"] = now + self._cache_ttl(data)
+       self._json(200, self._cache_resource(cache_id, cache), op=op, disconnect=disconnect)
+
+
+   def _delete_cached_content(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       with self.server.state.lock:
+           self.server.state.caches.pop(path.rsplit("/", 1)[-1], None)
+       self._json(200, {}, op=op, disconnect=disconnect)
+
+
+   def _predict_long_running(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       state = self.server.state
+       model = path.rsplit("/", 1)[-1].split(":", 1)[0]
+       operation_id = uuid.uuid4().hex[:16]
+       with state.lock:
+           state.operations[operation_id] = time.monotonic() + state.config(op).get("video_seconds", 30.0) * state.latency_scale
+       self._json(200, {"name": f"models/{model}/operations/{operation_id}"}, op=op, disconnect=disconnect)
+
+
+   def _operation(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       state = self.server.state
+       name = path[len("/gemini/v1beta/"):]
+       operation_id = name.rsplit("/", 1)[-1]
+       with state.lock:
+           done_at = state.operations.get(operation_id)
+       if done_at is None:
+           self._error(404, f"Operation {name} not found", op)
+           return
+       if time.monotonic() < done_at:
+           self._json(200, {"name": name, "done": False}, op=op, disconnect=disconnect)
+           return
+       host = self.headers.get("Host", f"127.0.0.1:{self.server.server_port}")
+       uri = f"http://{host}/gemini/download/v1beta/files/{operation_id}:download?alt=media"
+       self._json(200, {
+           "name": name,
+           "done": True,
+           "response": {"generateVideoResponse": {"generatedSamples": [{"video": {"uri": uri}}]}},
+       }, op=op, disconnect=disconnect)
+
+
+   def _download(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       self._binary(self.server.state.blob(self.server.state.config(op).get("payload_bytes", 8_000_000)), "video/mp4", op, disconnect)
+
+
+   def _speech(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       self._binary(self.server.state.blob(self.server.state.config(op).get("payload_bytes", 400_000)), "audio/mpeg", op, disconnect)
+
+
+   def _binary(self, body: bytes, content_type: str, op: str, disconnect: bool) -> None:
+       """Trả file nhị phân, hỗ trợ Range/If-Range để client tải tiếp được sau khi mất kết nối."""
+       etag = f'"{len(body)}"'
+       headers = {"Accept-Ranges": "bytes", "ETag": etag}
+       range_header = self.headers.get("Range")
+       if_range = self.headers.get("If-Range")
+       if range_header and range_header.startswith("bytes=") and (if_range is None or if_range == etag):
+           start = int(range_header[len("bytes="):].split("-", 1)[0] or 0)
+           if start >= len(body):
+               self._send(416, b"", headers={"Content-Range": f"bytes */{len(body)}"}, op=op)
+               return
+           headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+           self._send(206, body[start:], content_type, headers, op, disconnect)
+           return
+       self._send(200, body, content_type, headers, op, disconnect)
+
+
+   def _key_info(self, path: str, data: Dict[str, Any], op: str, disconnect: bool) -> None:
+       state = self.server.state
+       self._json(200, {
+           "key": "sk-mock",
+           "info": {
+               "key_name": "sk-...mock",
+               "spend": state.stats()["spend"],
+               "max_budget": state.profile.get("max_budget"),
+               "models": [],
+           },
+       }, op=op, disconnect=disconnect)
+
+
+class MockServer(ThreadingHTTPServer):
+   """
+   Server giả lập thucchien.ai để benchmark/kiểm thử không tốn budget.
+
+   Dùng trong code:
+       with MockServer(profile={"chat": {"latency": {"dist": "fixed", "value": 0.1}}}, seed=1) as server:
+           bot = ThucChienAIBot("any-key", base_url=server.url)
+
+   Hoặc chạy riêng: python -m src.mock.server --port 8787, rồi đặt THUC_CHIEN_BASE_URL=http://127.0.0.1:8787.
+   """
+
+   daemon_threads = True
+   # Hàng đợi accept đủ lớn cho benchmark nhiều kết nối đồng thời.
+   request_queue_size = 512
+
+
+   def __init__(self, host: str = "127.0.0.1", port: int = 0, profile: Optional[Dict[str, Any]] = None,
+                seed: Optional[int] = None, latency_scale: float = 1.0):
+       """
+       Args:
+           host (str): Địa chỉ lắng nghe.
+           port (int): Cổng; 0 để hệ điều hành chọn cổng trống (xem url).
+           profile (Optional[Dict]): Ghi đè DEFAULT_PROFILE (latency, lỗi, kích thước payload...).
+           seed (Optional[int]): Seed cho latency và lỗi để kết quả lặp lại được.
+           latency_scale (float): Nhân mọi latency (và thời gian render video), ví dụ 0 để chạy nhanh nhất.
+       """
+       super().__init__((host, port), MockHandler)
+       self.state = MockState(profile, seed, latency_scale)
+       self._thread: Optional[threading.Thread] = None
+
+
+   @property
+   def url(self) -> str:
+       host, port = self.server_address[:2]
+       return f"http://{host}:{port}"
+
+
+   def start(self) -> "MockServer":
+       """Chạy server trong một thread nền."""
+       self._thread = threading.Thread(target=self.serve_forever, name="mock-thucchien", daemon=True)
+       self._thread.start()
+       return self
+
+
+   def stop(self) -> None:
+       self.shutdown()
+       self.server_close()
+       if self._thread is not None:
+           self._thread.join()
+
+
+   def __enter__(self) -> "MockServer":
+       return self.start()
+
+
+   def __exit__(self, *exc_info) -> None:
+       self.stop()
+
+
+def main() -> None:
+   parser = argparse.ArgumentParser(description="Mock server cho API thucchien.ai.")
+   parser.add_argument("--host", default="127.0.0.1")
+   parser.add_argument("--port", type=int, default=8787)
+   parser.add_argument("--profile", help="File JSON ghi đè DEFAULT_PROFILE.")
+   parser.add_argument("--seed", type=int, default=None)
+   parser.add_argument("--latency-scale", type=float, default=1.0)
+   parser.add_argument("--error-rate", type=float, default=None, help="Xác suất trả lỗi HTTP cho mọi endpoint.")
+   args = parser.parse_args()
+
+   profile: Dict[str, Any] = {}
+   if args.profile:
+       with open(args.profile, "r", encoding="utf-8") as f:
+           profile = json.load(f)
+   if args.error_rate is not None:
+       profile = merge_profile(profile, {"errors": {"rate": args.error_rate}})
+
+   server = MockServer(args.host, args.port, profile, args.seed, args.latency_scale)
+   print(f"Mock thucchien.ai đang chạy tại {server.url} (Ctrl+C để dừng)")
+   try:
+       server.serve_forever()
+   except KeyboardInterrupt:
+       pass
+   finally:
+       server.server_close()
+
+
+if __name__ == "__main__":
+   main()
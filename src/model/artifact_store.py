@@ -0,0 +1,340 @@
+# File: src/model/artifact_store.py
+
+
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from src.model.log import configure_logging, get_logger
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_ARTIFACT_DIR = "output/artifacts"
+
+# File tạm trong thư mục staging cũ hơn ngưỡng này (giây) được coi là của process đã chết và bị xóa khi gc.
+_STALE_STAGING_SECONDS = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mime TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used);
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT,
+    scene TEXT,
+    node TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    export_path TEXT,
+    elapsed REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_run ON outputs (run_id, scene, node);
+CREATE INDEX IF NOT EXISTS outputs_digest ON outputs (digest);
+"""
+
+
+def unique_output_path(directory: str, prefix: str, ext: str) -> str:
+   """
+   Đường dẫn file kết quả không trùng giữa các lần gọi đồng thời (thay cho `{prefix}_{int(time.time())}`,
+   vốn bị ghi đè khi hai lần gọi rơi vào cùng một giây).
+   """
+   os.makedirs(directory, exist_ok=True)
+   return os.path.join(directory, f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}")
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+   h = hashlib.sha256()
+   with open(path, "rb") as f:
+       for chunk in iter(lambda: f.read(chunk_size), b""):
+           h.update(chunk)
+   return h.hexdigest()
+
+
+def artifact_store(config: Any) -> Optional["ArtifactStore"]:
+   """ArtifactStore của lần chạy (config["configurable"]["artifact_store"]), None nếu không cấu hình."""
+   return ((config or {}).get("configurable") or {}).get("artifact_store")
+
+
+def output_labels(config: Any) -> Dict[str, Any]:
+   """run_id/scene của lần chạy (đặt trong config["configurable"] bởi storyboard/batch) để ghi vào manifest."""
+   configurable = (config or {}).get("configurable") or {}
+   return {"run_id": configurable.get("run_id"), "scene": configurable.get("scene")}
+
+
+class ArtifactStore:
+   """
+   Kho file kết quả (ảnh, audio, video) định danh theo nội dung (content-addressed).
+
+   Mỗi file được lưu một lần tại `blobs/<2 ký tự đầu>/<sha256><ext>` bằng os.replace (atomic), nên
+   các lần gọi đồng thời không ghi đè lên nhau và kết quả trùng nội dung chỉ tốn dung lượng một lần.
+   Manifest SQLite (`manifest.sqlite`) ghi lại node/run/scene đã tạo ra từng artifact cùng kích
+   thước, mime và thời gian xử lý. Với max_bytes, các artifact ít dùng nhất bị xóa (gc) để thư
+   mục không lớn vô hạn trên worker chạy lâu. Có thể dùng chung giữa nhiều process.
+   """
+
+   def __init__(self, root: str = DEFAULT_ARTIFACT_DIR, max_bytes: Optional[int] = None):
+       """
+       Args:
+           root (str): Thư mục gốc của kho (blobs/, staging/, manifest.sqlite).
+           max_bytes (Optional[int]): Dung lượng tối đa của các blob; None để không giới hạn.
+       """
+       self.root = root
+       self.max_bytes = max_bytes
+       self.blob_dir = os.path.join(root, "blobs")
+       # File đang được tải/giải mã; cùng filesystem với blobs/ để os.replace là atomic.
+       self.staging_dir = os.path.join(root, "staging")
+       os.makedirs(self.blob_dir, exist_ok=True)
+       os.makedirs(self.staging_dir, exist_ok=True)
+       self._lock = threading.Lock()
+       self._conn = sqlite3.connect(os.path.join(root, "manifest.sqlite"), check_same_thread=False, isolation_level=None, timeout=30)
+       self._conn.row_factory = sqlite3.Row
+       self._conn.execute("PRAGMA journal_mode=WAL")
+       self._conn.execute("PRAGMA synchronous=NORMAL")
+       self._conn.executescript(_SCHEMA)
+
+
+   def close(self) -> None:
+       with self._lock:
+           self._conn.close()
+
+
+   def __enter__(self) -> "ArtifactStore":
+       return self
+
+
+   def __exit__(self, *exc_info: Any) -> None:
+       self.close()
+
+
+   def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+       with self._lock:
+           return self._conn.execute(sql, params).fetchall()
+
+
+   def staging_path(self, ext: str) -> str:
+       """Đường dẫn tạm (chưa tồn tại) để bot tải kết quả vào trước khi đưa vào kho bằng put_file."""
+       return os.path.join(self.staging_dir, f"{uuid.uuid4().hex}{ext}")
+
+
+   def _blob_path(self, digest: str, ext: str) -> str:
+       return os.path.join(self.blob_dir, digest[:2], digest + ext)
+
+
+   # --- Ghi ---
+
+   def put_file(
+       self,
+       src: str,
+       node: str,
+       run_id: Optional[str] = None,
+       scene: Any = None,
+       mime: Optional[str] = None,
+       elapsed: Optional[float] = None,
+       export_to: Optional[str] = None
+   ) -> str:
+       """
+       Chuyển (move) file src vào kho và ghi một dòng manifest cho node/run/scene.
+
+       Nếu đã có blob cùng nội dung, src chỉ thay thế blob đó (không tốn thêm dung lượng). Với
+       export_to, file còn được liên kết (hard link, hoặc sao chép nếu khác filesystem) tới đường
+       dẫn người dùng yêu cầu, và đường dẫn đó được trả về; ngược lại trả về đường dẫn blob.
+       """
+       digest = file_digest(src)
+       size = os.path.getsize(src)
+       # File staging (vd. ".b64-*.part" của StreamingJSONDecoder) không mang đuôi đúng: ưu tiên mime.
+       ext = (mime and mimetypes.guess_extension(mime)) or os.path.splitext(src)[1] or ".bin"
+       mime = mime or mimetypes.guess_type(src)[0]
+       now = time.time()
+
+       with self._lock:
+           # BEGIN IMMEDIATE: không xen kẽ với gc của process khác (có thể đang xóa đúng blob này).
+           self._conn.execute("BEGIN IMMEDIATE")
+           try:
+               row = self._conn.execute("SELECT path FROM artifacts WHERE digest = ?", (digest,)).fetchone()
+               path = row["path"] if row else self._blob_path(digest, ext)
+               os.makedirs(os.path.dirname(path), exist_ok=True)
+               # File staging được tạo bằng mkstemp (0600).
+               os.chmod(src, 0o644)
+               os.replace(src, path)
+               self._conn.execute(
+                   "INSERT INTO artifacts (digest, path, size, mime, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                   "ON CONFLICT (digest) DO UPDATE SET last_used = excluded.last_used",
+                   (digest, path, size, mime, now, now)
+               )
+               self._conn.execute(
+                   "INSERT INTO outputs (run_id, scene, node, digest, export_path, elapsed, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (run_id, None if scene is None else str(scene), node, digest, export_to, elapsed, now)
+               )
+               if export_to:
+                   self.export(path, export_to)
+               self._conn.execute("COMMIT")
+           except BaseException:
+               self._conn.execute("ROLLBACK")
+               raise
+
+       logger.debug("Artifact %s (%d byte) từ %s: %s", digest[:12], size, node, "mới" if row is None else "trùng nội dung")
+       if self.max_bytes is not None:
+           self.gc(self.max_bytes, keep={digest})
+       return export_to or path
+
+
+   def put_bytes(self, data: bytes, node: str, **labels: Any) -> str:
+       """Như put_file cho dữ liệu đã có trong bộ nhớ."""
+       fd, partial = tempfile.mkstemp(dir=self.staging_dir)
+       try:
+           with os.fdopen(fd, "wb") as f:
+               f.write(data)
+           return self.put_file(partial, node, **labels)
+       except BaseException:
+           if os.path.exists(partial):
+               os.remove(partial)
+           raise
+
+
+   @staticmethod
+   def export(path: str, target: str) -> None:
+       """Đặt một bản của blob tại target (atomic): hard link nếu được, sao chép nếu khác filesystem."""
+       directory = os.path.dirname(target)
+       if directory:
+           os.makedirs(directory, exist_ok=True)
+       partial = f"{target}.{uuid.uuid4().hex[:8]}.part"
+       try:
+           os.link(path, partial)
+       except OSError:
+           shutil.copyfile(path, partial)
+       os.replace(partial, target)
+
+
+   # --- Truy vấn ---
+
+   def outputs(self, run_id: Optional[str] = None, scene: Any = None, node: Optional[str] = None) -> List[Dict[str, Any]]:
+       """Các dòng manifest (kèm path/size/mime của artifact) lọc theo run_id/scene/node, cũ nhất trước."""
+       conditions, params = [], []
+       for column, value in (("o.run_id", run_id), ("o.scene", None if scene is None else str(scene)), ("o.node", node)):
+           if value is not None:
+               conditions.append(f"{column} = ?")
+               params.append(value)
+       where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+       rows = self._query(
+           "SELECT o.run_id, o.scene, o.node, o.digest, o.export_path, o.elapsed, o.created_at, a.path, a.size, a.mime "
+           f"FROM outputs o JOIN artifacts a ON a.digest = o.digest {where} ORDER BY o.id",
+           tuple(params)
+       )
+       return [dict(row) for row in rows]
+
+
+   def stats(self) -> Dict[str, Any]:
+       artifacts = self._query("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM artifacts")[0]
+       outputs = self._query("SELECT COUNT(*) AS n, COALESCE(SUM(a.size), 0) AS bytes FROM outputs o JOIN artifacts a ON a.digest = o.digest")[0]
+       return {
+           "artifacts": artifacts["n"],
+           "bytes": artifacts["bytes"],
+           "outputs": outputs["n"],
+           # Dung lượng tiết kiệm được nhờ dedupe: tổng kích thước các output trừ dung lượng thực tế.
+           "deduplicated_bytes": outputs["bytes"] - artifacts["bytes"],
+           "max_bytes": self.max_bytes,
+       }
+
+
+   # --- Dọn dẹp ---
+
+   def gc(self, max_bytes: Optional[int] = None, keep: Optional[set] = None) -> Dict[str, int]:
+       """
+       Xóa các artifact ít dùng nhất (last_used) cho tới khi tổng dung lượng <= max_bytes (mặc định
+       self.max_bytes), cùng các dòng manifest trỏ tới chúng và file staging bị bỏ dở. File đã
+       export (hard link/bản sao) không bị ảnh hưởng. Trả về số artifact và byte đã xóa.
+       """
+       max_bytes = self.max_bytes if max_bytes is None else max_bytes
+       keep = keep or set()
+       removed = {"artifacts": 0, "bytes": 0}
+       if max_bytes is None:
+           self._clean_staging()
+           return removed
+
+       with self._lock:
+           self._conn.execute("BEGIN IMMEDIATE")
+           try:
+               total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+               victims = []
+               if total > max_bytes:
+                   for row in self._conn.execute("SELECT digest, path, size FROM artifacts ORDER BY last_used"):
+                       if total <= max_bytes:
+                           break
+                       if row["digest"] in keep:
+                           continue
+                       victims.append(row)
+                       total -= row["size"]
+               for row in victims:
+                   self._conn.execute("DELETE FROM outputs WHERE digest = ?", (row["digest"],))
+                   self._conn.execute("DELETE FROM artifacts WHERE digest = ?", (row["digest"],))
+                   try:
+                       os.remove(row["path"])
+                   except OSError:
+                       pass
+                   removed["artifacts"] += 1
+                   removed["bytes"] += row["size"]
+               self._conn.execute("COMMIT")
+           except BaseException:
+               self._conn.execute("ROLLBACK")
+               raise
+
+       if removed["artifacts"]:
+           logger.info("GC artifact: đã xóa %d artifact (%d byte).", removed["artifacts"], removed["bytes"])
+       self._clean_staging()
+       return removed
+
+
+   def _clean_staging(self) -> None:
+       cutoff = time.time() - _STALE_STAGING_SECONDS
+       for name in os.listdir(self.staging_dir):
+           path = os.path.join(self.staging_dir, name)
+           try:
+               if os.path.getmtime(path) < cutoff:
+                   os.remove(path)
+           except OSError:
+               pass
+
+
+def main() -> None:
+   parser = argparse.ArgumentParser(description="Xem manifest và dọn dẹp kho artifact.")
+   parser.add_argument("--root", default=os.getenv("ARTIFACT_DIR", DEFAULT_ARTIFACT_DIR), help="Thư mục gốc của kho.")
+   commands = parser.add_subparsers(dest="command", required=True)
+   ls = commands.add_parser("ls", help="In các dòng manifest (JSONL).")
+   ls.add_argument("--run-id")
+   ls.add_argument("--scene")
+   ls.add_argument("--node")
+   gc = commands.add_parser("gc", help="Xóa artifact ít dùng nhất cho tới khi vừa quota.")
+   gc.add_argument("--max-bytes", type=int, required=True)
+   commands.add_parser("stats", help="In số artifact và dung lượng.")
+   args = parser.parse_args()
+
+   configure_logging()
+   with ArtifactStore(args.root) as store:
+       if args.command == "ls":
+           for row in store.outputs(args.run_id, args.scene, args.node):
+               print(json.dumps(row, ensure_ascii=False))
+       elif args.command == "gc":
+           print(json.dumps(store.gc(args.max_bytes), indent=2))
+       else:
+           print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,936 @@
+# File: src/model/async_bot.py
+
+
+import asyncio
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.model.bot import ThucChienAIBot
+from src.model.budget import CostAccountant
+from src.model.chat_stream import ChatStream, DeltaCallback
+from src.model.context_cache import DEFAULT_CONTEXT_TTL, ContextCacheRegistry, text_content
+from src.model.gemini_files import GeminiFileRegistry, file_part
+from src.model.image_cache import EncodedImageCache
+from src.model.log import get_logger
+from src.model.metrics import METRICS, Metrics
+from src.model.rate_limit import RateLimiter, current_priority, default_priority, estimate_chat_tokens
+from src.model.resilience import Resilience
+from src.model.response_cache import ResponseCache
+from src.model.streaming_body import DEFAULT_CHUNK_SIZE, FileBody, StreamingJSONBody, has_base64_file
+from src.model.streaming_json import StreamingJSONDecoder
+from src.model.transfer import DEFAULT_DOWNLOAD_CHUNK_SIZE, PartialDownload, ProgressCallback, operation_type, resolve_timeouts
+from src.model.video_poller import PollBackoff
+
+
+logger = get_logger(__name__)
+
+
+# Số Task video đã kết thúc được giữ lại cho wait_for_video (như max_finished của VideoOperationPoller).
+MAX_FINISHED_VIDEOS = 256
+
+
+class AsyncThucChienAIBot:
+   """
+   Phiên bản asyncio của ThucChienAIBot.
+   Cung cấp cùng các phương thức (create_chat_completion, generate_image, edit_image_gemini,
+   generate_video, generate_speech, get_key_info, ...) nhưng là coroutine, dùng chung một
+   connection pool keep-alive có giới hạn và giới hạn số request đồng thời trên mỗi host,
+   để một event loop có thể chạy hàng chục tác vụ sinh nội dung cùng lúc.
+   """
+   BASE_URL = ThucChienAIBot.BASE_URL
+
+   # Các node trong src/nodes/ dựa vào cờ này để chọn nhánh async.
+   is_async = True
+
+   # Dùng lại logic đọc và mã hóa ảnh của client đồng bộ.
+   _image_mime_type = ThucChienAIBot._image_mime_type
+   _stream_image_to_base64 = ThucChienAIBot._stream_image_to_base64
+   _file_scope = ThucChienAIBot._file_scope
+   _text_payload = staticmethod(ThucChienAIBot._text_payload)
+
+   # Các bước chung của _make_request: header, cache, ghi nhận lỗi và quyết định gửi lại.
+   _request_headers = ThucChienAIBot._request_headers
+   _request_context = ThucChienAIBot._request_context
+   _cached_response = ThucChienAIBot._cached_response
+   _cache_hit = ThucChienAIBot._cache_hit
+   _cache_result = ThucChienAIBot._cache_result
+   _invalid_response = ThucChienAIBot._invalid_response
+   _http_failure = ThucChienAIBot._http_failure
+   _transport_failure = ThucChienAIBot._transport_failure
+   _retry_delay = ThucChienAIBot._retry_delay
+
+
+   def __init__(
+       self,
+       api_key: str,
+       base_url: Optional[str] = None,
+       max_connections: int = 100,
+       max_keepalive_connections: int = 20,
+       keepalive_expiry: float = 30.0,
+       max_concurrency_per_host: int = 16,
+       timeout: Optional[float] = None,
+       cache: Optional[ResponseCache] = None,
+       image_cache: Optional[EncodedImageCache] = None,
+       resilience: Optional[Resilience] = None,
+       rate_limiter: Optional[RateLimiter] = None,
+       timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+       download_chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+       upload_chunk_size: int = DEFAULT_CHUNK_SIZE,
+       metrics: Optional[Metrics] = None,
+       video_poll_interval: float = 15,
+       budget: Optional[CostAccountant] = None,
+       files: Optional[GeminiFileRegistry] = None,
+       contexts: Optional[ContextCacheRegistry] = None
+   ):
+       """
+       Khởi tạo Bot client bất đồng bộ.
+
+
+       Args:
+           api_key (str): API key của bạn từ thucchien.ai.
+           base_url (Optional[str]): Địa chỉ API; mặc định đọc THUC_CHIEN_BASE_URL, hoặc BASE_URL.
+           max_connections (int): Tổng số kết nối tối đa trong pool.
+           max_keepalive_connections (int): Số kết nối keep-alive được giữ lại để tái sử dụng.
+           keepalive_expiry (float): Thời gian (giây) giữ một kết nối rảnh trước khi đóng.
+           max_concurrency_per_host (int): Số request đồng thời tối đa tới cùng một host.
+           timeout (Optional[float]): Nếu đặt, dùng một timeout (giây) cho mọi request thay cho timeouts.
+           cache (Optional[ResponseCache]): Cache phản hồi trên đĩa, có thể dùng chung với client đồng bộ.
+           image_cache (Optional[EncodedImageCache]): Cache base64 của ảnh đầu vào; mặc định tạo mới (64MB).
+           resilience (Optional[Resilience]): Chính sách retry/circuit breaker, có thể dùng chung với client đồng bộ.
+           rate_limiter (Optional[RateLimiter]): Giới hạn request/token mỗi phút theo model, có thể dùng chung với client đồng bộ.
+           timeouts (Optional[Dict]): (connect, read) timeout theo loại thao tác, như ThucChienAIBot.
+           download_chunk_size (int): Kích thước khối (byte) khi ghi file audio/video tải về.
+           upload_chunk_size (int): Kích thước khối (byte) khi stream ảnh đầu vào; phải là bội số của 3.
+           metrics (Optional[Metrics]): Nơi ghi histogram của mỗi request, có thể dùng chung với client đồng bộ.
+           video_poll_interval (float): Khoảng chờ tối đa (giây) giữa hai lần kiểm tra trạng thái video.
+           budget (Optional[CostAccountant]): Kiểm soát chi tiêu theo /key/info, có thể dùng chung với client đồng bộ.
+           files (Optional[GeminiFileRegistry]): Danh sách file đã upload lên Gemini Files API (upload ảnh một lần),
+               có thể dùng chung với client đồng bộ; mặc định đọc GEMINI_FILE_REGISTRY.
+           contexts (Optional[ContextCacheRegistry]): Danh sách context đã cache phía provider (Gemini cachedContents),
+               có thể dùng chung với client đồng bộ; mặc định đọc GEMINI_CONTEXT_REGISTRY.
+       """
+       if not api_key:
+           raise ValueError("API key không được để trống.")
+       if max_concurrency_per_host < 1:
+           raise ValueError("max_concurrency_per_host phải lớn hơn hoặc bằng 1.")
+       self.api_key = api_key
+       self.BASE_URL = (base_url or os.getenv("THUC_CHIEN_BASE_URL") or self.BASE_URL).rstrip("/")
+       self.max_concurrency_per_host = max_concurrency_per_host
+       self.cache = cache
+       self.image_cache = image_cache if image_cache is not None else EncodedImageCache()
+       self.resilience = resilience if resilience is not None else Resilience()
+       self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.from_env()
+       self.timeout = timeout
+       self.timeouts = resolve_timeouts(timeouts)
+       self.download_chunk_size = download_chunk_size
+       self.upload_chunk_size = upload_chunk_size
+       self.metrics = metrics if metrics is not None else METRICS
+       self.video_poll_interval = video_poll_interval
+       self.budget = budget if budget is not None else CostAccountant.from_env()
+       self.files = files if files is not None else GeminiFileRegistry.from_env()
+       # Key file -> asyncio.Lock: các scene cùng dùng một ảnh tham chiếu chỉ upload một lần.
+       self._upload_locks: Dict[str, asyncio.Lock] = {}
+       self.contexts = contexts if contexts is not None else ContextCacheRegistry.from_env()
+       # Key context -> asyncio.Lock: các request cùng prefix chỉ tạo cache một lần.
+       self._context_locks: Dict[str, asyncio.Lock] = {}
+       self.client = httpx.AsyncClient(
+           limits=httpx.Limits(
+               max_connections=max_connections,
+               max_keepalive_connections=max_keepalive_connections,
+               keepalive_expiry=keepalive_expiry
+           ),
+           timeout=timeout
+       )
+       self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+       # Tên tác vụ -> Task polling/tải video của submit_video.
+       self._video_tasks: Dict[str, asyncio.Task] = {}
+
+
+   async def aclose(self) -> None:
+       """Hủy các tác vụ video chưa xong của submit_video và đóng connection pool."""
+       pending = [task for task in self._video_tasks.values() if not task.done()]
+       for task in pending:
+           task.cancel()
+       if pending:
+           logger.warning("Hủy %d tác vụ video chưa tải xong khi đóng client.", len(pending))
+           await asyncio.gather(*pending, return_exceptions=True)
+       await self.client.aclose()
+
+
+   async def __aenter__(self) -> "AsyncThucChienAIBot":
+       return self
+
+
+   async def __aexit__(self, *exc_info) -> None:
+       await self.aclose()
+
+
+   def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+       """Lấy (hoặc tạo) semaphore giới hạn số request đồng thời cho host của url."""
+       host = urlsplit(url).netloc
+       semaphore = self._host_semaphores.get(host)
+       if semaphore is None:
+           semaphore = asyncio.Semaphore(self.max_concurrency_per_host)
+           self._host_semaphores[host] = semaphore
+       return semaphore
+
+
+   def _timeout_for(self, method: str, endpoint: str) -> httpx.Timeout:
+       """Timeout của httpx cho một request (write dùng chung giá trị read khi upload ảnh)."""
+       if self.timeout is not None:
+           return httpx.Timeout(self.timeout)
+       connect, read = self.timeouts.get(operation_type(method, endpoint), self.timeouts["default"])
+       return httpx.Timeout(read, connect=connect, pool=None)
+
+
+   async def _make_request(
+       self,
+       method: str,
+       endpoint: str,
+       auth_type: str = 'bearer',
+       data: Optional[Dict[str, Any]] = None,
+       output_file: Optional[str] = None,
+       use_cache: bool = True,
+       progress: Optional[ProgressCallback] = None,
+       decode_to: Optional[str] = None,
+       upload: Optional[Tuple[str, str]] = None,
+       chat_stream: Optional[ChatStream] = None
+   ) -> Optional[Dict[str, Any]]:
+       """
+       Phiên bản async của ThucChienAIBot._make_request.
+
+
+       Args:
+           method (str): Phương thức HTTP (ví dụ: 'GET', 'POST').
+           endpoint (str): Endpoint của API (ví dụ: '/chat/completions').
+           auth_type (str): Loại xác thực, 'bearer' hoặc 'google'.
+           data (Optional[Dict]): Dữ liệu payload cho các request POST.
+           output_file (Optional[str]): Đường dẫn để lưu file trả về (cho audio/video).
+           use_cache (bool): Cho phép dùng self.cache (chỉ áp dụng cho request POST).
+           progress (Optional[ProgressCallback]): Hàm báo tiến độ khi tải file (byte đã tải, tổng số byte).
+           decode_to (Optional[str]): Thư mục để giải mã dần các trường base64 ra file, như ThucChienAIBot.
+           upload (Optional[Tuple[str, str]]): (đường dẫn, mime type) của file gửi nguyên dạng làm body, như ThucChienAIBot.
+           chat_stream (Optional[ChatStream]): Đọc phản hồi SSE của chat stream=True, như ThucChienAIBot.
+
+
+       Returns:
+           Optional[Dict[str, Any]]: Dữ liệu JSON từ phản hồi của API hoặc thông tin file đã lưu.
+       """
+       url = f"{self.BASE_URL}{endpoint}"
+       headers = self._request_headers(auth_type, upload)
+       key, model, trace, cache_key = self._request_context(method, endpoint, data, use_cache, output_file)
+       if cache_key:
+           cached = await asyncio.to_thread(self._cached_response, cache_key, output_file, decode_to)
+           if cached is not None:
+               return self._cache_hit(endpoint, trace, cached, chat_stream)
+
+
+       reservation = await self.budget.areserve(model, operation_type(method, endpoint), self._refresh_budget)
+       if reservation is None:
+           trace.finish("budget_exceeded")
+           return None
+       charged = False
+
+       streaming = has_base64_file(data)
+       if upload:
+           trace.request_bytes = len(FileBody(upload[0], self.upload_chunk_size))
+       elif streaming:
+           trace.request_bytes = len(StreamingJSONBody(data, self.upload_chunk_size))
+       elif data is not None:
+           # Tự serialize (giống httpx với json=) để biết kích thước payload.
+           json_body = json.dumps(data, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+           trace.request_bytes = len(json_body)
+       priority = current_priority(default_priority(endpoint))
+       estimated_tokens = estimate_chat_tokens(data)
+       timeout = self._timeout_for(method, endpoint)
+       download = PartialDownload(output_file, method.upper() == "GET", progress) if output_file else None
+       attempt = 0
+       try:
+           while True:
+               attempt += 1
+               if not self.resilience.before_attempt(key):
+                   logger.warning("Circuit breaker đang mở cho %s, từ chối request.", key)
+                   trace.status = trace.status or "circuit_open"
+                   return None
+               # Body dạng stream chỉ đọc được một lần nên được tạo lại cho mỗi lần gửi.
+               if upload:
+                   body = FileBody(upload[0], self.upload_chunk_size)
+                   headers["Content-Length"] = str(len(body))
+                   request_body = {"content": body.aiter_chunks()}
+               elif streaming:
+                   body = StreamingJSONBody(data, self.upload_chunk_size)
+                   headers["Content-Length"] = str(len(body))
+                   request_body = {"content": body.aiter_chunks()}
+               elif data is not None:
+                   request_body = {"content": json_body}
+               else:
+                   request_body = {}
+
+               response = None
+               decoder = None
+               retry_status = None
+               retry_after = None
+               timed_out = False
+               outcome = self.resilience.outcome(key)
+               try:
+                   # Chờ quota của model trước khi chiếm một slot kết nối tới host.
+                   await self.rate_limiter.aacquire(model, estimated_tokens, priority)
+                   async with self._host_semaphore(url):
+                       if download and download.received:
+                           logger.info("Tải tiếp %s từ byte %d...", output_file, download.received)
+                       request = self.client.build_request(
+                           method,
+                           url,
+                           headers={**headers, **download.request_headers()} if download else headers,
+                           timeout=timeout,
+                           extensions={"trace": trace.httpx_hook},
+                           **request_body
+                       )
+                       # Luôn stream để tách thời gian chờ header (ttfb, gồm cả connect) với thời gian nhận body.
+                       with trace.phase("ttfb"):
+                           response = await self.client.send(request, stream=True)
+                       try:
+                           trace.record_attempt(response.status_code)
+                           if response.is_error:
+                               await response.aread()
+                           response.raise_for_status()
+                           charged = True
+                           if download:
+                               if not download.begin(response.status_code, response.headers):
+                                   raise httpx.RemoteProtocolError("Content-Range không khớp với phần đã tải.")
+                               with trace.phase("transfer"):
+                                   async for chunk in response.aiter_bytes(chunk_size=self.download_chunk_size):
+                                       trace.response_bytes += len(chunk)
+                                       with trace.phase("file_write"):
+                                           download.write(chunk)
+                           elif chat_stream is not None:
+                               # Chuyển từng đoạn text cho on_delta ngay khi event SSE tới.
+                               chat_stream.reset()
+                               with trace.phase("transfer"):
+                                   async for chunk in response.aiter_bytes():
+                                       trace.response_bytes += len(chunk)
+                                       with trace.phase("json_decode"):
+                                           chat_stream.feed(chunk)
+                           elif decode_to:
+                               # Giải mã dần các trường base64 ra file thay vì giữ toàn bộ body.
+                               decoder = StreamingJSONDecoder(decode_to)
+                               try:
+                                   with trace.phase("transfer"):
+                                       async for chunk in response.aiter_bytes(chunk_size=self.download_chunk_size):
+                                           trace.response_bytes += len(chunk)
+                                           with trace.phase("json_decode"):
+                                               decoder.feed(chunk)
+                               except BaseException:
+                                   decoder.discard()
+                                   raise
+                           else:
+                               with trace.phase("transfer"):
+                                   content = await response.aread()
+                               trace.response_bytes += len(content)
+                       finally:
+                           await response.aclose()
+
+                   if download:
+                       with trace.phase("file_write"):
+                           download.commit()
+                       outcome.success()
+                       logger.info("File đã được lưu thành công tại: %s", output_file)
+                       result = {"status": "success", "file_path": output_file}
+                       await asyncio.to_thread(self._cache_result, cache_key, output_file, result)
+                       return result
+
+                   outcome.success()
+                   if chat_stream is not None:
+                       with trace.phase("json_decode"):
+                           result = chat_stream.close()
+                       if chat_stream.first_delta_at is not None:
+                           self.metrics.observe("first_token_seconds", chat_stream.first_delta_at - trace.started, **trace.labels)
+                       await asyncio.to_thread(self._cache_result, cache_key, None, result)
+                       return result
+                   if decoder is not None:
+                       if response.status_code == 204 or not trace.response_bytes:
+                           return None
+                       with trace.phase("json_decode"):
+                           result = decoder.close()
+                       await asyncio.to_thread(self._cache_result, cache_key, None, result)
+                       return result
+
+                   if response.status_code == 204 or not content:
+                       return None
+
+                   with trace.phase("json_decode"):
+                       result = response.json()
+                   await asyncio.to_thread(self._cache_result, cache_key, None, result)
+                   return result
+
+
+               except ValueError as e:
+                   # json.JSONDecodeError, StreamingJSONDecoder hoặc ChatStream (file tạm đã được xóa).
+                   self._invalid_response(trace, outcome, e)
+                   return None
+               except httpx.HTTPStatusError as http_err:
+                   retry_status, retry_after = self._http_failure(outcome, http_err, http_err.response)
+               except httpx.HTTPError as req_err:
+                   # Chỉ lỗi kết nối là chắc chắn chưa được server xử lý.
+                   timed_out = response is not None or not isinstance(req_err, (httpx.ConnectError, httpx.ConnectTimeout))
+                   self._transport_failure(trace, outcome, response, req_err)
+               finally:
+                   outcome.close()
+
+               delay = self._retry_delay(method, key, attempt, chat_stream, download, retry_status, retry_after, timed_out)
+               if delay is None:
+                   return None
+               await asyncio.sleep(delay)
+       finally:
+           self.budget.settle(reservation, charged)
+           trace.finish()
+
+
+   async def _refresh_budget(self) -> None:
+       started = time.time()
+       self.budget.reconcile(await self.get_key_info(), started)
+
+
+   # --- Các hàm cho Chat & Image ---
+
+
+   async def create_chat_completion(
+       self,
+       model: str,
+       messages: List[Dict[str, str]],
+       temperature: Optional[float] = None,
+       max_tokens: Optional[int] = None,
+       modalities: Optional[List[str]] = None,
+       stream: bool = False,
+       on_delta: Optional[DeltaCallback] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Tạo phản hồi trò chuyện (Chat Completions). Xem ThucChienAIBot.create_chat_completion."""
+       payload = {"model": model, "messages": messages}
+       if temperature is not None:
+           payload["temperature"] = temperature
+       if max_tokens is not None:
+           payload["max_tokens"] = max_tokens
+       if modalities is not None:
+           payload["modalities"] = modalities
+       if stream:
+           payload["stream"] = True
+           payload["stream_options"] = {"include_usage": True}
+
+       return await self._make_request(
+           "POST", "/chat/completions", data=payload, auth_type='bearer',
+           chat_stream=ChatStream(on_delta) if stream else None
+       )
+
+
+   async def generate_image(
+       self,
+       model: str,
+       prompt: str,
+       n: Optional[int] = 1,
+       aspect_ratio: Optional[str] = None,
+       size: Optional[str] = None,
+       decode_to: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Sinh hình ảnh (Image Generation). Xem ThucChienAIBot.generate_image."""
+       payload = {"model": model, "prompt": prompt}
+       if n is not None:
+           payload["n"] = n
+       if aspect_ratio is not None:
+           payload["aspect_ratio"] = aspect_ratio
+       if size is not None:
+           payload["size"] = size
+
+       return await self._make_request("POST", "/images/generations", data=payload, auth_type='bearer', decode_to=decode_to)
+
+
+   async def generate_image_gemini(
+       self,
+       model: str,
+       prompt: str,
+       aspect_ratio: str = "1:1",
+       decode_to: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Sinh/Sửa hình ảnh với Google Gemini. Xem ThucChienAIBot.generate_image_gemini."""
+       endpoint = f"/gemini/v1beta/models/{model}:generateContent"
+       payload = {
+           "contents": [{"parts": [{"text": prompt}]}],
+           "generationConfig": {
+               "imageConfig": {"aspectRatio": aspect_ratio}
+           }
+       }
+       return await self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
+
+
+   async def edit_image_gemini(
+       self,
+       model: str,
+       prompt: str,
+       image_paths: List[str],
+       aspect_ratio: str = "1:1",
+       decode_to: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Phân tích hoặc chỉnh sửa hình ảnh. Xem ThucChienAIBot.edit_image_gemini."""
+       endpoint = f"/gemini/v1beta/models/{model}:generateContent"
+
+       for _ in range(2):
+           parts = [{"text": prompt}]
+           try:
+               image_parts, uploaded = await self._image_parts(image_paths)
+           except (ValueError, FileNotFoundError) as e:
+               logger.error("Lỗi xử lý ảnh: %s", e)
+               return None
+           parts.extend(image_parts)
+
+           payload = {
+               "contents": [{"parts": parts}],
+               "generationConfig": {
+                   "imageConfig": {"aspectRatio": aspect_ratio}
+               }
+           }
+           result = await self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
+           if result is not None or not await self._drop_stale_files(uploaded):
+               return result
+           logger.info("Gửi lại request với ảnh vừa upload lại.")
+       return result
+
+
+   async def _image_parts(self, image_paths: List[str]) -> Tuple[List[Dict[str, Any]], List[Tuple[str, Dict[str, Any]]]]:
+       """Part cho từng ảnh đầu vào (fileData hoặc inlineData). Xem ThucChienAIBot._image_parts."""
+       parts = []
+       uploaded = []
+       for path in image_paths:
+           logger.debug("Đang xử lý ảnh: %s", path)
+           if self.files is not None:
+               if not os.path.exists(path):
+                   raise FileNotFoundError(f"Không tìm thấy file ảnh tại đường dẫn: {path}")
+               key = await asyncio.to_thread(self.files.key, path, self._file_scope())
+               entry = await self.ensure_file(path, key)
+               if entry is not None:
+                   parts.append(file_part(entry, key))
+                   uploaded.append((key, entry))
+                   continue
+               logger.warning("Không upload được %s, gửi ảnh dạng base64.", path)
+           image_data = self._stream_image_to_base64(path)
+           parts.append({
+               "inlineData": {
+                   "mimeType": image_data["mime_type"],
+                   "data": image_data["data"]
+               }
+           })
+       return parts, uploaded
+
+
+   # --- Gemini Files API ---
+
+   async def upload_file(self, file_path: str, mime_type: Optional[str] = None, max_wait: float = 60.0) -> Optional[Dict[str, Any]]:
+       """Upload một file lên Gemini Files API và chờ nó sẵn sàng. Xem ThucChienAIBot.upload_file."""
+       mime_type = mime_type or self._image_mime_type(file_path)
+       response = await self._make_request(
+           "POST", "/gemini/upload/v1beta/files", auth_type='google', use_cache=False, upload=(file_path, mime_type)
+       )
+       file = (response or {}).get("file")
+       if not file:
+           logger.error("Upload %s thất bại.", file_path)
+           return None
+
+       deadline = time.monotonic() + max_wait
+       while file.get("state") == "PROCESSING" and time.monotonic() < deadline:
+           await asyncio.sleep(1.0)
+           file = await self.get_file(file["name"]) or file
+       if file.get("state") not in (None, "ACTIVE"):
+           logger.error("File %s không sẵn sàng (state: %s).", file["name"], file.get("state"))
+           return None
+       logger.info("Đã upload %s thành %s", file_path, file["name"])
+       return file
+
+
+   async def get_file(self, name: str) -> Optional[Dict[str, Any]]:
+       """Thông tin một file đã upload, None nếu không còn tồn tại."""
+       return await self._make_request("GET", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   async def delete_file(self, name: str) -> None:
+       """Xóa một file đã upload trước khi hết hạn."""
+       await self._make_request("DELETE", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   async def ensure_file(self, file_path: str, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+       """Entry của file_path trong self.files, upload nếu chưa có hoặc sắp hết hạn. Xem ThucChienAIBot.ensure_file."""
+       key = key or await asyncio.to_thread(self.files.key, file_path, self._file_scope())
+       lock = self._upload_locks.setdefault(key, asyncio.Lock())
+       async with lock:
+           entry = self.files.lookup(key)
+           if entry is not None:
+               return entry
+           mime_type = self._image_mime_type(file_path)
+           file = await self.upload_file(file_path, mime_type)
+           if file is None:
+               return None
+           return self.files.register(key, file, mime_type)
+
+
+   async def _drop_stale_files(self, uploaded: List[Tuple[str, Dict[str, Any]]]) -> bool:
+       """Bỏ các file server không còn giữ; True nếu nên gửi lại request. Xem ThucChienAIBot._drop_stale_files."""
+       stale = False
+       for key, entry in uploaded:
+           file = await self.get_file(entry["name"])
+           if file is None or file.get("state") != "ACTIVE":
+               logger.warning("File %s không còn dùng được, sẽ upload lại.", entry["name"])
+               self.files.invalidate(key)
+               stale = True
+       return stale
+
+
+   # --- Gemini context caching (prefix dài dùng chung, cache phía provider) ---
+
+   async def generate_text_gemini(
+       self,
+       model: str,
+       prompt: str,
+       context: Optional[str] = None,
+       system_instruction: Optional[str] = None,
+       temperature: Optional[float] = None,
+       max_tokens: Optional[int] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Sinh văn bản với generateContent, context dài được cache qua self.contexts. Xem ThucChienAIBot.generate_text_gemini."""
+       endpoint = f"/gemini/v1beta/models/{model}:generateContent"
+       generation = {}
+       if temperature is not None:
+           generation["temperature"] = temperature
+       if max_tokens is not None:
+           generation["maxOutputTokens"] = max_tokens
+
+       for _ in range(2):
+           cached = await self._context_cache(model, context, system_instruction) if context else None
+           payload = self._text_payload(prompt, context, system_instruction, cached, generation)
+           result = await self._make_request("POST", endpoint, data=payload, auth_type='google')
+           if result is not None or cached is None or not await self._drop_stale_context(*cached):
+               return result
+           logger.info("Gửi lại request với context cache vừa tạo lại.")
+       return result
+
+
+   async def _context_cache(self, model: str, context: str, system_instruction: Optional[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+       if self.contexts is None or not self.contexts.cacheable(context, system_instruction):
+           return None
+       contents = [text_content(context)]
+       key = self.contexts.key(model, contents, system_instruction, self._file_scope())
+       entry = await self.ensure_cached_content(model, contents, system_instruction, key)
+       if entry is None:
+           logger.warning("Không tạo được context cache, gửi context trong request.")
+           return None
+       return key, entry
+
+
+   async def create_cached_content(
+       self,
+       model: str,
+       contents: List[Dict[str, Any]],
+       system_instruction: Optional[str] = None,
+       ttl: float = DEFAULT_CONTEXT_TTL
+   ) -> Optional[Dict[str, Any]]:
+       """Tạo một cachedContent. Xem ThucChienAIBot.create_cached_content."""
+       payload = {"model": f"models/{model}", "contents": contents, "ttl": f"{ttl:g}s"}
+       if system_instruction:
+           payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+       cached = await self._make_request("POST", "/gemini/v1beta/cachedContents", data=payload, auth_type='google', use_cache=False)
+       if cached is not None:
+           logger.info("Đã tạo context cache %s (%s token)", cached.get("name"), (cached.get("usageMetadata") or {}).get("totalTokenCount"))
+       return cached
+
+
+   async def get_cached_content(self, name: str) -> Optional[Dict[str, Any]]:
+       """Thông tin một cachedContent, None nếu không còn tồn tại."""
+       return await self._make_request("GET", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   async def update_cached_content(self, name: str, ttl: float = DEFAULT_CONTEXT_TTL) -> Optional[Dict[str, Any]]:
+       """Gia hạn một cachedContent thêm ttl giây tính từ bây giờ."""
+       return await self._make_request("PATCH", f"/gemini/v1beta/{name}?updateMask=ttl", data={"ttl": f"{ttl:g}s"}, auth_type='google')
+
+
+   async def delete_cached_content(self, name: str) -> None:
+       """Xóa một cachedContent trước khi hết hạn (ngừng tính phí lưu trữ)."""
+       await self._make_request("DELETE", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   async def ensure_cached_content(
+       self,
+       model: str,
+       contents: List[Dict[str, Any]],
+       system_instruction: Optional[str] = None,
+       key: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Entry của prefix trong self.contexts, tạo hoặc gia hạn khi cần. Xem ThucChienAIBot.ensure_cached_content."""
+       key = key or self.contexts.key(model, contents, system_instruction, self._file_scope())
+       lock = self._context_locks.setdefault(key, asyncio.Lock())
+       async with lock:
+           entry = self.contexts.lookup(key)
+           if entry is not None and self.contexts.needs_refresh(entry):
+               cached = await self.update_cached_content(entry["name"], self.contexts.ttl)
+               if cached is not None:
+                   return self.contexts.register(key, cached, extended=True)
+               self.contexts.invalidate(key)
+               entry = None
+           if entry is not None:
+               return entry
+           cached = await self.create_cached_content(model, contents, system_instruction, self.contexts.ttl)
+           if cached is None:
+               return None
+           return self.contexts.register(key, cached)
+
+
+   async def _drop_stale_context(self, key: str, entry: Dict[str, Any]) -> bool:
+       """Bỏ cache server không còn giữ; True nếu nên gửi lại request. Xem ThucChienAIBot._drop_stale_context."""
+       if await self.get_cached_content(entry["name"]) is not None:
+           return False
+       logger.warning("Context cache %s không còn dùng được, sẽ tạo lại.", entry["name"])
+       self.contexts.invalidate(key)
+       return True
+
+
+   # --- Các hàm cho Video ---
+
+   async def start_video_operation(
+       self,
+       model: str,
+       prompt: str,
+       image_path: Optional[str] = None,
+       negative_prompt: Optional[str] = None,
+       aspect_ratio: Optional[str] = "16:9",
+       resolution: Optional[str] = "720p"
+   ) -> Optional[str]:
+       """Bước 1: Khởi tạo tác vụ sinh video (predictLongRunning), trả về tên tác vụ hoặc None nếu thất bại."""
+       logger.info("Bước 1/3: Bắt đầu tác vụ sinh video...")
+       start_endpoint = f"/gemini/v1beta/models/{model}:predictLongRunning"
+
+       parameters = {}
+       if negative_prompt is not None:
+           parameters["negativePrompt"] = negative_prompt
+       if aspect_ratio is not None:
+           parameters["aspectRatio"] = aspect_ratio
+       if resolution is not None:
+           parameters["resolution"] = resolution
+
+       instance = {"prompt": prompt}
+       if image_path:
+           logger.info("Sử dụng ảnh đầu vào từ: %s", image_path)
+           try:
+               image_data = self._stream_image_to_base64(image_path)
+               instance["image"] = {
+                   "bytesBase64Encoded": image_data["data"],
+                   "mimeType": image_data["mime_type"]
+               }
+           except (ValueError, FileNotFoundError) as e:
+               logger.error("Lỗi xử lý ảnh đầu vào: %s", e)
+               return None
+
+       payload = {"instances": [instance], "parameters": parameters}
+
+       # Tên tác vụ chỉ dùng được một lần nên không cache bước này (xem generate_video).
+       start_response = await self._make_request("POST", start_endpoint, data=payload, auth_type='google', use_cache=False)
+
+       if not start_response or 'name' not in start_response:
+           logger.error("Không thể bắt đầu tác vụ sinh video.")
+           return None
+       operation_name = start_response['name']
+       logger.info("Tác vụ đã bắt đầu. Tên tác vụ: %s", operation_name)
+       return operation_name
+
+
+   async def get_video_operation(self, operation_name: str) -> Optional[Dict[str, Any]]:
+       """Bước 2: Lấy trạng thái hiện tại của một tác vụ sinh video."""
+       return await self._make_request("GET", f"/gemini/v1beta/{operation_name}", auth_type='google')
+
+
+   async def download_video(
+       self,
+       status_response: Dict[str, Any],
+       output_file: str,
+       progress: Optional[ProgressCallback] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Bước 3: Tải video của một tác vụ đã hoàn thành về output_file (tải tiếp bằng Range nếu mất kết nối)."""
+       try:
+           video_uri = status_response['response']['generateVideoResponse']['generatedSamples'][0]['video']['uri']
+           video_id = video_uri.split('/')[-1].split(':')[0]
+       except (KeyError, IndexError, TypeError):
+           logger.error("Không tìm thấy URI video trong phản hồi. Phản hồi đầy đủ từ API: %s", status_response)
+           return None
+       logger.info("Bước 3/3: Tải video với ID: %s", video_id)
+       download_endpoint = f"/gemini/download/v1beta/files/{video_id}:download?alt=media"
+       return await self._make_request("GET", download_endpoint, auth_type='google', output_file=output_file, progress=progress)
+
+
+   async def _follow_video(self, operation_name: str, output_file: str, max_interval: float) -> Optional[Dict[str, Any]]:
+       """Bước 2 và 3 cho một tác vụ đã khởi tạo: polling bằng asyncio.sleep rồi tải video."""
+       logger.info("Bước 2/3: Kiểm tra trạng thái tác vụ (tối đa mỗi %s giây)...", max_interval)
+       # Cùng lịch polling với VideoOperationPoller.
+       schedule = PollBackoff(max_interval)
+       delay = schedule.interval
+       while True:
+           await asyncio.sleep(delay)
+           status_response = await self.get_video_operation(operation_name)
+           if not status_response:
+               if schedule.status_failed():
+                   logger.error("Không thể lấy trạng thái tác vụ %s sau %d lần thử.", operation_name, schedule.status_errors)
+                   return None
+           else:
+               schedule.status_received()
+               if status_response.get('done'):
+                   logger.info("Tác vụ %s đã hoàn thành.", operation_name)
+                   break
+               logger.debug("Tác vụ đang được xử lý, vui lòng chờ...")
+           delay = schedule.next_interval()
+
+       return await self.download_video(status_response, output_file)
+
+
+   async def submit_video(
+       self,
+       output_file: str,
+       model: str,
+       prompt: str,
+       image_path: Optional[str] = None,
+       negative_prompt: Optional[str] = None,
+       aspect_ratio: Optional[str] = "16:9",
+       resolution: Optional[str] = "720p",
+       max_poll_interval: Optional[float] = None
+   ) -> Optional[str]:
+       """
+       Khởi tạo tác vụ sinh video và giao việc polling/tải video cho một asyncio.Task, trả về ngay
+       sau bước 1 (như ThucChienAIBot.submit_video). Task chạy trên event loop hiện tại nên
+       loop phải còn chạy tới khi video được tải xong (xem wait_for_video).
+
+
+       Returns:
+           Optional[str]: Tên tác vụ (dùng với wait_for_video) hoặc None nếu không khởi tạo được.
+       """
+       operation_name = await self.start_video_operation(
+           model=model,
+           prompt=prompt,
+           image_path=image_path,
+           negative_prompt=negative_prompt,
+           aspect_ratio=aspect_ratio,
+           resolution=resolution
+       )
+       if operation_name is None:
+           return None
+       max_interval = self.video_poll_interval if max_poll_interval is None else max_poll_interval
+       self._video_tasks[operation_name] = asyncio.create_task(self._follow_video(operation_name, output_file, max_interval))
+       # Như VideoOperationPoller: chỉ giữ kết quả của vài tác vụ đã kết thúc gần nhất.
+       finished = [name for name, task in self._video_tasks.items() if task.done()]
+       for name in finished[:max(0, len(finished) - MAX_FINISHED_VIDEOS)]:
+           del self._video_tasks[name]
+       return operation_name
+
+
+   async def wait_for_video(self, operation_name: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+       """Chờ một tác vụ đã submit hoàn tất và trả về thông tin file video (None nếu thất bại hoặc hết thời gian)."""
+       task = self._video_tasks.get(operation_name)
+       if task is None:
+           logger.error("Không tìm thấy tác vụ video: %s", operation_name)
+           return None
+       try:
+           # shield: hết thời gian chờ không hủy việc polling/tải video của tác vụ.
+           return await asyncio.wait_for(asyncio.shield(task), timeout)
+       except asyncio.TimeoutError:
+           logger.error("Hết thời gian chờ tác vụ video: %s", operation_name)
+           return None
+
+
+   async def generate_video(
+       self,
+       output_file: str,
+       model: str,
+       prompt: str,
+       image_path: Optional[str] = None,
+       negative_prompt: Optional[str] = None,
+       aspect_ratio: Optional[str] = "16:9",
+       resolution: Optional[str] = "720p",
+       poll_interval: Optional[float] = None
+   ) -> Optional[Dict[str, Any]]:
+       """
+       Sinh video theo quy trình 3 bước như ThucChienAIBot.generate_video, nhưng chờ bằng asyncio.sleep
+       nên không giữ worker trong lúc polling. Khoảng chờ tăng dần như VideoOperationPoller
+       (PollBackoff: tối đa poll_interval giây, mặc định self.video_poll_interval) và chỉ bỏ cuộc
+       sau DEFAULT_MAX_STATUS_ERRORS lần lỗi liên tiếp khi lấy trạng thái.
+       """
+       if poll_interval is None:
+           poll_interval = self.video_poll_interval
+
+       cache_key = None
+       if self.cache is not None:
+           cache_key = self.cache.make_key("POST", f"/gemini/v1beta/models/{model}:predictLongRunning", {
+               "prompt": prompt,
+               "image_sha256": ResponseCache.file_digest(image_path) if image_path and os.path.exists(image_path) else None,
+               "negative_prompt": negative_prompt,
+               "aspect_ratio": aspect_ratio,
+               "resolution": resolution
+           }, output=True)
+           cached = await asyncio.to_thread(self.cache.get_file, cache_key, output_file)
+           if cached is not None:
+               logger.debug("Lấy video từ cache: %s", output_file)
+               return cached
+
+       operation_name = await self.start_video_operation(
+           model=model,
+           prompt=prompt,
+           image_path=image_path,
+           negative_prompt=negative_prompt,
+           aspect_ratio=aspect_ratio,
+           resolution=resolution
+       )
+       if operation_name is None:
+           return None
+
+       result = await self._follow_video(operation_name, output_file, poll_interval)
+       if cache_key and result and result.get("status") == "success":
+           await asyncio.to_thread(self.cache.put_file, cache_key, output_file)
+       return result
+
+   # --- Các hàm cho Audio & Key Info ---
+
+
+   async def generate_speech(
+       self,
+       output_file: str,
+       model: str,
+       input_text: str,
+       voice: str
+   ) -> Optional[Dict[str, Any]]:
+       """Chuyển văn bản thành giọng nói (Text-to-Speech). Xem ThucChienAIBot.generate_speech."""
+       payload = {"model": model, "input": input_text, "voice": voice}
+       return await self._make_request("POST", "/audio/speech", data=payload, auth_type='bearer', output_file=output_file)
+
+
+   async def generate_speech_gemini(
+       self,
+       model: str,
+       prompt: str,
+       voice_name: str,
+       decode_to: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Chuyển văn bản thành giọng nói với Google Gemini. Xem ThucChienAIBot.generate_speech_gemini."""
+       endpoint = f"/gemini/v1beta/models/{model}:generateContent"
+       payload = {
+           "contents": [{"parts": [{"text": prompt}]}],
+           "generationConfig": {
+               "responseModalities": ["AUDIO"],
+               "speechConfig": {
+                   "voiceConfig": {
+                       "prebuiltVoiceConfig": {"voiceName": voice_name}
+                   }
+               }
+           }
+       }
+       return await self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
+
+
+   async def get_key_info(self) -> Optional[Dict[str, Any]]:
+       """Kiểm tra thông tin chi tiêu của API key."""
+       return await self._make_request("GET", "/key/info", auth_type='bearer')
@@ -5,8 +5,28 @@ import requests
 import os
 import time
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
 import base64
+import hashlib
+
+from src.model.budget import CostAccountant
+from src.model.chat_stream import ChatStream, DeltaCallback
+from src.model.context_cache import DEFAULT_CONTEXT_TTL, CachedContentName, ContextCacheRegistry, text_content
+from src.model.gemini_files import GeminiFileRegistry, file_part
+from src.model.image_cache import EncodedImageCache
+from src.model.log import configure_logging, get_logger
+from src.model.metrics import METRICS, Metrics
+from src.model.rate_limit import RateLimiter, current_priority, default_priority, estimate_chat_tokens, request_model
+from src.model.resilience import AttemptOutcome, Resilience, endpoint_key
+from src.model.response_cache import ResponseCache
+from src.model.streaming_body import DEFAULT_CHUNK_SIZE, Base64File, FileBody, StreamingJSONBody, has_base64_file
+from src.model.streaming_json import StreamingJSONDecoder
+from src.model.tracing import RequestTrace, mount_timed_adapter
+from src.model.transfer import DEFAULT_DOWNLOAD_CHUNK_SIZE, PartialDownload, ProgressCallback, operation_type, resolve_timeouts
+from src.model.video_poller import VideoOperationPoller
+
+
+logger = get_logger(__name__)
 
 
 class ThucChienAIBot:
@@ -20,18 +40,63 @@ class ThucChienAIBot:
    BASE_URL = "https://api.thucchien.ai"
 
 
-   def __init__(self, api_key: str):
+   def __init__(
+       self,
+       api_key: str,
+       base_url: Optional[str] = None,
+       cache: Optional[ResponseCache] = None,
+       image_cache: Optional[EncodedImageCache] = None,
+       resilience: Optional[Resilience] = None,
+       rate_limiter: Optional[RateLimiter] = None,
+       timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+       download_chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+       upload_chunk_size: int = DEFAULT_CHUNK_SIZE,
+       metrics: Optional[Metrics] = None,
+       budget: Optional[CostAccountant] = None,
+       files: Optional[GeminiFileRegistry] = None,
+       contexts: Optional[ContextCacheRegistry] = None
+   ):
        """
        Khởi tạo Bot client.
 
 
        Args:
            api_key (str): API key của bạn từ thucchien.ai.
+           base_url (Optional[str]): Địa chỉ API; mặc định đọc THUC_CHIEN_BASE_URL, hoặc BASE_URL.
+               Dùng để trỏ tới mock server (src/mock/server.py) khi benchmark/kiểm thử.
+           cache (Optional[ResponseCache]): Cache phản hồi trên đĩa (tùy chọn) cho các lệnh sinh nội dung.
+           image_cache (Optional[EncodedImageCache]): Cache base64 của ảnh đầu vào; mặc định tạo mới (64MB).
+           resilience (Optional[Resilience]): Chính sách retry/circuit breaker; mặc định dùng Resilience().
+           rate_limiter (Optional[RateLimiter]): Giới hạn request/token mỗi phút theo model; mặc định đọc từ RATE_LIMITS.
+           timeouts (Optional[Dict]): (connect, read) timeout theo loại thao tác, ghi đè DEFAULT_TIMEOUTS
+               trong src/model/transfer.py (ví dụ {"download": (10, 120)}).
+           download_chunk_size (int): Kích thước khối (byte) khi ghi file audio/video tải về.
+           upload_chunk_size (int): Kích thước khối (byte) khi stream ảnh đầu vào; phải là bội số của 3.
+           metrics (Optional[Metrics]): Nơi ghi histogram thời gian/kích thước của mỗi request; mặc định METRICS.
+           budget (Optional[CostAccountant]): Kiểm soát chi tiêu theo /key/info; mặc định đọc THUC_CHIEN_BUDGET.
+           files (Optional[GeminiFileRegistry]): Nếu có, ảnh đầu vào của edit_image_gemini được upload một lần
+               lên Gemini Files API và tham chiếu bằng fileUri; mặc định đọc GEMINI_FILE_REGISTRY.
+           contexts (Optional[ContextCacheRegistry]): Nếu có, context dài của generate_text_gemini được cache
+               phía provider (Gemini cachedContents) và dùng lại; mặc định đọc GEMINI_CONTEXT_REGISTRY.
        """
        if not api_key:
            raise ValueError("API key không được để trống.")
        self.api_key = api_key
+       self.BASE_URL = (base_url or os.getenv("THUC_CHIEN_BASE_URL") or self.BASE_URL).rstrip("/")
        self.session = requests.Session()
+       mount_timed_adapter(self.session)
+       self.cache = cache
+       self.image_cache = image_cache if image_cache is not None else EncodedImageCache()
+       self.resilience = resilience if resilience is not None else Resilience()
+       self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.from_env()
+       self.timeouts = resolve_timeouts(timeouts)
+       self.download_chunk_size = download_chunk_size
+       self.upload_chunk_size = upload_chunk_size
+       self.metrics = metrics if metrics is not None else METRICS
+       self.budget = budget if budget is not None else CostAccountant.from_env()
+       self.files = files if files is not None else GeminiFileRegistry.from_env()
+       self.contexts = contexts if contexts is not None else ContextCacheRegistry.from_env()
+       self._video_poller: Optional[VideoOperationPoller] = None
 
 
    def _make_request(
@@ -40,7 +105,12 @@ class ThucChienAIBot:
        endpoint: str,
        auth_type: str = 'bearer',
        data: Optional[Dict[str, Any]] = None,
-       output_file: Optional[str] = None
+       output_file: Optional[str] = None,
+       use_cache: bool = True,
+       progress: Optional[ProgressCallback] = None,
+       decode_to: Optional[str] = None,
+       upload: Optional[Tuple[str, str]] = None,
+       chat_stream: Optional[ChatStream] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Một phương thức nội bộ để thực hiện các yêu cầu HTTP đến API.
@@ -52,64 +122,323 @@ class ThucChienAIBot:
            auth_type (str): Loại xác thực, 'bearer' hoặc 'google'.
            data (Optional[Dict]): Dữ liệu payload cho các request POST.
            output_file (Optional[str]): Đường dẫn để lưu file trả về (cho audio/video).
+           use_cache (bool): Cho phép dùng self.cache (chỉ áp dụng cho request POST).
+           progress (Optional[ProgressCallback]): Hàm báo tiến độ khi tải file (byte đã tải, tổng số byte).
+           decode_to (Optional[str]): Thư mục để giải mã dần các trường base64 của phản hồi JSON ra file
+               (xem src/model/streaming_json.py); các trường đó được thay bằng {"__file__": đường dẫn}.
+           upload (Optional[Tuple[str, str]]): (đường dẫn, mime type) của file gửi nguyên dạng làm body
+               (upload lên Gemini Files API) thay cho data.
+           chat_stream (Optional[ChatStream]): Đọc phản hồi dạng text/event-stream (chat stream=True),
+               chuyển từng đoạn text cho on_delta và trả về phản hồi đã ghép.
 
 
        Returns:
            Optional[Dict[str, Any]]: Dữ liệu JSON từ phản hồi của API hoặc thông tin file đã lưu.
        """
        url = f"{self.BASE_URL}{endpoint}"
-       headers = {"Content-Type": "application/json"}
+       headers = self._request_headers(auth_type, upload)
+       key, model, trace, cache_key = self._request_context(method, endpoint, data, use_cache, output_file)
+       if cache_key:
+           cached = self._cached_response(cache_key, output_file, decode_to)
+           if cached is not None:
+               return self._cache_hit(endpoint, trace, cached, chat_stream)
+
+
+       # Payload có ảnh dạng Base64File được gửi dần từng khối để bộ nhớ không tăng theo kích thước ảnh.
+       if upload:
+           body = FileBody(upload[0], self.upload_chunk_size)
+           request_body = {"data": body}
+       elif has_base64_file(data):
+           body = StreamingJSONBody(data, self.upload_chunk_size)
+           request_body = {"data": body}
+       elif data is not None:
+           # Tự serialize (giống requests với json=) để biết kích thước payload.
+           body = json.dumps(data, allow_nan=False).encode("utf-8")
+           request_body = {"data": body}
+       else:
+           body = b""
+           request_body = {}
+       trace.request_bytes = len(body)
 
 
+       # Giữ chỗ chi phí ước lượng trước khi gửi; vượt budget thì từ chối (xem src/model/budget.py).
+       op = operation_type(method, endpoint)
+       reservation = self.budget.reserve(model, op, self._refresh_budget)
+       if reservation is None:
+           trace.finish("budget_exceeded")
+           return None
+       charged = False
+
+       # Retry với backoff + jitter và circuit breaker theo endpoint (xem src/model/resilience.py).
+       priority = current_priority(default_priority(endpoint))
+       estimated_tokens = estimate_chat_tokens(data)
+       timeout = self.timeouts.get(op, self.timeouts["default"])
+       # File tải về được ghi vào file tạm rồi đổi tên; GET được tải tiếp bằng Range khi gửi lại.
+       download = PartialDownload(output_file, method.upper() == "GET", progress) if output_file else None
+       attempt = 0
+       try:
+           while True:
+               attempt += 1
+               if not self.resilience.before_attempt(key):
+                   logger.warning("Circuit breaker đang mở cho %s, từ chối request.", key)
+                   trace.status = trace.status or "circuit_open"
+                   return None
+
+               response = None
+               retry_status = None
+               retry_after = None
+               timed_out = False
+               outcome = self.resilience.outcome(key)
+               try:
+                   # Xếp hàng cục bộ khi model đã hết quota thay vì nhận 429 (xem src/model/rate_limit.py).
+                   self.rate_limiter.acquire(model, estimated_tokens, priority)
+                   # Luôn stream để tách thời gian chờ header (ttfb, gồm cả connect) với thời gian nhận body.
+                   with trace.activate(), trace.phase("ttfb"):
+                       response = self.session.request(
+                           method,
+                           url,
+                           headers={**headers, **download.request_headers()} if download else headers,
+                           stream=True,
+                           timeout=timeout,
+                           **request_body
+                       )
+                   trace.record_attempt(response.status_code)
+                   response.raise_for_status()
+                   # Server đã xử lý request: tính phí kể cả khi việc tải body sau đó bị lỗi.
+                   charged = True
+
+
+                   if download:
+                       if download.received:
+                           logger.info("Tải tiếp %s từ byte %d...", output_file, download.received)
+                       if not download.begin(response.status_code, response.headers):
+                           raise requests.exceptions.ConnectionError("Content-Range không khớp với phần đã tải.")
+                       with trace.phase("transfer"):
+                           for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                               trace.response_bytes += len(chunk)
+                               with trace.phase("file_write"):
+                                   download.write(chunk)
+                       with trace.phase("file_write"):
+                           download.commit()
+                       outcome.success()
+                       logger.info("File đã được lưu thành công tại: %s", output_file)
+                       result = {"status": "success", "file_path": output_file}
+                       self._cache_result(cache_key, output_file, result)
+                       return result
+
+                   outcome.success()
+                   if chat_stream is not None:
+                       result = self._read_chat_stream(response, chat_stream, trace)
+                       self._cache_result(cache_key, None, result)
+                       return result
+                   if decode_to:
+                       result = self._decode_streaming(response, decode_to, trace)
+                       self._cache_result(cache_key, None, result)
+                       return result
+
+                   with trace.phase("transfer"):
+                       content = response.content
+                   trace.response_bytes += len(content)
+                   if response.status_code == 204 or not content:
+                       return None
+
+                   with trace.phase("json_decode"):
+                       result = response.json()
+                   self._cache_result(cache_key, None, result)
+                   return result
+
+
+               # requests.exceptions.JSONDecodeError kế thừa cả RequestException nên phải được bắt trước.
+               except json.JSONDecodeError as e:
+                   self._invalid_response(trace, outcome, f"{e}. Phản hồi thô: {response.text}")
+                   return None
+               except requests.exceptions.HTTPError as http_err:
+                   retry_status, retry_after = self._http_failure(outcome, http_err, http_err.response)
+               except requests.exceptions.RequestException as req_err:
+                   # Lỗi trước khi có phản hồi (kết nối) chắc chắn chưa được xử lý;
+                   # timeout đọc hoặc lỗi giữa chừng thì server có thể đã xử lý request.
+                   timed_out = response is not None or isinstance(req_err, requests.exceptions.ReadTimeout)
+                   self._transport_failure(trace, outcome, response, req_err)
+               finally:
+                   outcome.close()
+
+               delay = self._retry_delay(method, key, attempt, chat_stream, download, retry_status, retry_after, timed_out)
+               if delay is None:
+                   return None
+               time.sleep(delay)
+       finally:
+           self.budget.settle(reservation, charged)
+           trace.finish()
+
+
+   # --- Các bước chung của _make_request (AsyncThucChienAIBot dùng lại các hàm này) ---
+
+   def _request_headers(self, auth_type: str, upload: Optional[Tuple[str, str]] = None) -> Dict[str, str]:
+       """Header xác thực và Content-Type của một request."""
+       headers = {"Content-Type": "application/json"}
        if auth_type == 'bearer':
            headers["Authorization"] = f"Bearer {self.api_key}"
        elif auth_type == 'google':
            headers["x-goog-api-key"] = self.api_key
        else:
            raise ValueError("auth_type phải là 'bearer' hoặc 'google'.")
+       if upload:
+           headers["Content-Type"] = upload[1]
+           headers["X-Goog-Upload-Protocol"] = "raw"
+       return headers
+
+
+   def _request_context(
+       self,
+       method: str,
+       endpoint: str,
+       data: Optional[Dict[str, Any]],
+       use_cache: bool,
+       output_file: Optional[str]
+   ) -> Tuple[str, Optional[str], RequestTrace, Optional[str]]:
+       """
+       Trả về (key của breaker, model, RequestTrace, key của response cache hoặc None).
+       Thời gian từng phase, kích thước, số lần thử và status được ghi vào self.metrics (xem src/model/tracing.py).
+       """
+       model = request_model(method, endpoint, data)
+       trace = RequestTrace(self.metrics, method, endpoint, model)
+       cache_key = None
+       if self.cache is not None and use_cache and method.upper() == "POST":
+           cache_key = self.cache.make_key(method, endpoint, data, output=bool(output_file))
+       return endpoint_key(method, endpoint), model, trace, cache_key
+
+
+   def _cached_response(self, cache_key: str, output_file: Optional[str], decode_to: Optional[str]) -> Optional[Dict[str, Any]]:
+       """Đọc response cache (đọc đĩa: client async gọi qua asyncio.to_thread)."""
+       if output_file:
+           return self.cache.get_file(cache_key, output_file)
+       return self.cache.get_json(cache_key, decode_to)
+
+
+   def _cache_hit(self, endpoint: str, trace: RequestTrace, cached: Dict[str, Any], chat_stream: Optional[ChatStream]) -> Dict[str, Any]:
+       logger.debug("Lấy kết quả từ cache cho: %s", endpoint)
+       trace.finish("cache")
+       return chat_stream.replay(cached) if chat_stream is not None else cached
+
+
+   def _cache_result(self, cache_key: Optional[str], output_file: Optional[str], result: Optional[Dict[str, Any]]) -> None:
+       """Ghi kết quả thành công vào response cache (ghi đĩa: client async gọi qua asyncio.to_thread)."""
+       if not cache_key or result is None:
+           return
+       if output_file:
+           self.cache.put_file(cache_key, output_file)
+       else:
+           self.cache.put_json(cache_key, result)
+
+
+   def _invalid_response(self, trace: RequestTrace, outcome: AttemptOutcome, detail: Any) -> None:
+       # Server đã trả lời nhưng body không phải JSON hợp lệ: không gửi lại và không tính vào breaker.
+       if not outcome.recorded:
+           outcome.success()
+       trace.status = "invalid_json"
+       logger.error("Không thể giải mã JSON từ phản hồi: %s", detail)
+
+
+   def _http_failure(self, outcome: AttemptOutcome, error: Exception, response: Any) -> Tuple[int, Optional[str]]:
+       """Ghi nhận một phản hồi lỗi HTTP (requests hoặc httpx), trả về (status, Retry-After)."""
+       outcome.failure(response.status_code)
+       logger.warning("Lỗi HTTP: %s - chi tiết lỗi từ API: %s", error, response.text)
+       return response.status_code, response.headers.get("Retry-After")
 
 
+   def _transport_failure(self, trace: RequestTrace, outcome: AttemptOutcome, response: Any, error: Exception) -> None:
+       """Ghi nhận lỗi kết nối/timeout, trước khi có phản hồi (một lần thử) hoặc khi đang đọc body."""
+       if response is None:
+           trace.record_attempt(type(error).__name__)
+       else:
+           trace.status = type(error).__name__
+       outcome.failure()
+       logger.warning("Lỗi Request: %s", error)
+
+
+   def _retry_delay(
+       self,
+       method: str,
+       key: str,
+       attempt: int,
+       chat_stream: Optional[ChatStream],
+       download: Optional[PartialDownload],
+       status: Optional[int],
+       retry_after: Optional[str],
+       timed_out: bool
+   ) -> Optional[float]:
+       """Thời gian chờ trước lần gửi tiếp theo sau một lần thử lỗi, hoặc None nếu không gửi lại."""
+       if chat_stream is not None and chat_stream.started:
+           # Một phần câu trả lời đã được chuyển cho on_delta: gửi lại sẽ làm lặp nội dung.
+           logger.error("Stream %s bị ngắt sau khi đã nhận một phần câu trả lời, không gửi lại.", key)
+           return None
+       if download:
+           download.close()
+       delay = self.resilience.retry_delay(method, key, attempt, status=status, retry_after=retry_after, timeout=timed_out)
+       if delay is None:
+           if download:
+               download.discard()
+           return None
+       logger.info("Thử lại %s sau %.1f giây (lần %d)...", key, delay, attempt + 1)
+       return delay
+
+
+   def _decode_streaming(self, response: requests.Response, decode_to: str, trace: RequestTrace) -> Optional[Dict[str, Any]]:
+       """Đọc body theo từng khối và giải mã các trường base64 thẳng ra file trong decode_to."""
+       decoder = StreamingJSONDecoder(decode_to)
        try:
-           response = self.session.request(
-               method,
-               url,
-               json=data,
-               headers=headers,
-               stream=bool(output_file)
-           )
-           response.raise_for_status()
-
-
-           if output_file:
-               with open(output_file, 'wb') as f:
-                   for chunk in response.iter_content(chunk_size=8192):
-                       f.write(chunk)
-               print(f"File đã được lưu thành công tại: {output_file}")
-               return {"status": "success", "file_path": output_file}
-          
-           if response.status_code == 204 or not response.content:
+           with trace.phase("transfer"):
+               for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                   trace.response_bytes += len(chunk)
+                   with trace.phase("json_decode"):
+                       decoder.feed(chunk)
+           if response.status_code == 204 or not trace.response_bytes:
                return None
-              
-           return response.json()
+           with trace.phase("json_decode"):
+               return decoder.close()
+       except ValueError as e:
+           decoder.discard()
+           trace.status = "invalid_json"
+           logger.error("Không thể giải mã JSON từ phản hồi: %s", e)
+           return None
+       except BaseException:
+           # Lỗi kết nối giữa chừng: xóa file tạm, request sẽ được gửi lại.
+           decoder.discard()
+           raise
 
 
-       except requests.exceptions.HTTPError as http_err:
-           print(f"Lỗi HTTP: {http_err}")
-           print(f"Chi tiết lỗi từ API: {http_err.response.text}")
-       except requests.exceptions.RequestException as req_err:
-           print(f"Lỗi Request: {req_err}")
-       except json.JSONDecodeError:
-           print(f"Không thể giải mã JSON từ phản hồi. Phản hồi thô: {response.text}")
-      
-       return None
+   def _read_chat_stream(self, response: requests.Response, chat_stream: ChatStream, trace: RequestTrace) -> Optional[Dict[str, Any]]:
+       """Đọc các event SSE ngay khi tới (không chờ hết body) và ghi thời gian tới token đầu tiên."""
+       chat_stream.reset()
+       try:
+           with trace.phase("transfer"):
+               # chunk_size=None: nhận từng khối ngay khi server gửi (Transfer-Encoding: chunked).
+               for chunk in response.iter_content(chunk_size=None):
+                   trace.response_bytes += len(chunk)
+                   with trace.phase("json_decode"):
+                       chat_stream.feed(chunk)
+           with trace.phase("json_decode"):
+               result = chat_stream.close()
+       except ValueError as e:
+           trace.status = "invalid_json"
+           logger.error("Không thể đọc stream từ phản hồi: %s", e)
+           return None
+       if chat_stream.first_delta_at is not None:
+           self.metrics.observe("first_token_seconds", chat_stream.first_delta_at - trace.started, **trace.labels)
+       return result
+
+
+   def _refresh_budget(self) -> None:
+       """Đối chiếu spend ước lượng với /key/info (CostAccountant quyết định khi nào cần gọi)."""
+       started = time.time()
+       self.budget.reconcile(self.get_key_info(), started)
 
 
    # --- HÀM HELPER MỚI ĐỂ MÃ HÓA ẢNH ---
-   def _encode_image_to_base64(self, image_path: str) -> Dict[str, str]:
+   def _image_mime_type(self, image_path: str) -> str:
        """
-       Đọc file ảnh, mã hóa sang base64 và xác định mime type.
+       Xác định mime type dựa trên phần mở rộng file.
        """
-       # Xác định mime type dựa trên phần mở rộng file
        ext = os.path.splitext(image_path)[1].lower()
        mime_types = {
            '.jpg': 'image/jpeg',
@@ -120,17 +449,36 @@ class ThucChienAIBot:
        mime_type = mime_types.get(ext)
        if not mime_type:
            raise ValueError(f"Định dạng file không được hỗ trợ: {ext}. Chỉ hỗ trợ JPG, PNG, WEBP.")
+       return mime_type
 
 
-       # Đọc file và mã hóa
+   def _encode_image_to_base64(self, image_path: str) -> Dict[str, str]:
+       """
+       Đọc file ảnh, mã hóa sang base64 và xác định mime type.
+       """
+       mime_type = self._image_mime_type(image_path)
+
+
+       # Đọc file và mã hóa (ảnh dùng lại nhiều lần chỉ được mã hóa một lần nhờ image_cache)
        try:
-           with open(image_path, "rb") as image_file:
-               encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+           encoded_string = Base64File(image_path, self.image_cache).encoded_bytes().decode('utf-8')
            return {"mime_type": mime_type, "data": encoded_string}
        except FileNotFoundError:
            raise FileNotFoundError(f"Không tìm thấy file ảnh tại đường dẫn: {image_path}")
 
 
+   def _stream_image_to_base64(self, image_path: str) -> Dict[str, Any]:
+       """
+       Giống _encode_image_to_base64 nhưng trả về Base64File: ảnh chỉ được đọc
+       và mã hóa từng khối khi request được gửi đi (xem StreamingJSONBody).
+       """
+       mime_type = self._image_mime_type(image_path)
+       try:
+           return {"mime_type": mime_type, "data": Base64File(image_path, self.image_cache)}
+       except FileNotFoundError:
+           raise FileNotFoundError(f"Không tìm thấy file ảnh tại đường dẫn: {image_path}")
+
+
    # --- Các hàm cho Chat & Image ---
 
 
@@ -140,7 +488,9 @@ class ThucChienAIBot:
        messages: List[Dict[str, str]],
        temperature: Optional[float] = None,
        max_tokens: Optional[int] = None,
-       modalities: Optional[List[str]] = None
+       modalities: Optional[List[str]] = None,
+       stream: bool = False,
+       on_delta: Optional[DeltaCallback] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Tạo phản hồi trò chuyện (Chat Completions).
@@ -152,6 +502,9 @@ class ThucChienAIBot:
            temperature (Optional[float]): Mức độ sáng tạo của phản hồi.
            max_tokens (Optional[int]): Số lượng token tối đa để tạo.
            modalities (Optional[List[str]]): Dùng để sinh ảnh, ví dụ: ["image"].
+           stream (bool): Nhận câu trả lời dạng stream (SSE); kết quả trả về vẫn có dạng như khi không stream.
+           on_delta (Optional[DeltaCallback]): Với stream, được gọi với từng đoạn text mới ngay khi nhận được
+               (ví dụ đưa vào JSONItemExtractor để xử lý từng scene trước khi model viết xong).
 
 
        Returns:
@@ -164,8 +517,14 @@ class ThucChienAIBot:
            payload["max_tokens"] = max_tokens
        if modalities is not None:
            payload["modalities"] = modalities
+       if stream:
+           payload["stream"] = True
+           payload["stream_options"] = {"include_usage": True}
           
-       return self._make_request("POST", "/chat/completions", data=payload, auth_type='bearer')
+       return self._make_request(
+           "POST", "/chat/completions", data=payload, auth_type='bearer',
+           chat_stream=ChatStream(on_delta) if stream else None
+       )
 
 
    def generate_image(
@@ -174,7 +533,8 @@ class ThucChienAIBot:
        prompt: str,
        n: Optional[int] = 1,
        aspect_ratio: Optional[str] = None,
-       size: Optional[str] = None  # <-- THAM SỐ MỚI
+       size: Optional[str] = None,  # <-- THAM SỐ MỚI
+       decode_to: Optional[str] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Sinh hình ảnh (Image Generation).
@@ -186,6 +546,8 @@ class ThucChienAIBot:
            n (Optional[int]): Số lượng hình ảnh cần tạo.
            aspect_ratio (Optional[str]): Tỷ lệ khung hình, ví dụ: "1:1", "16:9".
            size (Optional[str]): Kích thước ảnh, ví dụ: "1024x1024".
+           decode_to (Optional[str]): Nếu đặt, dữ liệu base64 được giải mã dần ra file trong thư mục này
+               và thay bằng {"__file__": đường dẫn} (không giữ toàn bộ ảnh/audio trong bộ nhớ).
 
 
        Returns:
@@ -201,14 +563,15 @@ class ThucChienAIBot:
            payload["size"] = size
        # -----------------------------------
           
-       return self._make_request("POST", "/images/generations", data=payload, auth_type='bearer')
+       return self._make_request("POST", "/images/generations", data=payload, auth_type='bearer', decode_to=decode_to)
 
 
    def generate_image_gemini(
        self,
        model: str,
        prompt: str,
-       aspect_ratio: str = "1:1"
+       aspect_ratio: str = "1:1",
+       decode_to: Optional[str] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Sinh/Sửa hình ảnh với Google Gemini.
@@ -218,6 +581,8 @@ class ThucChienAIBot:
            model (str): Tên model (ví dụ: 'gemini-2.5-flash-image-preview').
            prompt (str): Mô tả hình ảnh cần tạo.
            aspect_ratio (str): Tỷ lệ khung hình (ví dụ: '1:1', '9:16').
+           decode_to (Optional[str]): Nếu đặt, dữ liệu base64 được giải mã dần ra file trong thư mục này
+               và thay bằng {"__file__": đường dẫn} (không giữ toàn bộ ảnh/audio trong bộ nhớ).
 
 
        Returns:
@@ -230,7 +595,7 @@ class ThucChienAIBot:
                "imageConfig": {"aspectRatio": aspect_ratio}
            }
        }
-       return self._make_request("POST", endpoint, data=payload, auth_type='google')
+       return self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
 
 
    # --- HÀM MỚI ĐỂ CHỈNH SỬA ẢNH ---
@@ -239,10 +604,13 @@ class ThucChienAIBot:
        model: str,
        prompt: str,
        image_paths: List[str], # <-- THAY ĐỔI: Từ str thành List[str]
-       aspect_ratio: str = "1:1"
+       aspect_ratio: str = "1:1",
+       decode_to: Optional[str] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Phân tích hoặc chỉnh sửa hình ảnh dựa trên prompt và một hoặc nhiều ảnh đầu vào.
+       Với self.files, mỗi ảnh chỉ được upload một lần (Gemini Files API) rồi được tham chiếu bằng
+       fileUri, nên các request sau chỉ gửi prompt; file hết hạn/bị xóa được upload lại tự động.
 
 
        Args:
@@ -250,61 +618,342 @@ class ThucChienAIBot:
            prompt (str): Yêu cầu hoặc câu hỏi về các hình ảnh.
            image_paths (List[str]): Danh sách các đường dẫn đến file ảnh cần xử lý.
            aspect_ratio (str): Tỷ lệ khung hình cho ảnh đầu ra (nếu có).
+           decode_to (Optional[str]): Nếu đặt, dữ liệu base64 được giải mã dần ra file trong thư mục này
+               và thay bằng {"__file__": đường dẫn} (không giữ toàn bộ ảnh/audio trong bộ nhớ).
 
 
        Returns:
            Optional[Dict[str, Any]]: Phản hồi từ API.
        """
-       # Bắt đầu payload với phần text
-       parts = [{"text": prompt}]
+       endpoint = f"/gemini/v1beta/models/{model}:generateContent"
 
+       # Lần thứ hai chỉ xảy ra khi một file đã upload không còn trên server (xem _drop_stale_files).
+       for _ in range(2):
+           # Bắt đầu payload với phần text
+           parts = [{"text": prompt}]
 
-       # Lặp qua từng đường dẫn ảnh, mã hóa và thêm vào danh sách parts
-       try:
-           for path in image_paths:
-               print(f"Đang xử lý ảnh: {path}")
-               image_data = self._encode_image_to_base64(path)
-               parts.append({
-                   "inlineData": {
-                       "mimeType": image_data["mime_type"],
-                       "data": image_data["data"]
-                   }
-               })
-       except (ValueError, FileNotFoundError) as e:
-           print(f"Lỗi xử lý ảnh: {e}")
+           # Lặp qua từng đường dẫn ảnh và thêm vào danh sách parts
+           try:
+               image_parts, uploaded = self._image_parts(image_paths)
+           except (ValueError, FileNotFoundError) as e:
+               logger.error("Lỗi xử lý ảnh: %s", e)
+               return None
+           parts.extend(image_parts)
+
+           # Xây dựng payload cuối cùng với tất cả các part (text + images)
+           payload = {
+               "contents": [{"parts": parts}],
+               "generationConfig": {
+                   "imageConfig": {"aspectRatio": aspect_ratio}
+               }
+           }
+
+           result = self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
+           if result is not None or not self._drop_stale_files(uploaded):
+               return result
+           logger.info("Gửi lại request với ảnh vừa upload lại.")
+       return result
+
+
+   def _image_parts(self, image_paths: List[str]) -> Tuple[List[Dict[str, Any]], List[Tuple[str, Dict[str, Any]]]]:
+       """
+       Part cho từng ảnh đầu vào: fileData (fileUri) nếu có self.files, ngược lại inlineData base64
+       (gửi dần từng khối). Trả về (parts, [(key, entry)] của các file đã upload được dùng).
+       """
+       parts = []
+       uploaded = []
+       for path in image_paths:
+           logger.debug("Đang xử lý ảnh: %s", path)
+           if self.files is not None:
+               if not os.path.exists(path):
+                   raise FileNotFoundError(f"Không tìm thấy file ảnh tại đường dẫn: {path}")
+               key = self.files.key(path, self._file_scope())
+               entry = self.ensure_file(path, key)
+               if entry is not None:
+                   parts.append(file_part(entry, key))
+                   uploaded.append((key, entry))
+                   continue
+               logger.warning("Không upload được %s, gửi ảnh dạng base64.", path)
+           image_data = self._stream_image_to_base64(path)
+           parts.append({
+               "inlineData": {
+                   "mimeType": image_data["mime_type"],
+                   "data": image_data["data"]
+               }
+           })
+       return parts, uploaded
+
+
+   # --- Gemini Files API (upload ảnh một lần, dùng lại bằng fileUri) ---
+
+   def _file_scope(self) -> str:
+       # File upload thuộc về project của API key: đổi key hoặc server thì phải upload lại.
+       return hashlib.sha256(f"{self.BASE_URL}|{self.api_key}".encode("utf-8")).hexdigest()[:16]
+
+
+   def upload_file(self, file_path: str, mime_type: Optional[str] = None, max_wait: float = 60.0) -> Optional[Dict[str, Any]]:
+       """
+       Upload một file lên Gemini Files API (giữ 48 giờ) và chờ nó sẵn sàng (state ACTIVE).
+
+
+       Args:
+           file_path (str): Đường dẫn file cần upload.
+           mime_type (Optional[str]): Mime type; mặc định suy ra từ đuôi file ảnh.
+           max_wait (float): Thời gian tối đa (giây) chờ file chuyển từ PROCESSING sang ACTIVE.
+
+
+       Returns:
+           Optional[Dict[str, Any]]: Resource file (name, uri, mimeType, expirationTime, ...) hoặc None.
+       """
+       mime_type = mime_type or self._image_mime_type(file_path)
+       response = self._make_request(
+           "POST", "/gemini/upload/v1beta/files", auth_type='google', use_cache=False, upload=(file_path, mime_type)
+       )
+       file = (response or {}).get("file")
+       if not file:
+           logger.error("Upload %s thất bại.", file_path)
+           return None
+
+       deadline = time.monotonic() + max_wait
+       while file.get("state") == "PROCESSING" and time.monotonic() < deadline:
+           time.sleep(1.0)
+           file = self.get_file(file["name"]) or file
+       if file.get("state") not in (None, "ACTIVE"):
+           logger.error("File %s không sẵn sàng (state: %s).", file["name"], file.get("state"))
            return None
+       logger.info("Đã upload %s thành %s", file_path, file["name"])
+       return file
 
 
+   def get_file(self, name: str) -> Optional[Dict[str, Any]]:
+       """Thông tin một file đã upload (name dạng 'files/abc123'), None nếu không còn tồn tại."""
+       return self._make_request("GET", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   def delete_file(self, name: str) -> None:
+       """Xóa một file đã upload trước khi hết hạn."""
+       self._make_request("DELETE", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   def ensure_file(self, file_path: str, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+       """Entry (name, uri, mime_type, expires_at) của file_path trong self.files, upload nếu chưa có hoặc sắp hết hạn."""
+       key = key or self.files.key(file_path, self._file_scope())
+       # Nhiều scene dùng chung một ảnh tham chiếu: chỉ một thread upload, các thread khác chờ và dùng lại.
+       with self.files.lock(key):
+           entry = self.files.lookup(key)
+           if entry is not None:
+               return entry
+           mime_type = self._image_mime_type(file_path)
+           file = self.upload_file(file_path, mime_type)
+           if file is None:
+               return None
+           return self.files.register(key, file, mime_type)
+
+
+   def _drop_stale_files(self, uploaded: List[Tuple[str, Dict[str, Any]]]) -> bool:
+       """
+       Sau một request thất bại: bỏ khỏi self.files các file server không còn giữ (hết hạn sớm, bị xóa,
+       đổi project) để lần sau upload lại. Trả về True nếu có file như vậy (nên gửi lại request).
+       """
+       stale = False
+       for key, entry in uploaded:
+           file = self.get_file(entry["name"])
+           if file is None or file.get("state") != "ACTIVE":
+               logger.warning("File %s không còn dùng được, sẽ upload lại.", entry["name"])
+               self.files.invalidate(key)
+               stale = True
+       return stale
+
+
+   # --- Gemini context caching (prefix dài dùng chung, cache phía provider) ---
+
+   def generate_text_gemini(
+       self,
+       model: str,
+       prompt: str,
+       context: Optional[str] = None,
+       system_instruction: Optional[str] = None,
+       temperature: Optional[float] = None,
+       max_tokens: Optional[int] = None
+   ) -> Optional[Dict[str, Any]]:
+       """
+       Sinh văn bản với Google Gemini (generateContent), context là prefix dài đặt trước prompt.
+       Với self.contexts và context đủ dài, context (cùng system_instruction) được tạo thành cachedContent
+       một lần rồi được tham chiếu bằng tên, nên các request sau chỉ gửi prompt; cache hết hạn/bị xóa
+       được tạo lại tự động, context quá ngắn để cache được gửi thẳng trong request.
+
+
+       Args:
+           model (str): Tên model (ví dụ: 'gemini-2.5-flash').
+           prompt (str): Câu hỏi/yêu cầu riêng của request này.
+           context (Optional[str]): Prefix dùng chung giữa nhiều request (câu chuyện, danh sách scenario, ...).
+           system_instruction (Optional[str]): System prompt (được cache cùng context).
+           temperature (Optional[float]): Mức độ sáng tạo của phản hồi.
+           max_tokens (Optional[int]): Số lượng token tối đa để tạo.
+
+
+       Returns:
+           Optional[Dict[str, Any]]: Phản hồi từ API (lấy text bằng gemini_text trong src/model/context_cache.py).
+       """
        endpoint = f"/gemini/v1beta/models/{model}:generateContent"
-      
-       # Xây dựng payload cuối cùng với tất cả các part (text + images)
-       payload = {
-           "contents": [{"parts": parts}],
-           "generationConfig": {
-               "imageConfig": {"aspectRatio": aspect_ratio}
-           }
-       }
-      
-       return self._make_request("POST", endpoint, data=payload, auth_type='google')
+       generation = {}
+       if temperature is not None:
+           generation["temperature"] = temperature
+       if max_tokens is not None:
+           generation["maxOutputTokens"] = max_tokens
+
+       # Lần thứ hai chỉ xảy ra khi cache đã dùng không còn trên server (xem _drop_stale_context).
+       for _ in range(2):
+           cached = self._context_cache(model, context, system_instruction) if context else None
+           payload = self._text_payload(prompt, context, system_instruction, cached, generation)
+           result = self._make_request("POST", endpoint, data=payload, auth_type='google')
+           if result is not None or cached is None or not self._drop_stale_context(*cached):
+               return result
+           logger.info("Gửi lại request với context cache vừa tạo lại.")
+       return result
+
+
+   @staticmethod
+   def _text_payload(
+       prompt: str,
+       context: Optional[str],
+       system_instruction: Optional[str],
+       cached: Optional[Tuple[str, Dict[str, Any]]],
+       generation: Dict[str, Any]
+   ) -> Dict[str, Any]:
+       if cached is not None:
+           # System instruction đã nằm trong cache, không được gửi lại cùng cachedContent.
+           payload = {"cachedContent": CachedContentName(cached[1]["name"], cached[0]), "contents": [text_content(prompt)]}
+       else:
+           parts = [{"text": context}, {"text": prompt}] if context else [{"text": prompt}]
+           payload = {"contents": [{"role": "user", "parts": parts}]}
+           if system_instruction:
+               payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+       if generation:
+           payload["generationConfig"] = generation
+       return payload
+
+
+   def _context_cache(self, model: str, context: str, system_instruction: Optional[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+       """(key, entry) của cache cho context, None nếu không dùng cache (tắt, context ngắn, tạo lỗi)."""
+       if self.contexts is None or not self.contexts.cacheable(context, system_instruction):
+           return None
+       contents = [text_content(context)]
+       key = self.contexts.key(model, contents, system_instruction, self._file_scope())
+       entry = self.ensure_cached_content(model, contents, system_instruction, key)
+       if entry is None:
+           logger.warning("Không tạo được context cache, gửi context trong request.")
+           return None
+       return key, entry
+
+
+   def create_cached_content(
+       self,
+       model: str,
+       contents: List[Dict[str, Any]],
+       system_instruction: Optional[str] = None,
+       ttl: float = DEFAULT_CONTEXT_TTL
+   ) -> Optional[Dict[str, Any]]:
+       """
+       Tạo một cachedContent (prefix dùng chung cho nhiều request generateContent).
+
+
+       Args:
+           model (str): Model sẽ dùng cache (cache chỉ dùng được với đúng model này).
+           contents (List[Dict]): Nội dung prefix theo định dạng contents của generateContent.
+           system_instruction (Optional[str]): System prompt được cache cùng prefix.
+           ttl (float): Thời gian sống (giây).
+
+
+       Returns:
+           Optional[Dict[str, Any]]: Resource cachedContent (name, expireTime, usageMetadata, ...) hoặc None.
+       """
+       payload = {"model": f"models/{model}", "contents": contents, "ttl": f"{ttl:g}s"}
+       if system_instruction:
+           payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+       cached = self._make_request("POST", "/gemini/v1beta/cachedContents", data=payload, auth_type='google', use_cache=False)
+       if cached is not None:
+           logger.info("Đã tạo context cache %s (%s token)", cached.get("name"), (cached.get("usageMetadata") or {}).get("totalTokenCount"))
+       return cached
+
+
+   def get_cached_content(self, name: str) -> Optional[Dict[str, Any]]:
+       """Thông tin một cachedContent (name dạng 'cachedContents/abc123'), None nếu không còn tồn tại."""
+       return self._make_request("GET", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   def update_cached_content(self, name: str, ttl: float = DEFAULT_CONTEXT_TTL) -> Optional[Dict[str, Any]]:
+       """Gia hạn một cachedContent thêm ttl giây tính từ bây giờ."""
+       return self._make_request("PATCH", f"/gemini/v1beta/{name}?updateMask=ttl", data={"ttl": f"{ttl:g}s"}, auth_type='google')
+
+
+   def delete_cached_content(self, name: str) -> None:
+       """Xóa một cachedContent trước khi hết hạn (ngừng tính phí lưu trữ)."""
+       self._make_request("DELETE", f"/gemini/v1beta/{name}", auth_type='google')
+
+
+   def ensure_cached_content(
+       self,
+       model: str,
+       contents: List[Dict[str, Any]],
+       system_instruction: Optional[str] = None,
+       key: Optional[str] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Entry (name, expires_at, tokens) của prefix trong self.contexts: tạo nếu chưa có, gia hạn nếu sắp hết hạn."""
+       key = key or self.contexts.key(model, contents, system_instruction, self._file_scope())
+       # Nhiều request cùng prefix: chỉ một thread tạo cache, các thread khác chờ và dùng lại.
+       with self.contexts.lock(key):
+           entry = self.contexts.lookup(key)
+           if entry is not None and self.contexts.needs_refresh(entry):
+               cached = self.update_cached_content(entry["name"], self.contexts.ttl)
+               if cached is not None:
+                   return self.contexts.register(key, cached, extended=True)
+               self.contexts.invalidate(key)
+               entry = None
+           if entry is not None:
+               return entry
+           cached = self.create_cached_content(model, contents, system_instruction, self.contexts.ttl)
+           if cached is None:
+               return None
+           return self.contexts.register(key, cached)
+
+
+   def _drop_stale_context(self, key: str, entry: Dict[str, Any]) -> bool:
+       """Sau một request thất bại: bỏ cache server không còn giữ. Trả về True nếu nên gửi lại request."""
+       if self.get_cached_content(entry["name"]) is not None:
+           return False
+       logger.warning("Context cache %s không còn dùng được, sẽ tạo lại.", entry["name"])
+       self.contexts.invalidate(key)
+       return True
 
 
    # --- Các hàm cho Video ---
-  
-   def generate_video(
+
+   @property
+   def video_poller(self) -> VideoOperationPoller:
+       """Poller dùng chung cho mọi tác vụ video của client này (khởi tạo khi cần)."""
+       if self._video_poller is None:
+           self._video_poller = VideoOperationPoller(self)
+       return self._video_poller
+
+
+   def start_video_operation(
        self,
-       output_file: str,
        model: str,
        prompt: str,
        image_path: Optional[str] = None,
        negative_prompt: Optional[str] = None,
        aspect_ratio: Optional[str] = "16:9",
-       resolution: Optional[str] = "720p",
-       poll_interval: int = 15
-   ) -> Optional[Dict[str, Any]]:
+       resolution: Optional[str] = "720p"
+   ) -> Optional[str]:
        """
-       Sinh video từ prompt (và tùy chọn từ một ảnh) theo quy trình 3 bước.
+       Bước 1: Khởi tạo tác vụ sinh video (predictLongRunning).
+
+
+       Returns:
+           Optional[str]: Tên tác vụ (operation name) hoặc None nếu thất bại.
        """
-       print("Bước 1/3: Bắt đầu tác vụ sinh video...")
+       logger.info("Bước 1/3: Bắt đầu tác vụ sinh video...")
        start_endpoint = f"/gemini/v1beta/models/{model}:predictLongRunning"
       
        parameters = {}
@@ -317,9 +966,9 @@ class ThucChienAIBot:
           
        instance = {"prompt": prompt}
        if image_path:
-           print(f"Sử dụng ảnh đầu vào từ: {image_path}")
+           logger.info("Sử dụng ảnh đầu vào từ: %s", image_path)
            try:
-               image_data = self._encode_image_to_base64(image_path)
+               image_data = self._stream_image_to_base64(image_path)
               
                # --- THAY ĐỔI QUAN TRỌNG ---
                # API yêu cầu cả bytesBase64Encoded và mimeType.
@@ -331,47 +980,139 @@ class ThucChienAIBot:
 
 
            except (ValueError, FileNotFoundError) as e:
-               print(f"Lỗi xử lý ảnh đầu vào: {e}")
+               logger.error("Lỗi xử lý ảnh đầu vào: %s", e)
                return None
       
        payload = {"instances": [instance], "parameters": parameters}
       
-       start_response = self._make_request("POST", start_endpoint, data=payload, auth_type='google')
+       # Tên tác vụ chỉ dùng được một lần nên không cache bước này (xem generate_video).
+       start_response = self._make_request("POST", start_endpoint, data=payload, auth_type='google', use_cache=False)
 
 
        if not start_response or 'name' not in start_response:
-           print("Không thể bắt đầu tác vụ sinh video.")
+           logger.error("Không thể bắt đầu tác vụ sinh video.")
            return None
        operation_name = start_response['name']
-       print(f"Tác vụ đã bắt đầu. Tên tác vụ: {operation_name}")
+       logger.info("Tác vụ đã bắt đầu. Tên tác vụ: %s", operation_name)
+       return operation_name
 
 
-       # --- Phần Bước 2 và Bước 3 giữ nguyên ---
-       print(f"Bước 2/3: Kiểm tra trạng thái mỗi {poll_interval} giây...")
-       status_endpoint = f"/gemini/v1beta/{operation_name}"
-       while True:
-           status_response = self._make_request("GET", status_endpoint, auth_type='google')
-           if not status_response:
-               print("Không thể lấy trạng thái tác vụ.")
-               return None
-          
-           if status_response.get('done'):
-               print("Tác vụ đã hoàn thành.")
-               break
-          
-           print("Tác vụ đang được xử lý, vui lòng chờ...")
-           time.sleep(poll_interval)
-      
+   def get_video_operation(self, operation_name: str) -> Optional[Dict[str, Any]]:
+       """Bước 2: Lấy trạng thái hiện tại của một tác vụ sinh video."""
+       return self._make_request("GET", f"/gemini/v1beta/{operation_name}", auth_type='google')
+
+
+   def download_video(
+       self,
+       status_response: Dict[str, Any],
+       output_file: str,
+       progress: Optional[ProgressCallback] = None
+   ) -> Optional[Dict[str, Any]]:
+       """Bước 3: Tải video của một tác vụ đã hoàn thành về output_file (tải tiếp bằng Range nếu mất kết nối)."""
        try:
            video_uri = status_response['response']['generateVideoResponse']['generatedSamples'][0]['video']['uri']
            video_id = video_uri.split('/')[-1].split(':')[0]
-           print(f"Bước 3/3: Tải video với ID: {video_id}")
-           download_endpoint = f"/gemini/download/v1beta/files/{video_id}:download?alt=media"
-           return self._make_request("GET", download_endpoint, auth_type='google', output_file=output_file)
        except (KeyError, IndexError, TypeError):
-           print("Không tìm thấy URI video trong phản hồi.")
-           print(f"Phản hồi đầy đủ từ API: {status_response}")
+           logger.error("Không tìm thấy URI video trong phản hồi. Phản hồi đầy đủ từ API: %s", status_response)
+           return None
+       logger.info("Bước 3/3: Tải video với ID: %s", video_id)
+       download_endpoint = f"/gemini/download/v1beta/files/{video_id}:download?alt=media"
+       return self._make_request("GET", download_endpoint, auth_type='google', output_file=output_file, progress=progress)
+
+
+   def submit_video(
+       self,
+       output_file: str,
+       model: str,
+       prompt: str,
+       image_path: Optional[str] = None,
+       negative_prompt: Optional[str] = None,
+       aspect_ratio: Optional[str] = "16:9",
+       resolution: Optional[str] = "720p",
+       callback: Optional[Callable[[str, Optional[Dict[str, Any]]], None]] = None,
+       max_poll_interval: Optional[float] = None
+   ) -> Optional[str]:
+       """
+       Khởi tạo tác vụ sinh video và giao cho video_poller theo dõi, trả về ngay lập tức.
+
+
+       Args:
+           callback (Optional[Callable]): Gọi callback(operation_name, result) khi video đã tải xong.
+           max_poll_interval (Optional[float]): Khoảng chờ tối đa giữa hai lần kiểm tra trạng thái.
+
+
+       Returns:
+           Optional[str]: Tên tác vụ (dùng với wait_for_video) hoặc None nếu không khởi tạo được.
+       """
+       operation_name = self.start_video_operation(
+           model=model,
+           prompt=prompt,
+           image_path=image_path,
+           negative_prompt=negative_prompt,
+           aspect_ratio=aspect_ratio,
+           resolution=resolution
+       )
+       if operation_name is None:
            return None
+       self.video_poller.submit(operation_name, output_file, callback=callback, max_interval=max_poll_interval)
+       return operation_name
+
+
+   def wait_for_video(self, operation_name: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+       """Chờ một tác vụ đã submit hoàn tất và trả về thông tin file video."""
+       future = self.video_poller.future(operation_name)
+       if future is None:
+           raise KeyError(f"Không có tác vụ video nào tên: {operation_name}")
+       return future.result(timeout=timeout)
+
+  
+   def generate_video(
+       self,
+       output_file: str,
+       model: str,
+       prompt: str,
+       image_path: Optional[str] = None,
+       negative_prompt: Optional[str] = None,
+       aspect_ratio: Optional[str] = "16:9",
+       resolution: Optional[str] = "720p",
+       poll_interval: int = 15
+   ) -> Optional[Dict[str, Any]]:
+       """
+       Sinh video từ prompt (và tùy chọn từ một ảnh) theo quy trình 3 bước.
+       Việc polling được giao cho video_poller (khoảng chờ tăng dần, tối đa poll_interval giây);
+       hàm này chờ đến khi video được tải xong.
+       """
+       cache_key = None
+       if self.cache is not None:
+           cache_key = self.cache.make_key("POST", f"/gemini/v1beta/models/{model}:predictLongRunning", {
+               "prompt": prompt,
+               "image_sha256": ResponseCache.file_digest(image_path) if image_path and os.path.exists(image_path) else None,
+               "negative_prompt": negative_prompt,
+               "aspect_ratio": aspect_ratio,
+               "resolution": resolution
+           }, output=True)
+           cached = self.cache.get_file(cache_key, output_file)
+           if cached is not None:
+               logger.debug("Lấy video từ cache: %s", output_file)
+               return cached
+
+       operation_name = self.submit_video(
+           output_file=output_file,
+           model=model,
+           prompt=prompt,
+           image_path=image_path,
+           negative_prompt=negative_prompt,
+           aspect_ratio=aspect_ratio,
+           resolution=resolution,
+           max_poll_interval=poll_interval
+       )
+       if operation_name is None:
+           return None
+       logger.info("Bước 2/3: Kiểm tra trạng thái tác vụ (tối đa mỗi %s giây)...", poll_interval)
+       result = self.wait_for_video(operation_name)
+       if cache_key and result and result.get("status") == "success":
+           self.cache.put_file(cache_key, output_file)
+       return result
           
    # --- Các hàm cho Audio & Key Info ---
 
@@ -405,7 +1146,8 @@ class ThucChienAIBot:
        self,
        model: str,
        prompt: str,
-       voice_name: str
+       voice_name: str,
+       decode_to: Optional[str] = None
    ) -> Optional[Dict[str, Any]]:
        """
        Chuyển văn bản thành giọng nói với Google Gemini.
@@ -415,6 +1157,8 @@ class ThucChienAIBot:
            model (str): Tên model (ví dụ: 'gemini-2.5-flash-preview-tts').
            prompt (str): Văn bản cần chuyển, có thể bao gồm hướng dẫn.
            voice_name (str): Tên giọng đọc (ví dụ: 'Kore').
+           decode_to (Optional[str]): Nếu đặt, dữ liệu base64 được giải mã dần ra file trong thư mục này
+               và thay bằng {"__file__": đường dẫn} (không giữ toàn bộ ảnh/audio trong bộ nhớ).
 
 
        Returns:
@@ -432,7 +1176,7 @@ class ThucChienAIBot:
                }
            }
        }
-       return self._make_request("POST", endpoint, data=payload, auth_type='google')
+       return self._make_request("POST", endpoint, data=payload, auth_type='google', decode_to=decode_to)
       
    def get_key_info(self) -> Optional[Dict[str, Any]]:
        """
@@ -453,6 +1197,7 @@ if __name__ == '__main__':
    # 2. Bỏ comment (xóa dấu #) ở các phần bạn muốn chạy thử.
 
 
+   configure_logging()
    API_KEY = os.environ.get("THUCCHIEN_API_KEY", "YOUR_API_KEY")
 
 
@@ -556,337 +1301,3 @@ if __name__ == '__main__':
            print(f"  - Chi tiêu: ${key_info['info']['spend']:.6f}")
            print(f"  - Models được phép: {key_info['info']['models']}")
            # print(json.dumps(key_info, indent=2, ensure_ascii=False))
-
-
-from src.graph.state import State
-from src.nodes.text2text import text2text
-from src.nodes.text2img import text2img
-from src.nodes.textimg2text import textimg2text
-from src.nodes.textimg2img import text_img2img
-
-
-"""
-Build a LangGraph-style flow that creates a story about Conan following the specified steps:
-
-
-1. Generate detailed character description (text -> text)
-2. Generate small story with character and story fields
-3. Generate character image from description (text -> image) saved to output/artifact
-4. Create 3-step plan from story (bối cảnh + kịch bản for each step)
-5. Generate images for each step/scene
-6. Create final outputs saved to output/story
-
-
-Flow:
-- Character description: text2text
-- Small story creation: text2text 
-- Character image: text2img (saved to output/artifact)
-- Plan generation: text2text (3 steps with bối cảnh + kịch bản)
-- Scene images: text2img for each step
-- Final outputs: step + character + images saved to output/story
-"""
-
-
-from langgraph.graph import END, StateGraph, START
-from langchain_core.runnables import RunnableConfig
-from typing import Dict, Any
-import os
-import json
-import uuid
-
-
-
-
-# Node functions for the story flow
-def generate_character_description(state: State, config: RunnableConfig) -> State:
-   """Step 1: Generate detailed character description for Conan"""
-   print("--- Step 1: Generating character description ---")
-  
-   state["t2t_question"] = (
-       "Create a detailed description of Conan character 12 years old in anime japan. Include appearance, age, clothing. Write in 3 sentences in English."
-   )
-  
-   # Call text2text node
-   state = text2text(state, config)
-  
-   # Store character description for later use
-   state["character_description"] = state["t2t_answer"]['choices'][0]["message"]["content"]
-   return state
-
-
-
-
-def generate_small_story(state: State, config: RunnableConfig) -> State:
-   """Step 2: Generate small story with character and story fields"""
-   print("--- Step 2: Generating small story ---")
-  
-   character_desc = state.get("character_description", "Conan")
-  
-   state["t2t_question"] = (
-       f"Based on the character description: {character_desc}\n\n"
-       "Create a short story featuring this character. Write in 10 sentences in English."
-   )
-   # Call text2text node 
-   state = text2text(state, config)
-  
-   # Store small story
-   state["small_story"] = state["t2t_answer"]['choices'][0]["message"]["content"]
-   return state
-
-
-
-
-def generate_character_image(state: State, config: RunnableConfig) -> State:
-   """Step 3: Generate character image from description"""
-   print("--- Step 3: Generating character image ---")
-  
-   character_desc = state.get("character_description", "A detective character")
-  
-   # Ensure output directory exists
-   os.makedirs("output/artifact", exist_ok=True)
-  
-   state["t2i_question"] = f"Create image a detailed illustration of: {character_desc}"
-   state["t2i_num_images"] = 1
-   state["t2i_output_path"] = "output/artifact/character_image.png"
-  
-   # Call text2img node
-   # state = text2img(state, config)
-  
-   # Store image object
-   # state["character_image"] = state["t2i_output_path"]
-   state["character_image"] = "output/images/generated_image_1761237726_1.png"
-  
-   return state
-
-
-def parse_json_safe(json_string: str) -> Dict[str, Any]:
-   """Helper function to safely parse JSON strings."""
-   try:
-       import re
-       pattern = r'```json(.*?)```'
-       match = re.search(pattern, json_string, re.DOTALL)
-       if match:
-           return json.loads(match.group(1))
-   except json.JSONDecodeError:
-       raise ValueError("Invalid JSON format")
-
-
-def generate_story_plan(state: State, config: RunnableConfig) -> State:
-   """Step 4: Create 3-step plan from story"""
-   print("--- Step 4: Generating story plan ---")
-  
-   small_story = state.get("small_story", "")
-   if small_story == "":
-       raise ValueError("Small story is empty, cannot generate story plan.")
-  
-   state["t2t_question"] = (
-       f"Based on the following story: {small_story}\n\n"
-       "Create a 3-step plan in JSON format:\n"
-       "Write in English."
-       "{\n"
-       '  "step1": {"context": "Scene description", "scenario": "Action description"},\n'
-       '  "step2": {"context": "Scene description", "scenario": "Action description"},\n'
-       '  "step3": {"context": "Scene description", "scenario": "Action description"}\n'
-       "}\n"
-   )
-  
-   # Call text2text node
-   state = text2text(state, config)
-  
-   # Store plan
-   state["story_plan"] = state["t2t_answer"]['choices'][0]["message"]["content"]
-  
-   return state
-
-
-
-
-def generate_scene_images(state: State, config: RunnableConfig) -> State:
-   """Step 5: Generate images for each step/scene using textimg2img"""
-   print("--- Step 5: Generating scene images using character image ---")
-  
-   story_plan = state.get("story_plan", "```json{}```")
-   character_image = state.get("character_image", "")
-  
-   # Ensure output directory exists
-   os.makedirs("output/artifact", exist_ok=True)
-  
-   try:
-       plan_data = parse_json_safe(story_plan) if isinstance(story_plan, str) else story_plan
-   except:
-       raise ValueError("Invalid story plan JSON format")
-  
-   scene_images = {}
-  
-   for step_key in ["step1", "step2", "step3"]:
-       if step_key in plan_data:
-           step_data = plan_data[step_key]
-           context = step_data.get("context", f"Scene for {step_key}")
-           scenario = step_data.get("scenario", f"Action for {step_key}")
-          
-           # Create text prompt for the scene
-           text_prompt = (
-               f"Context: {context}. "
-               f"Scenario: {scenario}. "
-               f"Create image with character in this scene."
-           )
-          
-           # Use textimg2img with character image + text prompt
-           state["ti2i_question"] = text_prompt
-           state["ti2i_image_paths"] = [character_image]
-           state["ti2i_num_images"] = 1
-          
-           # Call textimg2img node
-           state = text_img2img(state, config)
-
-
-           scene_images[step_key] = state["ti2i_output_path"]
-  
-   state["scene_images"] = scene_images
-  
-   return state
-
-
-
-
-def create_final_outputs(state: State, config: RunnableConfig) -> State:
-   """Step 6: Create final outputs and save to output/story"""
-   print("--- Step 6: Creating final outputs ---")
-  
-   # Ensure output directory exists
-   os.makedirs("output/story", exist_ok=True)
-  
-   character_desc = state.get("character_description", "")
-   character_image = state.get("character_image", "")
-   story_plan = state.get("story_plan", "{}")
-   scene_images = state.get("scene_images", {})
-   small_story = state.get("small_story", "{}")
-  
-   try:
-       plan_data = json.loads(story_plan) if isinstance(story_plan, str) else story_plan
-   except:
-       plan_data = {
-           "step1": {"context": "Scene 1", "scenario": "Action 1"},
-           "step2": {"context": "Scene 2", "scenario": "Action 2"},
-           "step3": {"context": "Scene 3", "scenario": "Action 3"}
-       }
-  
-   # Create outputs for each step
-   outputs = {}
-  
-   for i, step_key in enumerate(["step1", "step2", "step3"], 1):
-       step_data = plan_data.get(step_key, {})
-       step_image = scene_images.get(step_key, "")
-      
-       output = {
-           "step": step_key,
-           "context": step_data.get("context", f"Scene {i}"),
-           "scenario": step_data.get("scenario", f"Action {i}"),
-           "character": character_desc,
-           "character_image": character_image,
-           "scene_image": step_image
-       }
-      
-       outputs[f"output{i}"] = output
-      
-       # Save individual output file
-       with open(f"output/story/output{i}.json", "w", encoding="utf-8") as f:
-           json.dump(output, f, ensure_ascii=False, indent=2)
-  
-   # Save small story
-   with open("output/story/small_story.json", "w", encoding="utf-8") as f:
-       json.dump({"small_story": small_story}, f, ensure_ascii=False, indent=2)
-  
-   # Save complete story
-   complete_story = {
-       "character_description": character_desc,
-       "character_image": character_image,
-       "small_story": small_story,
-       "story_plan": story_plan,
-       "outputs": outputs
-   }
-  
-   with open("output/story/complete_story.json", "w", encoding="utf-8") as f:
-       json.dump(complete_story, f, ensure_ascii=False, indent=2)
-  
-   state["final_outputs"] = outputs
-   state["complete_story"] = complete_story
-  
-   print("Final outputs saved to output/story/")
-  
-   return state
-
-
-
-
-def build_story_flow() -> StateGraph:
-   """Build the complete story flow using LangGraph"""
-  
-   # Create StateGraph
-   workflow = StateGraph(State)
-  
-   # Add all nodes
-   workflow.add_node("generate_character_description", generate_character_description)
-   workflow.add_node("generate_small_story", generate_small_story)
-   workflow.add_node("generate_character_image", generate_character_image)
-   workflow.add_node("generate_story_plan", generate_story_plan)
-   workflow.add_node("generate_scene_images", generate_scene_images)
-   workflow.add_node("create_final_outputs", create_final_outputs)
-  
-   # Define the flow
-   workflow.add_edge(START, "generate_character_description")
-   workflow.add_edge("generate_character_description", "generate_small_story")
-   workflow.add_edge("generate_small_story", "generate_character_image")
-   workflow.add_edge("generate_character_image", "generate_story_plan")
-   workflow.add_edge("generate_story_plan", "generate_scene_images")
-   workflow.add_edge("generate_scene_images", "create_final_outputs")
-   workflow.add_edge("create_final_outputs", END)
-  
-   return workflow.compile()
-
-
-
-
-def run_story_flow():
-   """Run the complete story flow"""
-   from src.model.bot import ThucChienAIBot
-   from dotenv import load_dotenv
-   load_dotenv()
-   api_key = os.getenv("THUC_CHIEN_API_KEY")
-
-
-   # Initialize bot
-   bot = ThucChienAIBot(api_key)
-
-
-   # Build the flow
-   workflow = build_story_flow()
-  
-   # Initial state
-   initial_state = State()
-  
-   # Configuration with bot
-   config = RunnableConfig(
-       configurable={"bot": bot}
-   )
-  
-   print("Starting Conan story generation flow...")
-  
-   # Execute the workflow
-   final_state = workflow.invoke(initial_state, config)
-  
-   print("\n=== Story Flow Completed ===")
-   print(f"Character description: {final_state.get('character_description', 'N/A')[:100]}...")
-   print(f"Character image: {final_state.get('character_image', 'N/A')}")
-   print(f"Final outputs saved: {len(final_state.get('final_outputs', {}))}")
-  
-   return final_state
-
-
-
-
-if __name__ == "__main__":
-   run_story_flow()
-
-
-
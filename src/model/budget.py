@@ -0,0 +1,346 @@
+# File: src/model/budget.py
+
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.model.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Chi phí ước lượng (USD) của một request theo model và loại thao tác (operation_type trong
+# src/model/transfer.py). "*" áp dụng cho model không có trong bảng. Các thao tác không có
+# trong bảng (status, download, /key/info...) được coi là miễn phí. Giá thực tế được hiệu
+# chỉnh dần khi đối chiếu với spend của /key/info (xem CostAccountant.reconcile).
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+   "*": {"chat": 0.002, "generate": 0.04, "speech": 0.015, "video_submit": 3.2},
+}
+
+# Chế độ khi vượt budget: từ chối ngay, hoặc xếp hàng chờ budget được giải phóng.
+REFUSE = "refuse"
+QUEUE = "queue"
+
+# Giới hạn của hệ số hiệu chỉnh (spend thực tế / chi phí ước lượng).
+_MIN_SCALE = 0.25
+_MAX_SCALE = 4.0
+
+
+class Reservation:
+   """Phần budget giữ cho một request đang chạy; được tính vào spend khi request thành công."""
+
+   __slots__ = ("model", "modality", "price", "cost")
+
+   def __init__(self, model: Optional[str], modality: str, price: float, cost: float):
+       self.model = model
+       self.modality = modality
+       self.price = price
+       self.cost = cost
+
+
+class CostAccountant:
+   """
+   Kiểm soát chi tiêu của API key ngay trên đường gửi request.
+
+   Spend dự kiến = spend của lần đối chiếu /key/info gần nhất + chi phí ước lượng của các
+   request đã xong sau lần đó + chi phí giữ chỗ của các request đang chạy. Request mới chỉ
+   được gửi khi spend dự kiến cộng chi phí của nó không vượt budget; vì request đang chạy
+   cũng được tính, một batch gửi song song không thể vượt budget trước khi kịp đối chiếu.
+
+   /key/info chỉ được gọi lại sau mỗi refresh_interval giây (không gọi cho mỗi request); mỗi
+   lần đối chiếu, spend thực tế (gồm cả chi tiêu của process khác dùng chung key) thay cho
+   phần ước lượng, và tỉ lệ giữa spend thực tế với ước lượng được dùng để hiệu chỉnh giá.
+   """
+
+   def __init__(
+       self,
+       budget: Optional[float] = None,
+       use_key_budget: bool = False,
+       prices: Optional[Dict[str, Dict[str, float]]] = None,
+       refresh_interval: float = 60.0,
+       mode: str = REFUSE,
+       max_wait: float = 300.0
+   ):
+       """
+       Args:
+           budget (Optional[float]): Budget tối đa (USD) của key; None để chỉ theo dõi, không chặn.
+           use_key_budget (bool): Dùng max_budget trả về từ /key/info (nếu budget cũng được đặt, lấy giá trị nhỏ hơn).
+           prices (Optional[Dict]): Bảng giá {model: {loại thao tác: USD}}, gộp với DEFAULT_PRICES.
+           refresh_interval (float): Khoảng cách tối thiểu (giây) giữa hai lần gọi /key/info.
+           mode (str): REFUSE (trả về None ngay) hoặc QUEUE (chờ tối đa max_wait giây).
+           max_wait (float): Thời gian chờ tối đa của một request ở chế độ QUEUE.
+       """
+       if mode not in (REFUSE, QUEUE):
+           raise ValueError(f"mode phải là '{REFUSE}' hoặc '{QUEUE}'.")
+       self.budget = budget
+       self.use_key_budget = use_key_budget
+       self.prices = {model: dict(table) for model, table in DEFAULT_PRICES.items()}
+       for model, table in (prices or {}).items():
+           self.prices.setdefault(model, {}).update(table)
+       self.refresh_interval = refresh_interval
+       self.mode = mode
+       self.max_wait = max_wait
+
+       self.scale = 1.0
+       self.refusals = 0
+       self._cond = threading.Condition()
+       self._synced_spend: Optional[float] = None
+       self._key_budget: Optional[float] = None
+       # (thời điểm xong, giá gốc, chi phí đã hiệu chỉnh) của các request xong sau lần đối chiếu gần nhất.
+       self._committed: List[Tuple[float, float, float]] = []
+       # Không có budget thì không đối chiếu: chỉ cộng dồn chi phí thay vì giữ từng request trong _committed.
+       self._untracked = 0.0
+       self._reserved = 0.0
+       self._reserved_price = 0.0
+       self._last_refresh: Optional[float] = None
+       self._refreshing = False
+
+
+   @classmethod
+   def from_env(cls) -> "CostAccountant":
+       """
+       Đọc cấu hình từ biến môi trường:
+       THUC_CHIEN_BUDGET (số USD, hoặc "key" để dùng max_budget của /key/info),
+       BUDGET_MODE (refuse|queue), BUDGET_REFRESH_SECONDS, BUDGET_MAX_WAIT và
+       BUDGET_PRICES (JSON, ví dụ '{"veo-3.0-generate-001": {"video_submit": 6.0}}').
+       """
+       raw = os.getenv("THUC_CHIEN_BUDGET", "").strip()
+       use_key_budget = raw.lower() == "key"
+       prices = os.getenv("BUDGET_PRICES")
+       return cls(
+           budget=float(raw) if raw and not use_key_budget else None,
+           use_key_budget=use_key_budget,
+           prices=json.loads(prices) if prices else None,
+           refresh_interval=float(os.getenv("BUDGET_REFRESH_SECONDS", "60")),
+           mode=os.getenv("BUDGET_MODE", REFUSE),
+           max_wait=float(os.getenv("BUDGET_MAX_WAIT", "300"))
+       )
+
+
+   @property
+   def enabled(self) -> bool:
+       """True nếu có budget để chặn (đặt trực tiếp hoặc lấy từ /key/info)."""
+       return self.budget is not None or self.use_key_budget
+
+
+   def price(self, model: Optional[str], modality: str) -> float:
+       """Giá gốc (chưa hiệu chỉnh) của một request; 0 cho các thao tác miễn phí."""
+       table = self.prices.get(model or "", {})
+       if modality in table:
+           return table[modality]
+       return self.prices.get("*", {}).get(modality, 0.0)
+
+
+   def estimate(self, model: Optional[str], modality: str) -> float:
+       return self.price(model, modality) * self.scale
+
+
+   def limit(self) -> Optional[float]:
+       limits = [value for value in (self.budget, self._key_budget if self.use_key_budget else None) if value is not None]
+       return min(limits) if limits else None
+
+
+   def projected(self) -> float:
+       """Spend dự kiến: spend đã đối chiếu + chi phí đã xong sau đó + chi phí đang giữ chỗ."""
+       with self._cond:
+           return self._projected()
+
+
+   def _projected(self) -> float:
+       return (self._synced_spend or 0.0) + self._untracked + sum(cost for _, _, cost in self._committed) + self._reserved
+
+
+   # --- Giữ chỗ và thanh toán ---
+
+   def _try_reserve(self, model: Optional[str], modality: str, price: float) -> Optional[Reservation]:
+       cost = price * self.scale
+       limit = self.limit()
+       if limit is not None and self._projected() + cost > limit:
+           return None
+       self._reserved += cost
+       self._reserved_price += price
+       return Reservation(model, modality, price, cost)
+
+
+   def _refuse(self, model: Optional[str], modality: str, price: float) -> None:
+       with self._cond:
+           self.refusals += 1
+           projected = self._projected()
+       logger.warning(
+           "Từ chối request %s (%s): chi phí ước lượng $%.4f, spend dự kiến $%.4f, budget $%.4f.",
+           modality, model, price * self.scale, projected, self.limit() or 0.0
+       )
+
+
+   def reserve(self, model: Optional[str], modality: str, refresh: Optional[Callable[[], None]] = None) -> Optional[Reservation]:
+       """
+       Giữ chỗ budget cho một request (chặn thread ở chế độ QUEUE).
+
+       Args:
+           model (Optional[str]): Model của request.
+           modality (str): Loại thao tác (operation_type).
+           refresh (Optional[Callable]): Hàm gọi /key/info và reconcile, được gọi khi đến hạn đối chiếu.
+
+       Returns:
+           Optional[Reservation]: Phần budget đã giữ, hoặc None nếu request bị từ chối.
+       """
+       price = self.price(model, modality)
+       if price <= 0:
+           return Reservation(model, modality, 0.0, 0.0)
+       if not self.enabled:
+           # Không có budget: chỉ ghi nhận chi phí ước lượng, không gọi /key/info.
+           with self._cond:
+               return self._try_reserve(model, modality, price)
+       deadline = time.monotonic() + (self.max_wait if self.mode == QUEUE else 0)
+       while True:
+           if refresh is not None and self.needs_refresh():
+               try:
+                   refresh()
+               except BaseException:
+                   # Lỗi giữa lúc gọi /key/info: bỏ cờ _refreshing để lần sau vẫn đối chiếu được.
+                   self.refresh_failed()
+                   raise
+           with self._cond:
+               reservation = self._try_reserve(model, modality, price)
+               if reservation is not None:
+                   return reservation
+               remaining = deadline - time.monotonic()
+               if remaining > 0:
+                   # Chờ request khác xong/hoàn tiền, hoặc tới lần đối chiếu kế tiếp.
+                   self._cond.wait(min(remaining, self._until_refresh() or 1.0))
+                   continue
+           self._refuse(model, modality, price)
+           return None
+
+
+   async def areserve(
+       self,
+       model: Optional[str],
+       modality: str,
+       refresh: Optional[Callable[[], Awaitable[None]]] = None
+   ) -> Optional[Reservation]:
+       """Phiên bản async của reserve, chờ bằng asyncio.sleep thay vì chặn event loop."""
+       price = self.price(model, modality)
+       if price <= 0:
+           return Reservation(model, modality, 0.0, 0.0)
+       if not self.enabled:
+           # Không có budget: chỉ ghi nhận chi phí ước lượng, không gọi /key/info.
+           with self._cond:
+               return self._try_reserve(model, modality, price)
+       deadline = time.monotonic() + (self.max_wait if self.mode == QUEUE else 0)
+       while True:
+           if refresh is not None and self.needs_refresh():
+               try:
+                   await refresh()
+               except BaseException:
+                   # Lỗi hoặc bị hủy giữa lúc gọi /key/info: bỏ cờ _refreshing để lần sau vẫn đối chiếu được.
+                   self.refresh_failed()
+                   raise
+           with self._cond:
+               reservation = self._try_reserve(model, modality, price)
+               if reservation is not None:
+                   return reservation
+               wait = min(deadline - time.monotonic(), self._until_refresh() or 1.0, 1.0)
+           if wait <= 0:
+               self._refuse(model, modality, price)
+               return None
+           await asyncio.sleep(wait)
+
+
+   def settle(self, reservation: Optional[Reservation], charged: bool) -> None:
+       """Kết thúc một request: charged=True tính chi phí vào spend, False trả lại phần đã giữ."""
+       if reservation is None or reservation.cost <= 0:
+           return
+       with self._cond:
+           self._reserved = max(0.0, self._reserved - reservation.cost)
+           self._reserved_price = max(0.0, self._reserved_price - reservation.price)
+           if charged and not self.enabled:
+               self._untracked += reservation.cost
+           elif charged:
+               self._committed.append((time.time(), reservation.price, reservation.cost))
+           self._cond.notify_all()
+
+
+   # --- Đối chiếu với /key/info ---
+
+   def _until_refresh(self) -> float:
+       if self._last_refresh is None:
+           return 0.0
+       return max(0.0, self._last_refresh + self.refresh_interval - time.monotonic())
+
+
+   def needs_refresh(self) -> bool:
+       """
+       True nếu đã đến hạn gọi /key/info; chỉ một caller nhận True (caller đó phải gọi
+       reconcile hoặc refresh_failed sau khi gọi xong).
+       """
+       with self._cond:
+           if self._refreshing or self._until_refresh() > 0:
+               return False
+           self._refreshing = True
+           return True
+
+
+   def reconcile(self, key_info: Optional[Dict[str, Any]], started_at: float) -> None:
+       """
+       Thay phần chi phí ước lượng bằng spend thực tế từ /key/info.
+
+       Args:
+           key_info (Optional[Dict]): Phản hồi của /key/info ({"info": {"spend", "max_budget"}}).
+           started_at (float): time.time() lúc gửi /key/info; request xong sau thời điểm này
+               có thể chưa có trong spend nên vẫn được giữ lại trong phần ước lượng.
+       """
+       info = (key_info or {}).get("info") or {}
+       if info.get("spend") is None:
+           self.refresh_failed()
+           return
+       spend = float(info["spend"])
+       with self._cond:
+           settled = [entry for entry in self._committed if entry[0] < started_at]
+           self._committed = [entry for entry in self._committed if entry[0] >= started_at]
+           if self._synced_spend is not None and spend > self._synced_spend:
+               # Phần spend tăng thêm chắc chắn gồm các request đã xong trước started_at, và có thể
+               # gồm cả request đang chạy/xong trong lúc gọi /key/info (server tính phí khi nhận
+               # request). Hệ số giá thực nằm trong [delta / tối đa, delta / tối thiểu]; chỉ kéo
+               # scale về khoảng đó khi nó nằm ngoài.
+               delta = spend - self._synced_spend
+               lower = sum(price for _, price, _ in settled)
+               upper = lower + sum(price for _, price, _ in self._committed) + self._reserved_price
+               if upper > 0:
+                   target = max(self.scale, delta / upper)
+                   if lower > 0:
+                       target = min(target, delta / lower)
+                   self.scale = 0.5 * self.scale + 0.5 * min(_MAX_SCALE, max(_MIN_SCALE, target))
+           self._synced_spend = spend
+           if info.get("max_budget") is not None:
+               self._key_budget = float(info["max_budget"])
+           self._last_refresh = time.monotonic()
+           self._refreshing = False
+           self._cond.notify_all()
+       logger.debug("Đối chiếu /key/info: spend $%.4f, hệ số giá %.2f.", spend, self.scale)
+
+
+   def refresh_failed(self) -> None:
+       """Gọi /key/info thất bại: dùng tiếp ước lượng và thử lại sau refresh_interval."""
+       with self._cond:
+           self._last_refresh = time.monotonic()
+           self._refreshing = False
+           self._cond.notify_all()
+       logger.warning("Không thể đối chiếu spend với /key/info, tiếp tục dùng ước lượng.")
+
+
+   def stats(self) -> Dict[str, Any]:
+       with self._cond:
+           return {
+               "synced_spend": self._synced_spend,
+               "projected": self._projected(),
+               "reserved": self._reserved,
+               "limit": self.limit(),
+               "scale": self.scale,
+               "refusals": self.refusals
+           }
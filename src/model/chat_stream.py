@@ -0,0 +1,220 @@
+# File: src/model/chat_stream.py
+
+
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.model.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Hàm nhận từng đoạn text mới của câu trả lời (delta.content) ngay khi server gửi tới.
+DeltaCallback = Callable[[str], None]
+
+
+class SSEDecoder:
+   """Tách body text/event-stream (nhận theo từng khối byte) thành dữ liệu của từng event (trường data)."""
+
+   def __init__(self):
+       self._buf = b""
+       self._data: List[str] = []
+
+
+   def feed(self, chunk: bytes) -> List[str]:
+       events = []
+       self._buf += chunk
+       # Byte '\n' không xuất hiện bên trong ký tự UTF-8 nhiều byte nên tách theo byte là an toàn.
+       *lines, self._buf = self._buf.split(b"\n")
+       for line in lines:
+           self._line(line.rstrip(b"\r").decode("utf-8"), events)
+       return events
+
+
+   def close(self) -> List[str]:
+       """Event cuối cùng nếu body kết thúc mà không có dòng trống."""
+       events = []
+       if self._buf:
+           self._line(self._buf.rstrip(b"\r").decode("utf-8"), events)
+           self._buf = b""
+       self._line("", events)
+       return events
+
+
+   def _line(self, line: str, events: List[str]) -> None:
+       if not line:
+           if self._data:
+               events.append("\n".join(self._data))
+               self._data = []
+           return
+       if line.startswith(":"):
+           return
+       field, _, value = line.partition(":")
+       if field == "data":
+           self._data.append(value[1:] if value.startswith(" ") else value)
+
+
+class ChatStream:
+   """
+   Ghép các chunk `chat.completion.chunk` của /chat/completions (stream=True) thành một phản hồi
+   `chat.completion` giống hệt khi không stream, đồng thời chuyển từng đoạn text mới cho on_delta.
+   """
+
+   def __init__(self, on_delta: Optional[DeltaCallback] = None):
+       self.on_delta = on_delta
+       self.first_delta_at: Optional[float] = None
+       self._parts: List[str] = []
+       self.reset()
+
+
+   def reset(self) -> None:
+       """Bỏ phần đã nhận của một lần gửi thất bại trước khi có text (xem started)."""
+       self.done = False
+       self._sse = SSEDecoder()
+       self._meta: Dict[str, Any] = {}
+       self._chunks = 0
+       self._finish_reason: Optional[str] = None
+       self._usage: Optional[Dict[str, Any]] = None
+
+
+   @property
+   def started(self) -> bool:
+       """Đã có text được chuyển cho on_delta (gửi lại request sẽ làm lặp nội dung)."""
+       return bool(self._parts)
+
+
+   def feed(self, chunk: bytes) -> None:
+       for data in self._sse.feed(chunk):
+           self._event(data)
+
+
+   def close(self) -> Dict[str, Any]:
+       """Phản hồi đã ghép; ValueError nếu stream không có chunk nào."""
+       for data in self._sse.close():
+           self._event(data)
+       if not self._chunks:
+           raise ValueError("Stream không có chunk nào.")
+       result = {
+           "id": self._meta.get("id"),
+           "object": "chat.completion",
+           "created": self._meta.get("created"),
+           "model": self._meta.get("model"),
+           "choices": [{
+               "index": 0,
+               "finish_reason": self._finish_reason,
+               "message": {"role": "assistant", "content": "".join(self._parts)},
+           }],
+       }
+       if self._usage is not None:
+           result["usage"] = self._usage
+       return result
+
+
+   def replay(self, result: Dict[str, Any]) -> Dict[str, Any]:
+       """Phản hồi lấy từ cache: chuyển toàn bộ nội dung cho on_delta như một delta duy nhất."""
+       content = result["choices"][0]["message"]["content"]
+       if content:
+           self._delta(content)
+       return result
+
+
+   def _event(self, data: str) -> None:
+       if data.strip() == "[DONE]":
+           self.done = True
+           return
+       chunk = json.loads(data)
+       if "error" in chunk:
+           raise ValueError(f"Lỗi trong stream: {chunk['error']}")
+       for field in ("id", "created", "model"):
+           if chunk.get(field) is not None:
+               self._meta[field] = chunk[field]
+       self._chunks += 1
+       if chunk.get("usage"):
+           self._usage = chunk["usage"]
+       for choice in chunk.get("choices") or []:
+           if choice.get("index", 0) != 0:
+               continue
+           content = (choice.get("delta") or {}).get("content")
+           if content:
+               self._delta(content)
+           if choice.get("finish_reason"):
+               self._finish_reason = choice["finish_reason"]
+
+
+   def _delta(self, content: str) -> None:
+       if self.first_delta_at is None:
+           self.first_delta_at = time.perf_counter()
+       self._parts.append(content)
+       if self.on_delta is not None:
+           self.on_delta(content)
+
+
+class JSONItemExtractor:
+   """
+   Đọc dần text của model (có thể kèm ```json``` và lời dẫn) và trả về từng object JSON là phần tử
+   của mảng đầu tiên trong document ngay khi object đó đóng ngoặc, ví dụ từng scene của
+   {"scenarios": [{...}, {...}]}, thay vì chờ toàn bộ câu trả lời rồi mới parse.
+   Text trước ký tự '{' hoặc '[' đầu tiên và sau khi document đóng lại được bỏ qua.
+   """
+
+   def __init__(self):
+       self.items: List[Any] = []
+       self._stack: List[str] = []
+       self._in_string = False
+       self._escape = False
+       self._finished = False
+       self._array_depth: Optional[int] = None
+       self._item: Optional[List[str]] = None
+
+
+   def feed(self, text: str) -> List[Any]:
+       """Các object mới hoàn chỉnh trong đoạn text này (theo thứ tự)."""
+       found = []
+       for char in text:
+           if self._finished:
+               break
+           if self._item is not None:
+               self._item.append(char)
+           if self._in_string:
+               if self._escape:
+                   self._escape = False
+               elif char == "\\":
+                   self._escape = True
+               elif char == '"':
+                   self._in_string = False
+               continue
+           if not self._stack and char not in "{[":
+               continue
+           if char == '"':
+               self._in_string = True
+           elif char in "{[":
+               self._open(char)
+           elif char in "}]":
+               self._close(char, found)
+       self.items.extend(found)
+       return found
+
+
+   def _open(self, char: str) -> None:
+       self._stack.append(char)
+       if char == "[" and self._array_depth is None:
+           self._array_depth = len(self._stack)
+       elif char == "{" and self._item is None and len(self._stack) - 1 == self._array_depth:
+           self._item = ["{"]
+
+
+   def _close(self, char: str, found: List[Any]) -> None:
+       if not self._stack:
+           return
+       self._stack.pop()
+       if self._item is not None and char == "}" and len(self._stack) == self._array_depth:
+           text = "".join(self._item)
+           self._item = None
+           try:
+               found.append(json.loads(text))
+           except json.JSONDecodeError:
+               logger.warning("Bỏ qua object JSON không hợp lệ: %.200s", text)
+       if not self._stack:
+           self._finished = True
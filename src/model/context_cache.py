@@ -0,0 +1,201 @@
+# File: src/model/context_cache.py
+
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from src.model.gemini_files import parse_timestamp
+from src.model.log import get_logger
+from src.model.transfer import write_file_atomic
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_CONTEXT_REGISTRY = ".cache/gemini_contexts.json"
+
+# Thời gian sống khi tạo cache. Gemini tính phí lưu trữ theo token-giờ nên giữ ngắn, và chỉ gia hạn
+# (PATCH ttl) khi cache vẫn đang được dùng lúc sắp hết hạn.
+DEFAULT_CONTEXT_TTL = 600.0
+
+# Gia hạn khi cache còn ít hơn ngần này giây trước expireTime.
+DEFAULT_CONTEXT_REFRESH_MARGIN = 60.0
+
+# Gemini từ chối cache nhỏ hơn mức tối thiểu (1024 token với 2.5 Flash, 4096 với 2.5 Pro);
+# context ngắn hơn được gửi thẳng trong request.
+DEFAULT_MIN_CONTEXT_TOKENS = 1024
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+   """Ước lượng số token (~4 ký tự/token, như estimate_chat_tokens trong src/model/rate_limit.py)."""
+   return sum(len(text) for text in texts if text) // 4
+
+
+def text_content(text: str, role: str = "user") -> Dict[str, Any]:
+   return {"role": role, "parts": [{"text": text}]}
+
+
+def gemini_text(response: Optional[Dict[str, Any]]) -> Optional[str]:
+   """Nội dung text của candidate đầu tiên trong phản hồi generateContent, None nếu không có."""
+   try:
+       parts = response["candidates"][0]["content"]["parts"]
+   except (KeyError, IndexError, TypeError):
+       return None
+   return "".join(part.get("text", "") for part in parts)
+
+
+class CachedContentName(str):
+   """
+   Tên cachedContent trong payload generateContent, được gửi đi như một chuỗi bình thường. digest là
+   SHA-256 của context (model, system instruction, nội dung): ResponseCache tạo key từ digest thay vì
+   tên do server đặt, vốn đổi mỗi khi cache được tạo lại.
+   """
+
+   def __new__(cls, name: str, key: str) -> "CachedContentName":
+       value = super().__new__(cls, name)
+       value.digest = key.rsplit(":", 1)[-1]
+       return value
+
+
+class ContextCacheRegistry:
+   """
+   Danh sách cục bộ các context đã được cache phía provider (Gemini cachedContents qua /gemini/v1beta).
+
+   Một prefix dài dùng chung cho nhiều request (câu chuyện, danh sách scenario, ...) được tạo thành
+   cachedContent một lần; các request generateContent sau chỉ gửi phần câu hỏi cùng tên cache, nên
+   token của prefix được tính giá cache (rẻ hơn) và server không phải xử lý lại prefix (TTFT thấp hơn).
+   Entry được định danh theo model, system instruction, nội dung prefix và API key/base URL. Cache sắp
+   hết hạn mà vẫn được dùng thì bot gia hạn bằng PATCH ttl; cache đã hết hạn hoặc bị server báo không
+   còn tồn tại thì bị bỏ để bot tạo lại. Danh sách được lưu ra file JSON (ghi atomic) như GeminiFileRegistry.
+   """
+
+   def __init__(
+       self,
+       path: Optional[str] = DEFAULT_CONTEXT_REGISTRY,
+       ttl: float = DEFAULT_CONTEXT_TTL,
+       refresh_margin: float = DEFAULT_CONTEXT_REFRESH_MARGIN,
+       min_tokens: int = DEFAULT_MIN_CONTEXT_TOKENS
+   ):
+       """
+       Args:
+           path (Optional[str]): File JSON lưu danh sách; None để chỉ giữ trong bộ nhớ.
+           ttl (float): Thời gian sống (giây) khi tạo hoặc gia hạn cache.
+           refresh_margin (float): Số giây trước expireTime mà cache được gia hạn trước khi dùng.
+           min_tokens (int): Context ước lượng ít token hơn thì không cache.
+       """
+       self.path = path
+       self.ttl = ttl
+       self.refresh_margin = refresh_margin
+       self.min_tokens = min_tokens
+       self.hits = 0
+       self.creates = 0
+       self.extensions = 0
+       self._lock = threading.Lock()
+       self._key_locks: Dict[str, threading.Lock] = {}
+       self._entries: Dict[str, Dict[str, Any]] = {}
+       if path and os.path.exists(path):
+           try:
+               with open(path, "r", encoding="utf-8") as f:
+                   self._entries = json.load(f)
+           except (OSError, json.JSONDecodeError) as e:
+               logger.warning("Không đọc được danh sách context cache %s: %s", path, e)
+
+
+   @classmethod
+   def from_env(cls) -> Optional["ContextCacheRegistry"]:
+       """
+       Bật context caching khi có GEMINI_CONTEXT_REGISTRY (đường dẫn file JSON, vd. .cache/gemini_contexts.json);
+       GEMINI_CONTEXT_TTL, GEMINI_CONTEXT_REFRESH_MARGIN (giây) và GEMINI_CONTEXT_MIN_TOKENS ghi đè mặc định.
+       """
+       path = os.getenv("GEMINI_CONTEXT_REGISTRY")
+       if not path:
+           return None
+       return cls(
+           path,
+           ttl=float(os.getenv("GEMINI_CONTEXT_TTL", DEFAULT_CONTEXT_TTL)),
+           refresh_margin=float(os.getenv("GEMINI_CONTEXT_REFRESH_MARGIN", DEFAULT_CONTEXT_REFRESH_MARGIN)),
+           min_tokens=int(os.getenv("GEMINI_CONTEXT_MIN_TOKENS", DEFAULT_MIN_CONTEXT_TOKENS)),
+       )
+
+
+   def cacheable(self, context: str, system_instruction: Optional[str] = None) -> bool:
+       return estimate_tokens(context, system_instruction) >= self.min_tokens
+
+
+   def key(self, model: str, contents: List[Dict[str, Any]], system_instruction: Optional[str], scope: str) -> str:
+       """Key của một prefix: SHA-256 của model + system instruction + contents, kèm scope (cache thuộc về project của API key)."""
+       ident = json.dumps([model, system_instruction, contents], ensure_ascii=False, sort_keys=True)
+       return f"{scope}:{hashlib.sha256(ident.encode('utf-8')).hexdigest()}"
+
+
+   def lock(self, key: str) -> threading.Lock:
+       """Lock theo key: các thread cùng cần một prefix chờ nhau thay vì cùng tạo cache."""
+       with self._lock:
+           return self._key_locks.setdefault(key, threading.Lock())
+
+
+   def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+       """Entry chưa hết hạn (có thể cần gia hạn, xem needs_refresh), None nếu cần tạo cache."""
+       with self._lock:
+           entry = self._entries.get(key)
+           if entry is None:
+               return None
+           if entry["expires_at"] <= time.time():
+               logger.info("Context cache %s đã hết hạn, sẽ tạo lại.", entry["name"])
+               del self._entries[key]
+               self._save()
+               return None
+           self.hits += 1
+           return entry
+
+
+   def needs_refresh(self, entry: Dict[str, Any]) -> bool:
+       return entry["expires_at"] - self.refresh_margin <= time.time()
+
+
+   def register(self, key: str, cached: Dict[str, Any], extended: bool = False) -> Dict[str, Any]:
+       """Ghi nhận cache vừa tạo hoặc vừa gia hạn (resource cachedContent trả về từ API)."""
+       now = time.time()
+       with self._lock:
+           previous = self._entries.get(key) or {}
+           entry = {
+               "name": cached["name"],
+               "model": cached.get("model") or previous.get("model"),
+               "tokens": int((cached.get("usageMetadata") or {}).get("totalTokenCount") or previous.get("tokens") or 0),
+               "created_at": previous.get("created_at", now) if extended else now,
+               "expires_at": parse_timestamp(cached.get("expireTime")) or now + self.ttl,
+           }
+           if extended:
+               self.extensions += 1
+           else:
+               self.creates += 1
+           self._entries[key] = entry
+           self._save()
+       return entry
+
+
+   def invalidate(self, key: str) -> None:
+       with self._lock:
+           if self._entries.pop(key, None) is not None:
+               self._save()
+
+
+   def _save(self) -> None:
+       if not self.path:
+           return
+       now = time.time()
+       live = {k: v for k, v in self._entries.items() if v["expires_at"] > now}
+       self._entries = live
+       try:
+           write_file_atomic(self.path, json.dumps(live, ensure_ascii=False, indent=1).encode("utf-8"))
+       except OSError as e:
+           logger.warning("Không ghi được danh sách context cache %s: %s", self.path, e)
+
+
+   def stats(self) -> Dict[str, int]:
+       with self._lock:
+           return {"entries": len(self._entries), "hits": self.hits, "creates": self.creates, "extensions": self.extensions}
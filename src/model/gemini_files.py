@@ -0,0 +1,183 @@
+# File: src/model/gemini_files.py
+
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from src.model.log import get_logger
+from src.model.transfer import write_file_atomic
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_FILE_REGISTRY = ".cache/gemini_files.json"
+
+# File trên Gemini Files API bị xóa sau 48 giờ; dùng khi phản hồi không có expirationTime.
+DEFAULT_FILE_TTL = 48 * 3600
+
+# Upload lại khi file còn ít hơn ngần này giây trước khi hết hạn (request dài, video, ...).
+DEFAULT_REFRESH_MARGIN = 3600.0
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+   """Chuyển thời điểm RFC 3339 của Google (vd. '2025-10-19T08:00:00.123456789Z') sang epoch."""
+   if not value:
+       return None
+   text = value.replace("Z", "+00:00")
+   # Google trả tới 9 chữ số thập phân, fromisoformat chỉ nhận tối đa 6.
+   if "." in text:
+       head, rest = text.split(".", 1)
+       digits = len(rest) - len(rest.lstrip("0123456789"))
+       text = f"{head}.{rest[:min(digits, 6)]}{rest[digits:]}"
+   try:
+       return datetime.fromisoformat(text).timestamp()
+   except ValueError:
+       return None
+
+
+class FilePart(dict):
+   """
+   Part generateContent tham chiếu tới một file đã upload (thay cho inlineData base64), được gửi đi
+   như một dict bình thường. digest là SHA-256 nội dung file: ResponseCache tạo key từ digest thay vì
+   fileUri, vốn đổi sau mỗi lần upload lại.
+   """
+
+   def __init__(self, entry: Dict[str, Any], digest: str):
+       super().__init__(fileData={"mimeType": entry["mime_type"], "fileUri": entry["uri"]})
+       self.digest = digest
+
+
+def file_part(entry: Dict[str, Any], key: str) -> FilePart:
+   """Part cho entry của registry với key (scope:sha256, xem GeminiFileRegistry.key)."""
+   return FilePart(entry, key.rsplit(":", 1)[-1])
+
+
+class GeminiFileRegistry:
+   """
+   Danh sách cục bộ các file đã upload lên Gemini Files API (/gemini/upload/v1beta/files).
+
+   Mỗi entry được định danh theo nội dung file (SHA-256) và API key/base URL đã upload nó, nên
+   cùng một ảnh tham chiếu chỉ được upload một lần rồi dùng lại bằng fileUri trong mọi request
+   generateContent sau đó. Entry sắp hết hạn (xem refresh_margin) hoặc bị server báo không còn
+   tồn tại thì bị bỏ để bot upload lại. Danh sách được lưu ra file JSON (ghi atomic); nhiều
+   process dùng chung file chỉ có thể upload trùng, không làm hỏng dữ liệu.
+   """
+
+   def __init__(self, path: Optional[str] = DEFAULT_FILE_REGISTRY, refresh_margin: float = DEFAULT_REFRESH_MARGIN):
+       """
+       Args:
+           path (Optional[str]): File JSON lưu danh sách; None để chỉ giữ trong bộ nhớ.
+           refresh_margin (float): Số giây trước expirationTime mà file được coi là hết hạn.
+       """
+       self.path = path
+       self.refresh_margin = refresh_margin
+       self.hits = 0
+       self.uploads = 0
+       self._lock = threading.Lock()
+       self._key_locks: Dict[str, threading.Lock] = {}
+       # (path, size, mtime) -> SHA-256 để không phải đọc lại ảnh ở mỗi request.
+       self._digests: Dict[Tuple[str, int, float], str] = {}
+       self._entries: Dict[str, Dict[str, Any]] = {}
+       if path and os.path.exists(path):
+           try:
+               with open(path, "r", encoding="utf-8") as f:
+                   self._entries = json.load(f)
+           except (OSError, json.JSONDecodeError) as e:
+               logger.warning("Không đọc được danh sách file Gemini %s: %s", path, e)
+
+
+   @classmethod
+   def from_env(cls) -> Optional["GeminiFileRegistry"]:
+       """
+       Bật upload-once khi có GEMINI_FILE_REGISTRY (đường dẫn file JSON, vd. .cache/gemini_files.json);
+       GEMINI_FILE_REFRESH_MARGIN (giây) ghi đè refresh_margin.
+       """
+       path = os.getenv("GEMINI_FILE_REGISTRY")
+       if not path:
+           return None
+       return cls(path, float(os.getenv("GEMINI_FILE_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN)))
+
+
+   def key(self, path: str, scope: str) -> str:
+       """Key của một file cục bộ: SHA-256 nội dung + scope (file Gemini thuộc về project của API key)."""
+       stat = os.stat(path)
+       ident = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+       with self._lock:
+           digest = self._digests.get(ident)
+       if digest is None:
+           h = hashlib.sha256()
+           with open(path, "rb") as f:
+               for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                   h.update(chunk)
+           digest = h.hexdigest()
+           with self._lock:
+               self._digests[ident] = digest
+       return f"{scope}:{digest}"
+
+
+   def lock(self, key: str) -> threading.Lock:
+       """Lock theo key: các thread cùng cần một ảnh chờ nhau thay vì cùng upload."""
+       with self._lock:
+           return self._key_locks.setdefault(key, threading.Lock())
+
+
+   def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+       """Entry còn dùng được (chưa tới refresh_margin trước khi hết hạn), None nếu cần upload."""
+       with self._lock:
+           entry = self._entries.get(key)
+           if entry is None:
+               return None
+           if entry["expires_at"] - self.refresh_margin <= time.time():
+               logger.info("File %s sắp hết hạn, sẽ upload lại.", entry["name"])
+               del self._entries[key]
+               self._save()
+               return None
+           self.hits += 1
+           return entry
+
+
+   def register(self, key: str, file: Dict[str, Any], mime_type: str) -> Dict[str, Any]:
+       """Ghi nhận file vừa upload (resource `file` trả về từ Files API)."""
+       now = time.time()
+       entry = {
+           "name": file["name"],
+           "uri": file["uri"],
+           "mime_type": file.get("mimeType") or mime_type,
+           "size": int(file.get("sizeBytes") or 0),
+           "uploaded_at": now,
+           "expires_at": parse_timestamp(file.get("expirationTime")) or now + DEFAULT_FILE_TTL,
+       }
+       with self._lock:
+           self.uploads += 1
+           self._entries[key] = entry
+           self._save()
+       return entry
+
+
+   def invalidate(self, key: str) -> None:
+       with self._lock:
+           if self._entries.pop(key, None) is not None:
+               self._save()
+
+
+   def _save(self) -> None:
+       if not self.path:
+           return
+       now = time.time()
+       live = {k: v for k, v in self._entries.items() if v["expires_at"] > now}
+       self._entries = live
+       try:
+           write_file_atomic(self.path, json.dumps(live, ensure_ascii=False, indent=1).encode("utf-8"))
+       except OSError as e:
+           logger.warning("Không ghi được danh sách file Gemini %s: %s", self.path, e)
+
+
+   def stats(self) -> Dict[str, int]:
+       with self._lock:
+           return {"entries": len(self._entries), "hits": self.hits, "uploads": self.uploads}
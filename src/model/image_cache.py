@@ -0,0 +1,147 @@
+# File: src/model/image_cache.py
+
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Tuple
+
+
+# (đường dẫn tuyệt đối, mtime_ns, kích thước) - file đổi nội dung sẽ có key mới.
+_FileKey = Tuple[str, int, int]
+
+
+class EncodedImageCache:
+   """
+   Cache trong bộ nhớ cho nội dung base64 của các ảnh đầu vào được dùng lại nhiều lần
+   (ví dụ ảnh nhân vật tham chiếu cho mọi scene).
+
+   Key là đường dẫn + mtime + kích thước file nên ảnh bị sửa sẽ được mã hóa lại.
+   Tổng dung lượng bị giới hạn bởi max_bytes, entry ít dùng nhất bị loại trước (LRU);
+   ảnh lớn hơn max_bytes không được cache mà được stream trực tiếp từ file.
+   Nhiều thread cùng cần một ảnh chưa có trong cache (các scene chạy song song dùng chung ảnh
+   nhân vật) thì chỉ một thread mã hóa, các thread còn lại chờ kết quả đó.
+   """
+
+   # Số digest tối đa được ghi nhớ (digest rất nhỏ nên giữ cả cho ảnh không cache được).
+   MAX_DIGESTS = 1024
+
+   def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+       """
+       Args:
+           max_bytes (int): Dung lượng tối đa (byte) của dữ liệu base64 được giữ trong bộ nhớ.
+       """
+       self.max_bytes = max_bytes
+       self.hits = 0
+       self.misses = 0
+       self.evictions = 0
+       self._lock = threading.Lock()
+       self._entries: "OrderedDict[_FileKey, bytes]" = OrderedDict()
+       self._digests: "OrderedDict[_FileKey, str]" = OrderedDict()
+       # Ảnh đang được mã hóa -> Future của kết quả, cho các thread cùng cần ảnh đó.
+       self._pending: Dict[_FileKey, Future] = {}
+       self._size = 0
+
+
+   @staticmethod
+   def file_key(path: str) -> _FileKey:
+       stat = os.stat(path)
+       return (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+
+   def fits(self, encoded_length: int) -> bool:
+       """Ảnh có kích thước base64 này có được cache hay không."""
+       return 0 < encoded_length <= self.max_bytes
+
+
+   def encoded(self, path: str, encode: Callable[[], bytes]) -> bytes:
+       """
+       Lấy nội dung base64 của file từ cache, hoặc gọi encode() và lưu kết quả.
+
+
+       Args:
+           path (str): Đường dẫn file ảnh.
+           encode (Callable[[], bytes]): Hàm mã hóa toàn bộ file sang base64.
+       """
+       key = self.file_key(path)
+       with self._lock:
+           data = self._entries.get(key)
+           if data is not None:
+               self.hits += 1
+               self._entries.move_to_end(key)
+               return data
+           pending = self._pending.get(key)
+           if pending is None:
+               self.misses += 1
+               pending = self._pending[key] = Future()
+               owner = True
+           else:
+               self.hits += 1
+               owner = False
+       if not owner:
+           return pending.result()
+
+       try:
+           data = encode()
+       except BaseException as e:
+           with self._lock:
+               del self._pending[key]
+           pending.set_exception(e)
+           raise
+       if not self.fits(len(data)):
+           with self._lock:
+               del self._pending[key]
+           pending.set_result(data)
+           return data
+
+       with self._lock:
+           del self._pending[key]
+           # Bỏ các phiên bản cũ của cùng file.
+           for old_key in [k for k in self._entries if k[0] == key[0] and k != key]:
+               self._size -= len(self._entries.pop(old_key))
+           if key not in self._entries:
+               self._entries[key] = data
+               self._size += len(data)
+           while self._size > self.max_bytes:
+               _, evicted = self._entries.popitem(last=False)
+               self._size -= len(evicted)
+               self.evictions += 1
+       pending.set_result(data)
+       return data
+
+
+   def digest(self, path: str, compute: Callable[[], str]) -> str:
+       """Ghi nhớ digest của file (dùng cho key của ResponseCache)."""
+       key = self.file_key(path)
+       with self._lock:
+           value = self._digests.get(key)
+           if value is not None:
+               self._digests.move_to_end(key)
+               return value
+
+       value = compute()
+       with self._lock:
+           self._digests[key] = value
+           while len(self._digests) > self.MAX_DIGESTS:
+               self._digests.popitem(last=False)
+       return value
+
+
+   def clear(self) -> None:
+       with self._lock:
+           self._entries.clear()
+           self._digests.clear()
+           self._size = 0
+
+
+   def stats(self) -> Dict[str, int]:
+       """Số lần hit/miss/evict và dung lượng hiện tại."""
+       with self._lock:
+           return {
+               "hits": self.hits,
+               "misses": self.misses,
+               "evictions": self.evictions,
+               "entries": len(self._entries),
+               "bytes": self._size
+           }
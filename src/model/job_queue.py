@@ -0,0 +1,512 @@
+# File: src/model/job_queue.py
+
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from src.model.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_JOB_DB = ".cache/video_jobs.sqlite"
+
+# Thời gian (giây) tối đa một node chờ job của mình: không có worker nào chạy thì job không bao giờ xong.
+DEFAULT_WAIT_TIMEOUT = 3600.0
+
+# Trạng thái của một job: chưa gửi, đã có operation_name, đã tải xong, thất bại hẳn.
+PENDING = "pending"
+SUBMITTED = "submitted"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    request TEXT NOT NULL,
+    operation_name TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS video_jobs_state ON video_jobs (state, lease_expires);
+"""
+
+
+def job_id_for(request: Dict[str, Any]) -> str:
+   """
+   Id ổn định của một request: cùng model, prompt, ảnh và tham số cho cùng id. output_file không
+   được tính vì các node đặt tên file theo thời gian; chạy lại graph vẫn tìm thấy job cũ.
+   """
+   material = json.dumps(
+       {k: v for k, v in request.items() if k != "output_file"},
+       sort_keys=True, ensure_ascii=False, separators=(",", ":")
+   )
+   return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+def _result_exists(result: Optional[Dict[str, Any]]) -> bool:
+   return bool(result) and bool(result.get("file_path")) and os.path.exists(result["file_path"])
+
+
+class VideoJobQueue:
+   """
+   Hàng đợi job sinh video lưu trong SQLite, dùng chung giữa nhiều process.
+
+   operation_name trả về từ predictLongRunning được ghi ngay khi có, nên nếu process chết
+   giữa chừng, worker khác (hoặc chính nó sau khi khởi động lại) sẽ tiếp tục polling và tải
+   video của tác vụ đó thay vì gửi lại request (đã tốn tiền). Mỗi job được một worker giữ
+   bằng lease có hạn; worker phải gia hạn lease định kỳ, lease hết hạn thì job được trả lại
+   hàng đợi.
+   """
+
+   def __init__(self, path: str = DEFAULT_JOB_DB, max_attempts: int = 3):
+       """
+       Args:
+           path (str): File SQLite của hàng đợi.
+           max_attempts (int): Số lần thất bại tối đa của một job trước khi chuyển sang 'failed'.
+       """
+       directory = os.path.dirname(path)
+       if directory:
+           os.makedirs(directory, exist_ok=True)
+       self.path = path
+       self.max_attempts = max_attempts
+       self._lock = threading.Lock()
+       self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+       self._conn.row_factory = sqlite3.Row
+       self._conn.execute("PRAGMA journal_mode=WAL")
+       self._conn.execute("PRAGMA synchronous=NORMAL")
+       self._conn.executescript(_SCHEMA)
+
+
+   def close(self) -> None:
+       with self._lock:
+           self._conn.close()
+
+
+   def __enter__(self) -> "VideoJobQueue":
+       return self
+
+
+   def __exit__(self, *exc_info: Any) -> None:
+       self.close()
+
+
+   def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+       with self._lock:
+           return self._conn.execute(sql, params).fetchall()
+
+
+   @staticmethod
+   def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+       if row is None:
+           return None
+       job = dict(row)
+       job["request"] = json.loads(job["request"])
+       job["result"] = json.loads(job["result"]) if job["result"] else None
+       return job
+
+
+   # --- Phía gửi job ---
+
+   def enqueue(self, request: Dict[str, Any], job_id: Optional[str] = None) -> str:
+       """
+       Thêm một job (tham số của bot.generate_video, gồm output_file) và trả về id của nó.
+
+       Gửi lại cùng một job (mặc định id là hash của request) không tạo job mới: job đang chạy
+       hoặc đã xong được giữ nguyên, job đã thất bại được đưa lại hàng đợi. Job đã xong nhưng
+       file video đã bị xóa được chạy lại với request mới (giữ operation_name để chỉ tải lại).
+       """
+       job_id = job_id or job_id_for(request)
+       now = time.time()
+       existing = self.get(job_id)
+       if existing is not None and existing["state"] == DONE and not _result_exists(existing["result"]):
+           logger.info("File video của job %s không còn, đưa job lại hàng đợi.", job_id)
+           self._query(
+               "UPDATE video_jobs SET state = CASE WHEN operation_name IS NULL THEN ? ELSE ? END, request = ?, "
+               "result = NULL, attempts = 0, error = NULL, updated_at = ? WHERE id = ? AND state = ?",
+               (PENDING, SUBMITTED, json.dumps(request, ensure_ascii=False), now, job_id, DONE)
+           )
+       self._query(
+           "INSERT INTO video_jobs (id, state, request, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+           "ON CONFLICT (id) DO UPDATE SET state = CASE WHEN operation_name IS NULL THEN ? ELSE ? END, "
+           "attempts = 0, error = NULL, updated_at = ? WHERE state = ?",
+           (job_id, PENDING, json.dumps(request, ensure_ascii=False), now, now, PENDING, SUBMITTED, now, FAILED)
+       )
+       return job_id
+
+
+   def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+       rows = self._query("SELECT * FROM video_jobs WHERE id = ?", (job_id,))
+       return self._to_dict(rows[0]) if rows else None
+
+
+   def wait(self, job_id: str, timeout: Optional[float] = None, interval: float = 2.0) -> Optional[Dict[str, Any]]:
+       """Chờ job xong (do một worker bất kỳ xử lý); trả về kết quả tải video hoặc None nếu thất bại/hết giờ."""
+       deadline = None if timeout is None else time.monotonic() + timeout
+       while True:
+           job = self.get(job_id)
+           if job is None:
+               raise KeyError(f"Không có job video nào có id: {job_id}")
+           if job["state"] in (DONE, FAILED):
+               return job["result"] if job["state"] == DONE else None
+           if deadline is not None and time.monotonic() >= deadline:
+               logger.error("Hết thời gian chờ job video %s (trạng thái: %s); có worker nào đang chạy không?", job_id, job["state"])
+               return None
+           time.sleep(interval)
+
+
+   async def await_job(self, job_id: str, timeout: Optional[float] = None, interval: float = 2.0) -> Optional[Dict[str, Any]]:
+       """Bản async của wait (chờ bằng asyncio.sleep)."""
+       deadline = None if timeout is None else time.monotonic() + timeout
+       while True:
+           job = await asyncio.to_thread(self.get, job_id)
+           if job is None:
+               raise KeyError(f"Không có job video nào có id: {job_id}")
+           if job["state"] in (DONE, FAILED):
+               return job["result"] if job["state"] == DONE else None
+           if deadline is not None and time.monotonic() >= deadline:
+               logger.error("Hết thời gian chờ job video %s (trạng thái: %s); có worker nào đang chạy không?", job_id, job["state"])
+               return None
+           await asyncio.sleep(interval)
+
+
+   def unfinished(self) -> int:
+       """Số job chưa xong (đang chờ hoặc đang được một worker xử lý)."""
+       return self._query("SELECT COUNT(*) FROM video_jobs WHERE state IN (?, ?)", (PENDING, SUBMITTED))[0][0]
+
+
+   def stats(self) -> Dict[str, int]:
+       rows = self._query("SELECT state, COUNT(*) FROM video_jobs GROUP BY state")
+       return {state: count for state, count in rows}
+
+
+   # --- Phía worker ---
+
+   def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+       """
+       Lấy một job chưa xong và chưa bị worker nào giữ (hoặc lease đã hết hạn).
+
+       Job đã có operation_name được ưu tiên để tiếp tục các video đã trả tiền trước.
+       BEGIN IMMEDIATE khóa ghi file SQLite nên hai process không lấy trùng một job.
+       """
+       now = time.time()
+       with self._lock:
+           self._conn.execute("BEGIN IMMEDIATE")
+           try:
+               row = self._conn.execute(
+                   "SELECT * FROM video_jobs WHERE state IN (?, ?) AND (lease_expires IS NULL OR lease_expires < ?) "
+                   "ORDER BY operation_name IS NULL, created_at LIMIT 1",
+                   (PENDING, SUBMITTED, now)
+               ).fetchone()
+               if row is not None:
+                   self._conn.execute(
+                       "UPDATE video_jobs SET lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                       (worker_id, now + lease_seconds, now, row["id"])
+                   )
+               self._conn.execute("COMMIT")
+           except BaseException:
+               self._conn.execute("ROLLBACK")
+               raise
+       job = self._to_dict(row)
+       if job is not None:
+           job["lease_owner"] = worker_id
+       return job
+
+
+   def renew(self, worker_id: str, job_ids: List[str], lease_seconds: float) -> List[str]:
+       """Gia hạn lease của các job worker đang giữ; trả về các job đã mất lease (bị worker khác lấy)."""
+       if not job_ids:
+           return []
+       now = time.time()
+       placeholders = ",".join("?" * len(job_ids))
+       self._query(
+           f"UPDATE video_jobs SET lease_expires = ? WHERE lease_owner = ? AND id IN ({placeholders})",
+           (now + lease_seconds, worker_id, *job_ids)
+       )
+       rows = self._query(
+           f"SELECT id FROM video_jobs WHERE lease_owner = ? AND id IN ({placeholders})",
+           (worker_id, *job_ids)
+       )
+       owned = {row["id"] for row in rows}
+       return [job_id for job_id in job_ids if job_id not in owned]
+
+
+   def release(self, worker_id: str, job_id: str) -> None:
+       """Trả job về hàng đợi ngay (ví dụ khi worker dừng) để worker khác tiếp tục."""
+       self._query(
+           "UPDATE video_jobs SET lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+           (time.time(), job_id, worker_id)
+       )
+
+
+   def record_operation(self, job_id: str, operation_name: Optional[str]) -> None:
+       """Ghi (hoặc xóa, với None) operation_name của job ngay sau khi predictLongRunning trả về."""
+       self._query(
+           "UPDATE video_jobs SET operation_name = ?, state = ?, updated_at = ? WHERE id = ?",
+           (operation_name, SUBMITTED if operation_name else PENDING, time.time(), job_id)
+       )
+
+
+   def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+       self._query(
+           "UPDATE video_jobs SET state = ?, result = ?, error = NULL, lease_owner = NULL, lease_expires = NULL, "
+           "updated_at = ? WHERE id = ?",
+           (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+       )
+
+
+   def fail(self, job_id: str, error: str) -> str:
+       """
+       Ghi nhận một lần thất bại. Job được trả lại hàng đợi (giữ operation_name nếu có, để chỉ
+       polling/tải lại) cho đến khi đủ max_attempts lần; trả về trạng thái mới của job.
+       """
+       with self._lock:
+           self._conn.execute(
+               "UPDATE video_jobs SET attempts = attempts + 1, error = ?, lease_owner = NULL, lease_expires = NULL, "
+               "state = CASE WHEN attempts + 1 >= ? THEN ? WHEN operation_name IS NULL THEN ? ELSE ? END, "
+               "updated_at = ? WHERE id = ? AND state IN (?, ?)",
+               (error, self.max_attempts, FAILED, PENDING, SUBMITTED, time.time(), job_id, PENDING, SUBMITTED)
+           )
+           row = self._conn.execute("SELECT state FROM video_jobs WHERE id = ?", (job_id,)).fetchone()
+       return row["state"] if row else FAILED
+
+
+class VideoJobWorker:
+   """
+   Worker lấy job từ VideoJobQueue và chạy chúng bằng một ThucChienAIBot.
+
+   Job chưa có operation_name được gửi (predictLongRunning) rồi ghi operation_name vào hàng
+   đợi trước khi polling; job đã có operation_name (do worker trước bị dừng/chết) được giao
+   thẳng cho bot.video_poller để polling và tải tiếp. Worker giữ tối đa max_in_flight job cùng
+   lúc; lease của chúng (kể cả job đang gửi predictLongRunning) được gia hạn từ một thread
+   heartbeat riêng, nên request gửi chậm không làm mất lease. Nhiều worker (nhiều process) có
+   thể dùng chung một file hàng đợi.
+   """
+
+   def __init__(
+       self,
+       queue: VideoJobQueue,
+       bot: Any,
+       worker_id: Optional[str] = None,
+       max_in_flight: int = 4,
+       lease_seconds: float = 60.0,
+       idle_interval: float = 2.0
+   ):
+       """
+       Args:
+           queue (VideoJobQueue): Hàng đợi job.
+           bot: ThucChienAIBot (dùng start_video_operation và video_poller).
+           worker_id (Optional[str]): Tên worker trong cột lease_owner; mặc định host:pid:ngẫu nhiên.
+           max_in_flight (int): Số job tối đa worker giữ cùng lúc.
+           lease_seconds (float): Thời hạn lease; job của worker chết được trả lại sau khoảng này.
+           idle_interval (float): Khoảng chờ (giây) giữa hai vòng lấy job và giữa hai lần gia hạn lease.
+       """
+       if idle_interval * 3 > lease_seconds:
+           raise ValueError("lease_seconds phải lớn hơn 3 lần idle_interval để kịp gia hạn lease.")
+       self.queue = queue
+       self.bot = bot
+       self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+       self.max_in_flight = max_in_flight
+       self.lease_seconds = lease_seconds
+       self.idle_interval = idle_interval
+       self._lock = threading.Lock()
+       self._in_flight: Dict[str, Optional[str]] = {}   # job_id -> operation_name (None khi đang gửi)
+       self._stop = threading.Event()
+       self._thread: Optional[threading.Thread] = None
+       self._heartbeat_stop = threading.Event()
+       self._heartbeat: Optional[threading.Thread] = None
+
+
+   def start(self) -> "VideoJobWorker":
+       """Chạy worker trong một thread nền."""
+       self._thread = threading.Thread(target=self.run, name="video-job-worker", daemon=True)
+       self._thread.start()
+       return self
+
+
+   def stop(self, drain: bool = False) -> None:
+       """
+       Dừng lấy job mới. drain=True chờ các job đang giữ xong; ngược lại trả lease của chúng
+       để worker khác tiếp tục ngay (operation_name đã được ghi nên không gửi lại).
+       """
+       self._stop.set()
+       if self._thread is not None:
+           self._thread.join()
+       if drain:
+           # Heartbeat vẫn chạy nên lease của các job đang chờ không hết hạn trong lúc drain.
+           while self.in_flight():
+               time.sleep(self.idle_interval)
+       else:
+           with self._lock:
+               job_ids = list(self._in_flight)
+               self._in_flight.clear()
+           for job_id in job_ids:
+               self.queue.release(self.worker_id, job_id)
+       self._heartbeat_stop.set()
+       if self._heartbeat is not None:
+           self._heartbeat.join()
+
+
+   def in_flight(self) -> int:
+       with self._lock:
+           return len(self._in_flight)
+
+
+   def renew_leases(self) -> None:
+       """Gia hạn lease của mọi job đang giữ; job đã mất lease (bị worker khác lấy) bị bỏ khỏi danh sách."""
+       with self._lock:
+           job_ids = list(self._in_flight)
+       for job_id in self.queue.renew(self.worker_id, job_ids, self.lease_seconds):
+           logger.warning("Worker %s mất lease của job %s.", self.worker_id, job_id)
+           with self._lock:
+               self._in_flight.pop(job_id, None)
+
+
+   def _run_heartbeat(self) -> None:
+       while not self._heartbeat_stop.wait(self.idle_interval):
+           try:
+               self.renew_leases()
+           except Exception as e:
+               logger.error("Worker %s không gia hạn được lease: %s", self.worker_id, e)
+
+
+   def _ensure_heartbeat(self) -> None:
+       if self._heartbeat is None or not self._heartbeat.is_alive():
+           self._heartbeat_stop.clear()
+           self._heartbeat = threading.Thread(target=self._run_heartbeat, name="video-job-heartbeat", daemon=True)
+           self._heartbeat.start()
+
+
+   def run(self, exit_when_idle: bool = False) -> None:
+       """Vòng lặp chính: lấy thêm job khi còn chỗ rồi chờ idle_interval (lease do heartbeat gia hạn)."""
+       logger.info("Worker %s bắt đầu (tối đa %d job).", self.worker_id, self.max_in_flight)
+       self._ensure_heartbeat()
+       while not self._stop.is_set():
+           while self.in_flight() < self.max_in_flight and not self._stop.is_set():
+               job = self.queue.lease(self.worker_id, self.lease_seconds)
+               if job is None:
+                   break
+               self._start_job(job)
+
+           if exit_when_idle and self.in_flight() == 0 and self.queue.unfinished() == 0:
+               break
+           self._stop.wait(self.idle_interval)
+       logger.info("Worker %s dừng.", self.worker_id)
+
+
+   def _start_job(self, job: Dict[str, Any]) -> None:
+       job_id = job["id"]
+       request = dict(job["request"])
+       output_file = request.pop("output_file")
+       operation_name = job["operation_name"]
+
+       # Ghi vào _in_flight trước khi gửi để heartbeat gia hạn lease trong lúc predictLongRunning chạy
+       # (bị rate limiter xếp hàng, timeout, retry...); hết lease thì worker khác sẽ gửi lại job.
+       with self._lock:
+           self._in_flight[job_id] = operation_name
+
+       if operation_name:
+           logger.info("Tiếp tục tác vụ %s của job %s.", operation_name, job_id)
+       else:
+           try:
+               operation_name = self.bot.start_video_operation(**request)
+           except Exception as e:
+               logger.error("Job %s: lỗi khi gửi tác vụ video: %s", job_id, e)
+               operation_name = None
+           with self._lock:
+               owned = job_id in self._in_flight
+               if owned and operation_name is not None:
+                   self._in_flight[job_id] = operation_name
+               elif owned:
+                   del self._in_flight[job_id]
+           if not owned:
+               logger.error("Job %s: mất lease trong lúc gửi, bỏ tác vụ %s.", job_id, operation_name)
+               return
+           if operation_name is None:
+               state = self.queue.fail(job_id, "Không thể khởi tạo tác vụ sinh video.")
+               logger.warning("Job %s: không gửi được tác vụ video (trạng thái: %s).", job_id, state)
+               return
+           self.queue.record_operation(job_id, operation_name)
+
+       self.bot.video_poller.submit(
+           operation_name,
+           output_file,
+           callback=lambda name, result: self._on_done(job_id, name, result)
+       )
+
+
+   def _on_done(self, job_id: str, operation_name: str, result: Optional[Dict[str, Any]]) -> None:
+       with self._lock:
+           owned = self._in_flight.pop(job_id, None) is not None
+       if not owned:
+           # Worker đã trả lease (stop) hoặc mất lease; job thuộc về worker khác.
+           return
+       if result and result.get("status") == "success":
+           self.queue.complete(job_id, result)
+           logger.info("Job %s hoàn tất: %s", job_id, result.get("file_path"))
+           return
+
+       # Tác vụ kết thúc với lỗi thì polling lại vô ích: xóa operation_name để lần sau gửi lại.
+       status = self.bot.get_video_operation(operation_name)
+       if status and status.get("done") and "error" in status:
+           self.queue.record_operation(job_id, None)
+       state = self.queue.fail(job_id, f"Tác vụ {operation_name} không tải được video.")
+       logger.warning("Job %s thất bại (trạng thái: %s).", job_id, state)
+
+
+def main() -> None:
+   import dotenv
+   from src.model.bot import ThucChienAIBot
+   from src.model.log import configure_logging
+
+   dotenv.load_dotenv()
+   configure_logging(force=True)
+
+   parser = argparse.ArgumentParser(description="Worker và trạng thái của hàng đợi job sinh video.")
+   parser.add_argument("--db", default=os.getenv("VIDEO_JOB_DB", DEFAULT_JOB_DB), help="File SQLite của hàng đợi.")
+   commands = parser.add_subparsers(dest="command", required=True)
+   worker = commands.add_parser("worker", help="Chạy một worker đến khi bị dừng (Ctrl+C).")
+   worker.add_argument("--max-in-flight", type=int, default=4)
+   worker.add_argument("--lease-seconds", type=float, default=60.0)
+   worker.add_argument("--poll-interval", type=float, default=5.0, help="Khoảng chờ ban đầu giữa hai lần kiểm tra tác vụ.")
+   worker.add_argument("--exit-when-idle", action="store_true", help="Dừng khi hàng đợi không còn job chưa xong.")
+   commands.add_parser("status", help="In số job theo trạng thái.")
+   args = parser.parse_args()
+
+   with VideoJobQueue(args.db) as queue:
+       if args.command == "status":
+           print(json.dumps(queue.stats(), indent=2))
+           return
+
+       from src.model.video_poller import VideoOperationPoller
+       bot = ThucChienAIBot(api_key=os.getenv("THUC_CHIEN_API_KEY"))
+       bot._video_poller = VideoOperationPoller(bot, initial_interval=args.poll_interval, max_interval=max(30.0, args.poll_interval))
+       job_worker = VideoJobWorker(queue, bot, max_in_flight=args.max_in_flight, lease_seconds=args.lease_seconds)
+       try:
+           job_worker.run(exit_when_idle=args.exit_when_idle)
+       except KeyboardInterrupt:
+           pass
+       finally:
+           # Trả lease để worker khác tiếp tục ngay các tác vụ đã gửi.
+           job_worker.stop()
+           bot.video_poller.close(wait=False)
+
+
+if __name__ == "__main__":
+   main()
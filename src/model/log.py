@@ -0,0 +1,174 @@
+# File: src/model/log.py
+
+
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict, Iterator, Optional, TextIO
+
+
+# Logger gốc của project; mọi module dùng get_logger(__name__) để nằm dưới nó.
+ROOT_LOGGER = "thucchien"
+
+# Số ký tự tối đa của một message (prompt, phản hồi API...) trước khi bị cắt.
+DEFAULT_MAX_CHARS = 2000
+
+# Các trường tương quan (run_id, scene, ...) của tác vụ đang chạy, tự gắn vào mọi log record.
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("thucchien_log_context", default={})
+
+_configure_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_atexit_registered = False
+
+
+@contextlib.contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+   """
+   Gắn các trường tương quan cho mọi log trong khối with (kể cả trong asyncio.to_thread
+   và các node của LangGraph, vì contextvars được sao chép sang task/thread con).
+
+   Ví dụ: with log_context(run_id="abc", scene=3): ...
+   """
+   token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+   try:
+       yield
+   finally:
+       _context.reset(token)
+
+
+def truncate(value: Any, max_chars: Optional[int] = None) -> str:
+   """Chuyển value thành chuỗi, cắt phần cuối nếu dài hơn max_chars (mặc định theo LOG_MAX_CHARS)."""
+   text = value if isinstance(value, str) else str(value)
+   limit = max_chars if max_chars is not None else _max_chars()
+   if limit <= 0 or len(text) <= limit:
+       return text
+   return f"{text[:limit]}... [+{len(text) - limit} ký tự]"
+
+
+def _max_chars() -> int:
+   return int(os.getenv("LOG_MAX_CHARS", DEFAULT_MAX_CHARS))
+
+
+class _ContextFilter(logging.Filter):
+   """Chép các trường của log_context vào record (chạy ở thread gọi log, trước khi vào queue)."""
+
+   def filter(self, record: logging.LogRecord) -> bool:
+       record.context = _context.get()
+       return True
+
+
+class _TruncatingQueueHandler(logging.handlers.QueueHandler):
+   """
+   QueueHandler định dạng message (kèm traceback nếu có) ở thread gọi log và cắt bớt payload
+   lớn trước khi xếp hàng.
+   """
+
+   def __init__(self, log_queue: queue.Queue, max_chars: int):
+       super().__init__(log_queue)
+       self.max_chars = max_chars
+       self.addFilter(_ContextFilter())
+
+
+   def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+       record = super().prepare(record)
+       record.msg = truncate(record.msg, self.max_chars)
+       return record
+
+
+class TextFormatter(logging.Formatter):
+   """Định dạng dễ đọc: thời gian, level, logger, [run_id=... scene=...] message."""
+
+   def __init__(self):
+       super().__init__("%(asctime)s %(levelname)-7s %(name)s %(context_str)s%(message)s")
+
+
+   def format(self, record: logging.LogRecord) -> str:
+       context = getattr(record, "context", None) or {}
+       record.context_str = "".join(f"[{key}={value}] " for key, value in context.items())
+       return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+   """Mỗi log là một dòng JSON (ts, level, logger, msg và các trường tương quan)."""
+
+   def format(self, record: logging.LogRecord) -> str:
+       entry = {
+           "ts": record.created,
+           "level": record.levelname,
+           "logger": record.name,
+           "msg": record.getMessage(),
+           **(getattr(record, "context", None) or {}),
+       }
+       return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(
+   level: Optional[str] = None,
+   fmt: Optional[str] = None,
+   stream: Optional[TextIO] = None,
+   max_chars: Optional[int] = None,
+   force: bool = False
+) -> None:
+   """
+   Cấu hình logger "thucchien": log được xếp vào queue và một thread riêng ghi ra stream,
+   nên thread/event loop gọi log không bị chặn bởi I/O của stdout.
+
+
+   Args:
+       level (Optional[str]): Mức log (DEBUG, INFO, WARNING, ...); mặc định LOG_LEVEL hoặc INFO.
+       fmt (Optional[str]): "text" hoặc "json"; mặc định LOG_FORMAT hoặc "text".
+       stream (Optional[TextIO]): Nơi ghi log; mặc định sys.stdout.
+       max_chars (Optional[int]): Độ dài tối đa của message; mặc định LOG_MAX_CHARS (0 = không cắt).
+       force (bool): Cấu hình lại kể cả khi đã cấu hình trước đó.
+   """
+   global _listener, _atexit_registered
+   with _configure_lock:
+       if _listener is not None and not force:
+           return
+       if _listener is not None:
+           _listener.stop()
+
+       logger = logging.getLogger(ROOT_LOGGER)
+       for handler in list(logger.handlers):
+           logger.removeHandler(handler)
+       logger.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+       logger.propagate = False
+
+       output = logging.StreamHandler(stream or sys.stdout)
+       output.setFormatter(JSONFormatter() if (fmt or os.getenv("LOG_FORMAT", "text")) == "json" else TextFormatter())
+
+       log_queue: queue.Queue = queue.Queue(-1)
+       logger.addHandler(_TruncatingQueueHandler(log_queue, max_chars if max_chars is not None else _max_chars()))
+       _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+       _listener.start()
+       if not _atexit_registered:
+           atexit.register(shutdown_logging)
+           _atexit_registered = True
+
+
+def shutdown_logging() -> None:
+   """Ghi nốt các log còn trong queue và dừng thread ghi log."""
+   global _listener
+   with _configure_lock:
+       if _listener is not None:
+           _listener.stop()
+           _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+   """
+   Logger con của "thucchien" cho module name (thường là __name__).
+
+   Dùng kiểu lazy: logger.debug("Trả lời: %s", response) chỉ định dạng khi mức DEBUG được bật,
+   nên log ở hot path gần như không tốn gì khi tắt. Hàm không cấu hình handler: entrypoint
+   (main.py, CLI của worker, benchmark...) tự gọi configure_logging().
+   """
+   short = name[len("src."):] if name.startswith("src.") else name
+   return logging.getLogger(f"{ROOT_LOGGER}.{short}")
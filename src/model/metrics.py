@@ -0,0 +1,185 @@
+# File: src/model/metrics.py
+
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Bucket (giây) cho thời gian: từ 1ms tới 10 phút, đủ cho cả chat lẫn tải video.
+LATENCY_BUCKETS: Tuple[float, ...] = (
+   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+   2.5, 5.0, 10.0, 25.0, 60.0, 120.0, 300.0, 600.0,
+)
+
+# Bucket (byte) cho kích thước payload/phản hồi: từ 1KB tới 1GB.
+SIZE_BUCKETS: Tuple[float, ...] = tuple(float(1024 * 4 ** i) for i in range(11))
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+   """Histogram dạng bucket cộng dồn (như Prometheus); percentile được nội suy trong bucket."""
+
+   def __init__(self, buckets: Sequence[float]):
+       self.buckets = tuple(buckets)
+       self.counts = [0] * (len(self.buckets) + 1)
+       self.count = 0
+       self.sum = 0.0
+       self.max = 0.0
+
+
+   def observe(self, value: float) -> None:
+       self.counts[bisect.bisect_left(self.buckets, value)] += 1
+       self.count += 1
+       self.sum += value
+       self.max = max(self.max, value)
+
+
+   def percentile(self, q: float) -> float:
+       """Ước lượng percentile q (0-1) bằng nội suy tuyến tính trong bucket chứa nó."""
+       if not self.count:
+           return 0.0
+       rank = q * self.count
+       seen = 0
+       for i, bucket_count in enumerate(self.counts):
+           if seen + bucket_count >= rank and bucket_count:
+               lower = self.buckets[i - 1] if i > 0 else 0.0
+               upper = self.buckets[i] if i < len(self.buckets) else self.max
+               return lower + (upper - lower) * (rank - seen) / bucket_count
+           seen += bucket_count
+       return self.max
+
+
+   def summary(self) -> Dict[str, float]:
+       return {
+           "count": self.count,
+           "sum": self.sum,
+           "max": self.max,
+           "p50": self.percentile(0.50),
+           "p95": self.percentile(0.95),
+           "p99": self.percentile(0.99),
+       }
+
+
+class Metrics:
+   """
+   Registry trong process cho counter và histogram có label.
+
+   Dùng chung cho ThucChienAIBot, AsyncThucChienAIBot và các node (mặc định là METRICS).
+   Xuất ra JSON (to_json) hoặc định dạng text của Prometheus (to_prometheus).
+   """
+
+   PREFIX = "thucchien_"
+
+   def __init__(self):
+       self._lock = threading.Lock()
+       self._histograms: Dict[str, Dict[_Labels, Histogram]] = defaultdict(dict)
+       self._bucket_specs: Dict[str, Tuple[float, ...]] = {}
+       self._counters: Dict[str, Dict[_Labels, float]] = defaultdict(lambda: defaultdict(float))
+
+
+   @staticmethod
+   def _labels(labels: Dict[str, Any]) -> _Labels:
+       return tuple(sorted((key, "" if value is None else str(value)) for key, value in labels.items()))
+
+
+   def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any) -> None:
+       """Ghi một giá trị vào histogram name với các label cho trước."""
+       key = self._labels(labels)
+       with self._lock:
+           series = self._histograms[name]
+           histogram = series.get(key)
+           if histogram is None:
+               histogram = series[key] = Histogram(self._bucket_specs.setdefault(name, tuple(buckets)))
+           histogram.observe(value)
+
+
+   def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+       with self._lock:
+           self._counters[name][self._labels(labels)] += amount
+
+
+   @contextlib.contextmanager
+   def timer(self, name: str, **labels: Any) -> Iterator[None]:
+       """Đo thời gian của khối with và ghi vào histogram name."""
+       started = time.perf_counter()
+       try:
+           yield
+       finally:
+           self.observe(name, time.perf_counter() - started, **labels)
+
+
+   def reset(self) -> None:
+       with self._lock:
+           self._histograms.clear()
+           self._counters.clear()
+
+
+   def snapshot(self) -> Dict[str, Any]:
+       """Toàn bộ số liệu: histogram (count/sum/max/p50/p95/p99) và counter, theo label."""
+       with self._lock:
+           return {
+               "histograms": {
+                   name: [dict(labels=dict(key), **histogram.summary()) for key, histogram in series.items()]
+                   for name, series in self._histograms.items()
+               },
+               "counters": {
+                   name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                   for name, series in self._counters.items()
+               },
+           }
+
+
+   def to_json(self, indent: Optional[int] = 2) -> str:
+       return json.dumps(self.snapshot(), ensure_ascii=False, indent=indent)
+
+
+   @staticmethod
+   def _format_labels(labels: _Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+       pairs = list(labels) + list(extra)
+       if not pairs:
+           return ""
+       escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+       return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+   def to_prometheus(self) -> str:
+       """Xuất theo định dạng text exposition của Prometheus."""
+       lines: List[str] = []
+       with self._lock:
+           for name, series in sorted(self._counters.items()):
+               metric = f"{self.PREFIX}{name}"
+               lines.append(f"# TYPE {metric} counter")
+               for key, value in series.items():
+                   lines.append(f"{metric}{self._format_labels(key)} {value:g}")
+           for name, series in sorted(self._histograms.items()):
+               metric = f"{self.PREFIX}{name}"
+               lines.append(f"# TYPE {metric} histogram")
+               for key, histogram in series.items():
+                   cumulative = 0
+                   for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                       cumulative += bucket_count
+                       lines.append(f"{metric}_bucket{self._format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                   lines.append(f"{metric}_bucket{self._format_labels(key, (('le', '+Inf'),))} {histogram.count}")
+                   lines.append(f"{metric}_sum{self._format_labels(key)} {histogram.sum:g}")
+                   lines.append(f"{metric}_count{self._format_labels(key)} {histogram.count}")
+       return "\n".join(lines) + "\n"
+
+
+   def dump(self, path: str) -> None:
+       """Ghi số liệu ra file: định dạng Prometheus nếu đuôi là .prom, ngược lại là JSON."""
+       directory = os.path.dirname(path)
+       if directory:
+           os.makedirs(directory, exist_ok=True)
+       with open(path, "w", encoding="utf-8") as f:
+           f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+
+# Registry mặc định của process.
+METRICS = Metrics()
@@ -0,0 +1,269 @@
+# File: src/model/rate_limit.py
+
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Độ ưu tiên: số nhỏ hơn được phục vụ trước.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BATCH = 10
+
+_current_priority: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("rate_limit_priority", default=None)
+
+
+@contextlib.contextmanager
+def rate_priority(priority: int) -> Iterator[None]:
+   """
+   Đặt độ ưu tiên cho mọi request được gửi trong khối with (thread hoặc task hiện tại).
+
+   Ví dụ: bọc một batch video bằng `with rate_priority(PRIORITY_BATCH):` để các request
+   tương tác không phải xếp hàng sau nó.
+   """
+   token = _current_priority.set(priority)
+   try:
+       yield
+   finally:
+       _current_priority.reset(token)
+
+
+def current_priority(default: int = PRIORITY_DEFAULT) -> int:
+   value = _current_priority.get()
+   return default if value is None else value
+
+
+class TokenBucket:
+   """Token bucket nạp lại đều đặn rate_per_minute token mỗi phút, tối đa capacity token."""
+
+   def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+       if rate_per_minute <= 0:
+           raise ValueError("rate_per_minute phải lớn hơn 0.")
+       self.rate = rate_per_minute / 60.0
+       self.capacity = float(capacity if capacity is not None else rate_per_minute)
+       self.tokens = self.capacity
+       self.updated = time.monotonic()
+
+
+   def _refill(self) -> None:
+       now = time.monotonic()
+       self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+       self.updated = now
+
+
+   def wait_time(self, amount: float) -> float:
+       """Số giây cần chờ để có đủ amount token (0 nếu đủ ngay)."""
+       self._refill()
+       amount = min(amount, self.capacity)
+       if self.tokens >= amount:
+           return 0.0
+       return (amount - self.tokens) / self.rate
+
+
+   def consume(self, amount: float) -> None:
+       self._refill()
+       self.tokens -= min(amount, self.capacity)
+
+
+class ModelLimit:
+   """Giới hạn của một model: số request/phút và (tùy chọn) số token/phút."""
+
+   def __init__(self, rpm: float, tpm: Optional[float] = None, burst: Optional[float] = None):
+       """
+       Args:
+           rpm (float): Số request tối đa mỗi phút.
+           tpm (Optional[float]): Số token (ước lượng) tối đa mỗi phút, cho các model chat.
+           burst (Optional[float]): Số request được gửi dồn tối đa (mặc định bằng rpm).
+       """
+       self.rpm = rpm
+       self.tpm = tpm
+       self.burst = burst
+
+
+class _ModelQueue:
+   def __init__(self, limit: ModelLimit):
+       self.requests = TokenBucket(limit.rpm, limit.burst)
+       self.tokens = TokenBucket(limit.tpm) if limit.tpm else None
+       # (priority, seq) của các request đang chờ; chỉ phần tử đầu heap được lấy token.
+       self.waiters: List[Tuple[int, int]] = []
+
+
+class RateLimiter:
+   """
+   Bộ giới hạn tốc độ phía client theo từng model.
+
+   Request vượt giới hạn được xếp hàng cục bộ thay vì nhận 429 từ provider. Hàng đợi của
+   mỗi model sắp theo (priority, thứ tự đến) nên công bằng giữa các caller cùng độ ưu tiên
+   và request tương tác (PRIORITY_INTERACTIVE) được phục vụ trước request batch.
+   Model không được cấu hình thì không bị giới hạn.
+   """
+
+   # Khoảng kiểm tra lại tối đa của waiter async (giây).
+   ASYNC_POLL_INTERVAL = 0.05
+
+   def __init__(self, limits: Optional[Dict[str, ModelLimit]] = None):
+       self._cond = threading.Condition()
+       self._queues: Dict[str, _ModelQueue] = {
+           model: _ModelQueue(limit) for model, limit in (limits or {}).items() if model
+       }
+       self._counter = itertools.count()
+       self.waited_seconds: Dict[str, float] = {}
+
+
+   @classmethod
+   def from_env(cls, var: str = "RATE_LIMITS") -> "RateLimiter":
+       """
+       Đọc cấu hình từ biến môi trường dạng JSON, ví dụ:
+       RATE_LIMITS='{"imagen-4": {"rpm": 10}, "gemini-2.5-flash": {"rpm": 60, "tpm": 100000}}'
+       """
+       raw = os.getenv(var)
+       if not raw:
+           return cls()
+       return cls({model: ModelLimit(**limit) for model, limit in json.loads(raw).items()})
+
+
+   def set_limit(self, model: str, limit: ModelLimit) -> None:
+       with self._cond:
+           queue = _ModelQueue(limit)
+           if model in self._queues:
+               # Giữ nguyên các request đang chờ.
+               queue.waiters = self._queues[model].waiters
+           self._queues[model] = queue
+           self._cond.notify_all()
+
+
+   def _enqueue(self, model: str, priority: int) -> Optional[Tuple[int, int]]:
+       with self._cond:
+           queue = self._queues.get(model)
+           if queue is None:
+               return None
+           ticket = (priority, next(self._counter))
+           heapq.heappush(queue.waiters, ticket)
+           return ticket
+
+
+   def _try_acquire(self, model: str, ticket: Tuple[int, int], tokens: float) -> float:
+       """Lấy token nếu ticket đang ở đầu hàng; trả về số giây cần chờ (0 nếu đã lấy được)."""
+       queue = self._queues[model]
+       if queue.waiters[0] != ticket:
+           return self.ASYNC_POLL_INTERVAL
+       wait = queue.requests.wait_time(1)
+       if queue.tokens is not None and tokens:
+           wait = max(wait, queue.tokens.wait_time(tokens))
+       if wait > 0:
+           return wait
+       queue.requests.consume(1)
+       if queue.tokens is not None and tokens:
+           queue.tokens.consume(tokens)
+       heapq.heappop(queue.waiters)
+       self._cond.notify_all()
+       return 0.0
+
+
+   def _record_wait(self, model: str, started: float) -> None:
+       self.waited_seconds[model] = self.waited_seconds.get(model, 0.0) + time.monotonic() - started
+
+
+   def acquire(self, model: Optional[str], tokens: float = 0, priority: Optional[int] = None) -> None:
+       """
+       Chờ (chặn thread) cho tới khi model còn quota cho một request.
+
+
+       Args:
+           model (Optional[str]): Tên model; None hoặc model không cấu hình thì trả về ngay.
+           tokens (float): Số token ước lượng của request (chỉ dùng khi model có tpm).
+           priority (Optional[int]): Độ ưu tiên; mặc định lấy từ rate_priority() hoặc PRIORITY_DEFAULT.
+       """
+       ticket = self._enqueue(model, current_priority() if priority is None else priority) if model else None
+       if ticket is None:
+           return
+       started = time.monotonic()
+       with self._cond:
+           while True:
+               wait = self._try_acquire(model, ticket, tokens)
+               if wait == 0:
+                   break
+               self._cond.wait(wait)
+           self._record_wait(model, started)
+
+
+   async def aacquire(self, model: Optional[str], tokens: float = 0, priority: Optional[int] = None) -> None:
+       """Phiên bản async của acquire, chờ bằng asyncio.sleep thay vì chặn event loop."""
+       ticket = self._enqueue(model, current_priority() if priority is None else priority) if model else None
+       if ticket is None:
+           return
+       started = time.monotonic()
+       try:
+           while True:
+               with self._cond:
+                   wait = self._try_acquire(model, ticket, tokens)
+                   if wait == 0:
+                       self._record_wait(model, started)
+                       return
+               await asyncio.sleep(min(wait, self.ASYNC_POLL_INTERVAL))
+       except asyncio.CancelledError:
+           self._abandon(model, ticket)
+           raise
+
+
+   def _abandon(self, model: str, ticket: Tuple[int, int]) -> None:
+       """Bỏ ticket của một waiter bị hủy để không chặn hàng đợi."""
+       with self._cond:
+           waiters = self._queues[model].waiters
+           if ticket in waiters:
+               waiters.remove(ticket)
+               heapq.heapify(waiters)
+               self._cond.notify_all()
+
+
+   def stats(self) -> Dict[str, Dict[str, float]]:
+       """Số request đang chờ và tổng thời gian đã chờ theo model."""
+       with self._cond:
+           return {
+               model: {"waiting": len(queue.waiters), "waited_seconds": self.waited_seconds.get(model, 0.0)}
+               for model, queue in self._queues.items()
+           }
+
+
+def estimate_chat_tokens(payload: Optional[Dict]) -> int:
+   """Ước lượng số token của một request chat (~4 ký tự/token) cộng max_tokens nếu có."""
+   if not payload or "messages" not in payload:
+       return 0
+   prompt_chars = sum(len(str(m.get("content", ""))) for m in payload["messages"])
+   return prompt_chars // 4 + int(payload.get("max_tokens") or 0)
+
+
+# Model của các endpoint Gemini nằm trong đường dẫn, ví dụ /gemini/v1beta/models/veo-3:predictLongRunning.
+_MODEL_IN_PATH = re.compile(r"/models/([^/:?]+)")
+
+
+def request_model(method: str, endpoint: str, data: Optional[Dict]) -> Optional[str]:
+   """
+   Tên model của một request sinh nội dung (từ payload OpenAI-style hoặc từ đường dẫn Gemini).
+   GET (kiểm tra trạng thái, tải file) và các endpoint operations không tiêu RPM của model nên trả về None,
+   kể cả /gemini/v1beta/models/veo-3/operations/... có tên model trong đường dẫn.
+   """
+   if method.upper() != "POST" or "/operations/" in endpoint:
+       return None
+   if isinstance(data, dict) and isinstance(data.get("model"), str):
+       return data["model"]
+   match = _MODEL_IN_PATH.search(endpoint)
+   return match.group(1) if match else None
+
+
+def default_priority(endpoint: str) -> int:
+   """Độ ưu tiên mặc định theo loại request: chat là tương tác, sinh video là batch."""
+   if endpoint.startswith("/chat/completions"):
+       return PRIORITY_INTERACTIVE
+   if endpoint.endswith(":predictLongRunning"):
+       return PRIORITY_BATCH
+   return PRIORITY_DEFAULT
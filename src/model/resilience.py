@@ -0,0 +1,285 @@
+# File: src/model/resilience.py
+
+
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+
+class RetryPolicy:
+   """
+   Chính sách thử lại với exponential backoff và full jitter.
+
+   Mặc định tách riêng cho request idempotent (GET: polling trạng thái video, tải file)
+   và không idempotent (POST: sinh nội dung) - POST chỉ được thử lại khi chắc chắn server
+   chưa xử lý request (429/503 hoặc lỗi kết nối), với số lần thử ít hơn.
+   """
+
+   def __init__(
+       self,
+       max_attempts: int = 3,
+       base_delay: float = 1.0,
+       max_delay: float = 30.0,
+       retry_statuses: Iterable[int] = (429, 500, 502, 503, 504),
+       retry_on_timeout: bool = True
+   ):
+       """
+       Args:
+           max_attempts (int): Tổng số lần gửi tối đa (tính cả lần đầu).
+           base_delay (float): Khoảng chờ cơ sở (giây) cho lần thử lại đầu tiên.
+           max_delay (float): Khoảng chờ tối đa (giây); Retry-After lớn hơn giá trị này sẽ không được chờ.
+           retry_statuses (Iterable[int]): Các HTTP status được phép thử lại.
+           retry_on_timeout (bool): Thử lại khi bị timeout đọc (server có thể đã nhận request).
+       """
+       if max_attempts < 1:
+           raise ValueError("max_attempts phải lớn hơn hoặc bằng 1.")
+       self.max_attempts = max_attempts
+       self.base_delay = base_delay
+       self.max_delay = max_delay
+       self.retry_statuses = frozenset(retry_statuses)
+       self.retry_on_timeout = retry_on_timeout
+
+
+   def backoff(self, attempt: int) -> float:
+       """Khoảng chờ trước lần thử thứ attempt + 1 (full jitter)."""
+       return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+   """Đọc header Retry-After (số giây hoặc HTTP-date)."""
+   if not value:
+       return None
+   value = value.strip()
+   if value.isdigit():
+       return float(value)
+   try:
+       return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+   except (TypeError, ValueError):
+       return None
+
+
+class CircuitBreaker:
+   """
+   Circuit breaker cho một endpoint: mở sau failure_threshold lỗi liên tiếp,
+   từ chối ngay mọi request trong recovery_timeout giây, rồi cho một request thử (half-open).
+   """
+
+   CLOSED = "closed"
+   OPEN = "open"
+   HALF_OPEN = "half_open"
+
+   def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+       self.failure_threshold = failure_threshold
+       self.recovery_timeout = recovery_timeout
+       self.state = self.CLOSED
+       self.failures = 0
+       self.opened_at = 0.0
+       self._probe_in_flight = False
+       self._lock = threading.Lock()
+
+
+   def allow(self) -> bool:
+       with self._lock:
+           if self.state == self.CLOSED:
+               return True
+           if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+               self.state = self.HALF_OPEN
+               self._probe_in_flight = False
+           if self.state == self.HALF_OPEN and not self._probe_in_flight:
+               self._probe_in_flight = True
+               return True
+           return False
+
+
+   def record_success(self) -> None:
+       with self._lock:
+           self.state = self.CLOSED
+           self.failures = 0
+           self._probe_in_flight = False
+
+
+   def record_failure(self) -> None:
+       with self._lock:
+           self.failures += 1
+           self._probe_in_flight = False
+           if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+               self.state = self.OPEN
+               self.opened_at = time.monotonic()
+
+
+class AttemptOutcome:
+   """
+   Kết quả của một lần gửi cho breaker, dùng làm context manager quanh lần gửi đó.
+
+   Lần gửi kết thúc mà chưa gọi success/failure (bị hủy, ví dụ asyncio.wait_for hết hạn, hoặc lỗi
+   ngoài dự kiến như OSError khi đọc file upload) được tính là failure, để request thử của breaker
+   half-open luôn được giải phóng thay vì chặn endpoint đến khi process khởi động lại.
+   """
+
+   def __init__(self, resilience: "Resilience", key: str):
+       self.resilience = resilience
+       self.key = key
+       self.recorded = False
+
+
+   def success(self) -> None:
+       self.recorded = True
+       self.resilience.record_success(self.key)
+
+
+   def failure(self, status: Optional[int] = None) -> None:
+       self.recorded = True
+       self.resilience.record_failure(self.key, status)
+
+
+   def close(self) -> None:
+       """Gọi khi lần gửi kết thúc (trong finally): chưa ghi nhận kết quả thì tính là failure."""
+       if not self.recorded:
+           self.failure()
+
+
+   def __enter__(self) -> "AttemptOutcome":
+       return self
+
+
+   def __exit__(self, *exc_info) -> None:
+       self.close()
+
+
+# Các đoạn định danh (operation, file) được gom lại để mỗi loại endpoint có một breaker.
+_ID_SEGMENT = re.compile(r"/(operations|files)/[^/:?]+")
+
+
+def endpoint_key(method: str, endpoint: str) -> str:
+   """Chuẩn hóa endpoint thành key cho breaker/metrics, ví dụ 'GET /gemini/v1beta/models/x/operations/{id}'."""
+   path = _ID_SEGMENT.sub(r"/\1/{id}", endpoint.split("?", 1)[0])
+   return f"{method.upper()} {path}"
+
+
+class Resilience:
+   """
+   Lớp resilience dùng chung cho ThucChienAIBot và AsyncThucChienAIBot:
+   chính sách retry theo phương thức HTTP, circuit breaker theo endpoint và bộ đếm
+   (requests, retries, failures, short_circuited) để thấy được chi phí thật của lỗi tạm thời.
+   """
+
+   # Lỗi chắc chắn chưa được server xử lý, an toàn để thử lại cả với POST.
+   SAFE_POST_STATUSES = (429, 503)
+
+   def __init__(
+       self,
+       get_policy: Optional[RetryPolicy] = None,
+       post_policy: Optional[RetryPolicy] = None,
+       failure_threshold: int = 5,
+       recovery_timeout: float = 30.0
+   ):
+       self.get_policy = get_policy or RetryPolicy(max_attempts=5)
+       self.post_policy = post_policy or RetryPolicy(
+           max_attempts=3, retry_statuses=self.SAFE_POST_STATUSES, retry_on_timeout=False
+       )
+       self.failure_threshold = failure_threshold
+       self.recovery_timeout = recovery_timeout
+       self._breakers: Dict[str, CircuitBreaker] = {}
+       self._counters: Dict[str, Dict[str, int]] = defaultdict(
+           lambda: {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+       )
+       self._lock = threading.Lock()
+
+
+   def policy_for(self, method: str) -> RetryPolicy:
+       return self.get_policy if method.upper() in ("GET", "HEAD") else self.post_policy
+
+
+   def breaker(self, key: str) -> CircuitBreaker:
+       with self._lock:
+           breaker = self._breakers.get(key)
+           if breaker is None:
+               breaker = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+               self._breakers[key] = breaker
+           return breaker
+
+
+   def _count(self, key: str, name: str) -> None:
+       with self._lock:
+           self._counters[key][name] += 1
+
+
+   def before_attempt(self, key: str) -> bool:
+       """Gọi trước mỗi lần gửi; False nghĩa là breaker đang mở và request bị từ chối ngay."""
+       if not self.breaker(key).allow():
+           self._count(key, "short_circuited")
+           return False
+       self._count(key, "requests")
+       return True
+
+
+   def outcome(self, key: str) -> AttemptOutcome:
+       """Context manager ghi nhận kết quả của lần gửi vừa được before_attempt cho phép."""
+       return AttemptOutcome(self, key)
+
+
+   def record_success(self, key: str) -> None:
+       self.breaker(key).record_success()
+
+
+   def record_failure(self, key: str, status: Optional[int] = None) -> None:
+       """Ghi nhận lỗi; lỗi phía client (4xx trừ 429) không làm mở breaker."""
+       if status is not None and status < 500 and status != 429:
+           self.breaker(key).record_success()
+           return
+       self._count(key, "failures")
+       self.breaker(key).record_failure()
+
+
+   def retry_delay(
+       self,
+       method: str,
+       key: str,
+       attempt: int,
+       status: Optional[int] = None,
+       retry_after: Optional[str] = None,
+       timeout: bool = False
+   ) -> Optional[float]:
+       """
+       Quyết định có thử lại không sau lần gửi thứ attempt.
+
+
+       Args:
+           status (Optional[int]): HTTP status (None nếu lỗi kết nối/timeout).
+           retry_after (Optional[str]): Giá trị header Retry-After nếu có.
+           timeout (bool): Lỗi là timeout đọc (server có thể đã xử lý).
+
+
+       Returns:
+           Optional[float]: Số giây cần chờ trước khi thử lại, hoặc None nếu không thử lại.
+       """
+       policy = self.policy_for(method)
+       if attempt >= policy.max_attempts:
+           return None
+       if status is not None and status not in policy.retry_statuses:
+           return None
+       if timeout and not policy.retry_on_timeout:
+           return None
+
+       delay = policy.backoff(attempt)
+       server_delay = parse_retry_after(retry_after)
+       if server_delay is not None:
+           if server_delay > policy.max_delay:
+               # Server yêu cầu chờ quá lâu: trả lỗi ngay thay vì giữ worker.
+               return None
+           delay = max(delay, server_delay)
+       self._count(key, "retries")
+       return delay
+
+
+   def stats(self) -> Dict[str, Dict[str, object]]:
+       """Bộ đếm và trạng thái breaker theo endpoint."""
+       with self._lock:
+           return {
+               key: dict(counters, circuit=self._breakers[key].state if key in self._breakers else CircuitBreaker.CLOSED)
+               for key, counters in self._counters.items()
+           }
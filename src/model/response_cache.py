@@ -0,0 +1,337 @@
+# File: src/model/response_cache.py
+
+
+import base64
+import binascii
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from src.model.context_cache import CachedContentName
+from src.model.gemini_files import FilePart
+from src.model.log import get_logger
+from src.model.streaming_body import Base64File
+from src.model.streaming_json import FILE_REF, is_file_ref
+
+
+logger = get_logger(__name__)
+
+# Các trường chứa dữ liệu nhị phân dạng base64 trong payload/phản hồi của API.
+_BASE64_KEYS = ("b64_json", "bytesBase64Encoded")
+_INLINE_DATA_KEY = "inlineData"
+
+# Chuỗi base64 ngắn hơn ngưỡng này được giữ nguyên trong JSON.
+_MIN_BLOB_LENGTH = 1024
+
+
+def _digest(data: bytes) -> str:
+   return hashlib.sha256(data).hexdigest()
+
+
+class ResponseCache:
+   """
+   Cache phản hồi API trên đĩa, định danh theo nội dung request (content-addressed).
+
+   Key là SHA-256 của (method, endpoint, payload đã chuẩn hóa); các chuỗi base64 lớn trong
+   payload (ảnh đầu vào), các file đã upload và context đã cache trên Gemini được thay bằng
+   digest nội dung. Mỗi entry là một thư mục chứa meta.json và các blob nhị phân (ảnh, audio,
+   video) được lưu thành file riêng thay vì base64 trong JSON. Cache giới hạn tổng dung lượng (xóa entry ít dùng nhất - LRU) và
+   hết hạn theo TTL.
+   """
+
+   def __init__(
+       self,
+       cache_dir: str = ".cache/thucchien",
+       max_bytes: int = 2 * 1024 ** 3,
+       ttl: Optional[float] = 7 * 24 * 3600,
+       bypass: bool = False
+   ):
+       """
+       Args:
+           cache_dir (str): Thư mục lưu cache.
+           max_bytes (int): Dung lượng tối đa của cache (byte).
+           ttl (Optional[float]): Thời gian sống của entry (giây), None để không hết hạn.
+           bypass (bool): Nếu True, bỏ qua việc đọc cache (vẫn ghi kết quả mới để làm mới entry).
+       """
+       self.cache_dir = cache_dir
+       self.max_bytes = max_bytes
+       self.ttl = ttl
+       self.bypass = bypass
+       self.hits = 0
+       self.misses = 0
+       self._lock = threading.Lock()
+       # key -> kích thước entry, sắp xếp từ ít dùng nhất đến dùng gần nhất.
+       self._index: "OrderedDict[str, int]" = OrderedDict()
+       os.makedirs(cache_dir, exist_ok=True)
+       self._load_index()
+
+
+   # --- Key ---
+
+   @staticmethod
+   def _normalize(value: Any, parent_key: Optional[str] = None) -> Any:
+       """
+       Thay các chuỗi base64 lớn bằng digest để key ổn định và rẻ khi so sánh. Ảnh đã upload
+       (FilePart) và context đã cache (CachedContentName) cũng được thay bằng digest nội dung,
+       vì fileUri và tên cachedContent đổi mỗi khi được upload/tạo lại.
+       """
+       if isinstance(value, Base64File):
+           return {"sha256": value.digest()}
+       if isinstance(value, FilePart):
+           return {"file_sha256": value.digest}
+       if isinstance(value, CachedContentName):
+           return {"context_sha256": value.digest}
+       if isinstance(value, dict):
+           return {k: ResponseCache._normalize(v, k) for k, v in value.items()}
+       if isinstance(value, list):
+           return [ResponseCache._normalize(v, parent_key) for v in value]
+       if isinstance(value, str) and len(value) >= _MIN_BLOB_LENGTH and (
+           parent_key in _BASE64_KEYS or parent_key == "data"
+       ):
+           return {"sha256": _digest(value.encode("ascii", "ignore"))}
+       return value
+
+
+   def make_key(self, method: str, endpoint: str, data: Optional[Dict[str, Any]], output: bool = False) -> str:
+       """Tạo key cache từ endpoint (bao gồm model) và payload đã chuẩn hóa."""
+       material = json.dumps(
+           {"method": method.upper(), "endpoint": endpoint, "data": self._normalize(data), "output": output},
+           sort_keys=True,
+           ensure_ascii=False,
+           separators=(",", ":")
+       )
+       return _digest(material.encode("utf-8"))
+
+
+   @staticmethod
+   def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+       """SHA-256 của một file đầu vào (ví dụ ảnh tham chiếu), đọc theo từng khối."""
+       h = hashlib.sha256()
+       with open(path, "rb") as f:
+           for chunk in iter(lambda: f.read(chunk_size), b""):
+               h.update(chunk)
+       return h.hexdigest()
+
+
+   # --- Đọc/ghi entry ---
+
+   def _entry_dir(self, key: str) -> str:
+       return os.path.join(self.cache_dir, key[:2], key)
+
+
+   def _load_index(self) -> None:
+       entries = []
+       for shard in os.listdir(self.cache_dir):
+           shard_dir = os.path.join(self.cache_dir, shard)
+           if not os.path.isdir(shard_dir):
+               continue
+           for key in os.listdir(shard_dir):
+               meta_path = os.path.join(shard_dir, key, "meta.json")
+               if not os.path.exists(meta_path):
+                   continue
+               entries.append((os.path.getmtime(meta_path), key, self._dir_size(os.path.join(shard_dir, key))))
+       for _, key, size in sorted(entries):
+           self._index[key] = size
+
+
+   @staticmethod
+   def _dir_size(path: str) -> int:
+       return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+   def _read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+       with self._lock:
+           if self.bypass or key not in self._index:
+               self.misses += 1
+               return None
+       entry_dir = self._entry_dir(key)
+       meta_path = os.path.join(entry_dir, "meta.json")
+       try:
+           with open(meta_path, "r", encoding="utf-8") as f:
+               meta = json.load(f)
+       except (OSError, json.JSONDecodeError):
+           self._remove(key)
+           with self._lock:
+               self.misses += 1
+           return None
+
+       if self.ttl is not None and time.time() - meta["created_at"] > self.ttl:
+           self._remove(key)
+           with self._lock:
+               self.misses += 1
+           return None
+
+       os.utime(meta_path)
+       with self._lock:
+           self.hits += 1
+           if key in self._index:
+               self._index.move_to_end(key)
+       return meta
+
+
+   def _write_entry(self, key: str, meta: Dict[str, Any], blobs: Dict[str, bytes], files: Dict[str, str]) -> None:
+       """Ghi entry vào thư mục tạm rồi đổi tên (atomic) để tránh entry dở dang."""
+       shard_dir = os.path.dirname(self._entry_dir(key))
+       os.makedirs(shard_dir, exist_ok=True)
+       tmp_dir = tempfile.mkdtemp(dir=shard_dir, prefix=".tmp-")
+       try:
+           for name, data in blobs.items():
+               with open(os.path.join(tmp_dir, name), "wb") as f:
+                   f.write(data)
+           for name, src in files.items():
+               shutil.copyfile(src, os.path.join(tmp_dir, name))
+           meta["created_at"] = time.time()
+           with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+               json.dump(meta, f, ensure_ascii=False)
+           size = self._dir_size(tmp_dir)
+
+           self._remove(key)
+           os.rename(tmp_dir, self._entry_dir(key))
+       except OSError as e:
+           shutil.rmtree(tmp_dir, ignore_errors=True)
+           logger.warning("Không thể ghi cache cho key %s: %s", key, e)
+           return
+
+       with self._lock:
+           self._index[key] = size
+           self._index.move_to_end(key)
+       self._evict()
+
+
+   def _remove(self, key: str) -> None:
+       shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+       with self._lock:
+           self._index.pop(key, None)
+
+
+   def _evict(self) -> None:
+       while True:
+           with self._lock:
+               if sum(self._index.values()) <= self.max_bytes or len(self._index) <= 1:
+                   return
+               key = next(iter(self._index))
+           self._remove(key)
+
+
+   # --- Phản hồi JSON ---
+
+   def _extract_blobs(
+       self,
+       value: Any,
+       blobs: Dict[str, bytes],
+       files: Dict[str, str],
+       parent_key: Optional[str] = None,
+       mime_type: Optional[str] = None
+   ) -> Any:
+       """
+       Tách các trường base64 của phản hồi ra thành blob nhị phân, thay bằng tham chiếu.
+       Trường đã được StreamingJSONDecoder giải mã ra file ({"__file__": ...}) được sao chép nguyên file.
+       """
+       if is_file_ref(value):
+           ext = mimetypes.guess_extension(mime_type or "image/png") or ".bin"
+           name = f"blob_{len(blobs) + len(files)}{ext}"
+           files[name] = value[FILE_REF]
+           return {"__blob__": name}
+       if isinstance(value, dict):
+           mime = value.get("mimeType", mime_type) if parent_key == _INLINE_DATA_KEY else mime_type
+           return {k: self._extract_blobs(v, blobs, files, k, mime) for k, v in value.items()}
+       if isinstance(value, list):
+           return [self._extract_blobs(v, blobs, files, parent_key, mime_type) for v in value]
+       if isinstance(value, str) and len(value) >= _MIN_BLOB_LENGTH and (
+           parent_key in _BASE64_KEYS or (parent_key == "data" and mime_type)
+       ):
+           try:
+               raw = base64.b64decode(value, validate=True)
+           except (binascii.Error, ValueError):
+               return value
+           ext = mimetypes.guess_extension(mime_type or "image/png") or ".bin"
+           name = f"blob_{len(blobs) + len(files)}{ext}"
+           blobs[name] = raw
+           return {"__blob__": name}
+       return value
+
+
+   def _restore_blobs(self, value: Any, entry_dir: str, decode_to: Optional[str] = None) -> Any:
+       if isinstance(value, dict):
+           if set(value) == {"__blob__"}:
+               blob_path = os.path.join(entry_dir, value["__blob__"])
+               if decode_to:
+                   # Trả về file như StreamingJSONDecoder thay vì chuỗi base64 trong bộ nhớ.
+                   fd, path = tempfile.mkstemp(dir=decode_to, prefix=".b64-", suffix=".part")
+                   os.close(fd)
+                   shutil.copyfile(blob_path, path)
+                   return {FILE_REF: path, "size": os.path.getsize(path)}
+               with open(blob_path, "rb") as f:
+                   return base64.b64encode(f.read()).decode("ascii")
+           return {k: self._restore_blobs(v, entry_dir, decode_to) for k, v in value.items()}
+       if isinstance(value, list):
+           return [self._restore_blobs(v, entry_dir, decode_to) for v in value]
+       return value
+
+
+   def get_json(self, key: str, decode_to: Optional[str] = None) -> Optional[Dict[str, Any]]:
+       """
+       Lấy phản hồi JSON đã cache (None nếu miss). Nếu có decode_to, các blob được sao chép
+       ra file trong thư mục đó và trả về dạng {"__file__": đường dẫn, "size": số byte}.
+       """
+       meta = self._read_meta(key)
+       if meta is None or meta.get("kind") != "json":
+           return None
+       try:
+           if decode_to:
+               os.makedirs(decode_to, exist_ok=True)
+           return self._restore_blobs(meta["response"], self._entry_dir(key), decode_to)
+       except OSError:
+           self._remove(key)
+           return None
+
+
+   def put_json(self, key: str, response: Dict[str, Any]) -> None:
+       """Lưu phản hồi JSON; dữ liệu base64 được tách thành file nhị phân."""
+       blobs: Dict[str, bytes] = {}
+       files: Dict[str, str] = {}
+       stored = self._extract_blobs(response, blobs, files)
+       self._write_entry(key, {"kind": "json", "response": stored}, blobs, files)
+
+
+   # --- Phản hồi dạng file (audio/video) ---
+
+   def get_file(self, key: str, output_file: str) -> Optional[Dict[str, Any]]:
+       """Sao chép file đã cache tới output_file (None nếu miss)."""
+       meta = self._read_meta(key)
+       if meta is None or meta.get("kind") != "file":
+           return None
+       partial = f"{output_file}.part"
+       try:
+           directory = os.path.dirname(output_file)
+           if directory:
+               os.makedirs(directory, exist_ok=True)
+           shutil.copyfile(os.path.join(self._entry_dir(key), meta["file"]), partial)
+           os.replace(partial, output_file)
+       except OSError:
+           self._remove(key)
+           return None
+       return {"status": "success", "file_path": output_file}
+
+
+   def put_file(self, key: str, file_path: str) -> None:
+       """Lưu một file kết quả (audio/video) vào cache."""
+       name = "output" + (os.path.splitext(file_path)[1] or ".bin")
+       self._write_entry(key, {"kind": "file", "file": name}, {}, {name: file_path})
+
+
+   def stats(self) -> Dict[str, Any]:
+       with self._lock:
+           return {
+               "hits": self.hits,
+               "misses": self.misses,
+               "entries": len(self._index),
+               "bytes": sum(self._index.values())
+           }
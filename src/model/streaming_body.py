@@ -0,0 +1,212 @@
+# File: src/model/streaming_body.py
+
+
+import asyncio
+import base64
+import hashlib
+import json
+import mmap
+import os
+from typing import Any, AsyncIterator, Iterator, Optional, Union
+
+from src.model.image_cache import EncodedImageCache
+
+
+# Kích thước khối đọc từ file; là bội số của 3 để mỗi khối mã hóa base64 không có padding ở giữa.
+DEFAULT_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class Base64File:
+   """
+   Đại diện cho nội dung base64 của một file, được mã hóa dần khi gửi request
+   thay vì đọc và mã hóa toàn bộ file vào bộ nhớ.
+
+   Nếu có EncodedImageCache và ảnh đủ nhỏ, nội dung base64 được mã hóa một lần
+   rồi dùng lại cho các request sau.
+   """
+
+   def __init__(self, path: str, cache: Optional[EncodedImageCache] = None):
+       self.path = path
+       self.size = os.path.getsize(path)
+       self.cache = cache
+
+
+   def encoded_length(self) -> int:
+       """Độ dài (byte) của chuỗi base64 tương ứng."""
+       return 4 * ((self.size + 2) // 3)
+
+
+   def _cacheable(self) -> bool:
+       return self.cache is not None and self.cache.fits(self.encoded_length())
+
+
+   def iter_encoded(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+       """
+       Trả về từng khối base64 (ứng với chunk_size byte của file). Ảnh có trong cache cũng được
+       cắt thành từng khối từ bộ đệm của cache, để body không tạo thêm một bản sao của cả ảnh.
+       """
+       if not self._cacheable():
+           yield from self._iter_file(chunk_size)
+           return
+       if chunk_size % 3:
+           raise ValueError("chunk_size phải là bội số của 3.")
+       step = chunk_size // 3 * 4
+       view = memoryview(self.encoded_bytes())
+       for offset in range(0, len(view), step):
+           yield bytes(view[offset:offset + step])
+
+
+   def encoded_bytes(self) -> bytes:
+       """Toàn bộ nội dung base64 (từ cache nếu có)."""
+       if self._cacheable():
+           return self.cache.encoded(self.path, lambda: b"".join(self._iter_file()))
+       return b"".join(self._iter_file())
+
+
+   def _iter_file(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+       """Đọc file qua mmap và trả về từng khối base64."""
+       if chunk_size % 3:
+           raise ValueError("chunk_size phải là bội số của 3.")
+       if self.size == 0:
+           return
+       with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+           for offset in range(0, self.size, chunk_size):
+               yield base64.b64encode(mm[offset:offset + chunk_size])
+
+
+   def digest(self) -> str:
+       """SHA-256 của chuỗi base64 (trùng với digest của chuỗi đã mã hóa đầy đủ)."""
+       if self.cache is not None:
+           return self.cache.digest(self.path, self._compute_digest)
+       return self._compute_digest()
+
+
+   def _compute_digest(self) -> str:
+       h = hashlib.sha256()
+       for chunk in self.iter_encoded():
+           h.update(chunk)
+       return h.hexdigest()
+
+
+   def __repr__(self) -> str:
+       return f"Base64File({self.path!r}, size={self.size})"
+
+
+def has_base64_file(value: Any) -> bool:
+   """Kiểm tra payload có chứa Base64File nào không."""
+   if isinstance(value, Base64File):
+       return True
+   if isinstance(value, dict):
+       return any(has_base64_file(v) for v in value.values())
+   if isinstance(value, (list, tuple)):
+       return any(has_base64_file(v) for v in value)
+   return False
+
+
+def _iter_pieces(value: Any) -> Iterator[Union[bytes, Base64File]]:
+   """Tuần tự hóa payload thành các mảnh JSON; Base64File được giữ nguyên để mã hóa sau."""
+   if isinstance(value, Base64File):
+       yield b'"'
+       yield value
+       yield b'"'
+   elif isinstance(value, dict):
+       yield b"{"
+       for i, (key, item) in enumerate(value.items()):
+           if i:
+               yield b", "
+           yield json.dumps(str(key)).encode("ascii")
+           yield b": "
+           yield from _iter_pieces(item)
+       yield b"}"
+   elif isinstance(value, (list, tuple)):
+       yield b"["
+       for i, item in enumerate(value):
+           if i:
+               yield b", "
+           yield from _iter_pieces(item)
+       yield b"]"
+   else:
+       yield json.dumps(value, allow_nan=False).encode("ascii")
+
+
+class StreamingJSONBody:
+   """
+   Body JSON được sinh dần từng khối khi gửi request.
+
+   Bộ nhớ sử dụng chỉ khoảng một khối (chunk_size) bất kể kích thước và số lượng ảnh.
+   Độ dài được tính trước (__len__) để request có Content-Length thay vì chunked encoding.
+   Có thể lặp lại nhiều lần (ví dụ khi gửi lại request).
+   """
+
+   def __init__(self, payload: Any, chunk_size: int = DEFAULT_CHUNK_SIZE):
+       self.payload = payload
+       self.chunk_size = chunk_size
+       self._length = sum(
+           piece.encoded_length() if isinstance(piece, Base64File) else len(piece)
+           for piece in _iter_pieces(payload)
+       )
+
+
+   def __len__(self) -> int:
+       return self._length
+
+
+   def __iter__(self) -> Iterator[bytes]:
+       buffer = bytearray()
+       for piece in _iter_pieces(self.payload):
+           if isinstance(piece, Base64File):
+               for chunk in piece.iter_encoded(self.chunk_size):
+                   if buffer:
+                       yield bytes(buffer)
+                       buffer.clear()
+                   yield chunk
+           else:
+               buffer += piece
+               if len(buffer) >= self.chunk_size:
+                   yield bytes(buffer)
+                   buffer.clear()
+       if buffer:
+           yield bytes(buffer)
+
+
+   async def aiter_chunks(self) -> AsyncIterator[bytes]:
+       """Phiên bản async của __iter__ (cho httpx.AsyncClient)."""
+       # Đọc file trong thread pool để không chặn event loop.
+       iterator = iter(self)
+       while True:
+           chunk = await asyncio.to_thread(next, iterator, None)
+           if chunk is None:
+               return
+           yield chunk
+
+
+class FileBody:
+   """
+   Body là nội dung thô của một file (upload lên Gemini Files API), đọc dần từng khối khi gửi.
+   Có __len__ để request có Content-Length và có thể lặp lại khi gửi lại request.
+   """
+
+   def __init__(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+       self.path = path
+       self.size = os.path.getsize(path)
+       self.chunk_size = chunk_size
+
+
+   def __len__(self) -> int:
+       return self.size
+
+
+   def __iter__(self) -> Iterator[bytes]:
+       with open(self.path, "rb") as f:
+           for chunk in iter(lambda: f.read(self.chunk_size), b""):
+               yield chunk
+
+
+   async def aiter_chunks(self) -> AsyncIterator[bytes]:
+       """Phiên bản async của __iter__ (cho httpx.AsyncClient)."""
+       iterator = iter(self)
+       while True:
+           chunk = await asyncio.to_thread(next, iterator, None)
+           if chunk is None:
+               return
+           yield chunk
@@ -0,0 +1,301 @@
+# File: src/model/streaming_json.py
+
+
+import binascii
+import json
+import os
+import re
+import tempfile
+from typing import Any, Dict, List, Optional
+
+
+# Giá trị thay cho một trường base64 đã được giải mã ra file: {"__file__": đường dẫn, "size": số byte}.
+FILE_REF = "__file__"
+
+# Các trường chứa dữ liệu nhị phân dạng base64 (giống src/model/response_cache.py).
+_BASE64_KEYS = ("b64_json", "bytesBase64Encoded")
+_INLINE_DATA_KEY = "inlineData"
+
+# Ký tự kết thúc một đoạn chuỗi JSON: dấu nháy đóng hoặc bắt đầu escape.
+_STRING_STOP = re.compile(rb'["\\]')
+# Ký tự kết thúc một số/literal (true, false, null).
+_SCALAR_STOP = re.compile(rb'[\s,\]}]')
+_WHITESPACE = b" \t\r\n"
+_SIMPLE_ESCAPES = {ord("/"): b"/", ord("n"): b"", ord("r"): b"", ord("t"): b""}
+
+
+def is_file_ref(value: Any) -> bool:
+   return isinstance(value, dict) and FILE_REF in value
+
+
+class _Base64Sink:
+   """Giải mã base64 theo từng khối (bội số của 4 ký tự) và ghi thẳng ra một file tạm."""
+
+   def __init__(self, directory: str):
+       fd, self.path = tempfile.mkstemp(dir=directory, prefix=".b64-", suffix=".part")
+       self.file = os.fdopen(fd, "wb")
+       self.carry = b""
+       self.size = 0
+
+
+   def write(self, chunk: bytes) -> None:
+       data = self.carry + chunk.translate(None, _WHITESPACE)
+       usable = len(data) - len(data) % 4
+       self.carry = data[usable:]
+       if usable:
+           self._emit(data[:usable])
+
+
+   def _emit(self, data: bytes) -> None:
+       decoded = binascii.a2b_base64(data)
+       self.file.write(decoded)
+       self.size += len(decoded)
+
+
+   def close(self) -> Dict[str, Any]:
+       if self.carry:
+           self._emit(self.carry + b"=" * (-len(self.carry) % 4))
+           self.carry = b""
+       self.file.close()
+       return {FILE_REF: self.path, "size": self.size}
+
+
+   def discard(self) -> None:
+       self.file.close()
+       try:
+           os.remove(self.path)
+       except OSError:
+           pass
+
+
+class _String:
+   """Chuỗi JSON đang được đọc: giữ byte thô (kể cả escape) hoặc chuyển thẳng vào _Base64Sink."""
+
+   __slots__ = ("is_key", "raw", "sink")
+
+   def __init__(self, is_key: bool, sink: Optional[_Base64Sink]):
+       self.is_key = is_key
+       self.raw: List[bytes] = []
+       self.sink = sink
+
+
+class StreamingJSONDecoder:
+   """
+   Parser JSON tăng dần: nhận body theo từng khối (feed) và dựng lại document khi kết thúc (close).
+
+   Giá trị của các trường base64 (b64_json, bytesBase64Encoded, inlineData.data) không được giữ
+   trong bộ nhớ mà được giải mã dần vào file tạm trong decode_to, và được thay bằng
+   {"__file__": đường dẫn, "size": số byte}. Bộ nhớ dùng cho một phản hồi ảnh/audio vì thế chỉ
+   cỡ một khối mạng thay vì 3-4 bản sao đầy đủ (body, chuỗi JSON, bytes đã giải mã).
+   Bên nhận file phải di chuyển (os.replace) hoặc xóa chúng; discard() xóa mọi file đã tạo.
+   """
+
+   def __init__(self, decode_to: str):
+       os.makedirs(decode_to, exist_ok=True)
+       self.decode_to = decode_to
+       self.files: List[str] = []
+       self._buf = bytearray()
+       # Mỗi phần tử: [container, key đang chờ giá trị (dict) hoặc None].
+       self._stack: List[List[Any]] = []
+       self._expect = "value"
+       self._string: Optional[_String] = None
+       self._scalar: Optional[bytearray] = None
+       self._done = False
+       self._result: Any = None
+
+
+   # --- API ---
+
+   def feed(self, data: bytes) -> None:
+       self._buf += data
+       pos = self._parse(0)
+       del self._buf[:pos]
+
+
+   def close(self) -> Any:
+       """Kết thúc body và trả về document đã dựng; ValueError nếu body không phải JSON hoàn chỉnh."""
+       if self._scalar is not None:
+           self._finish_scalar()
+       pos = self._skip_whitespace(0)
+       if not self._done or self._string is not None or pos < len(self._buf):
+           self.discard()
+           raise ValueError("Phản hồi JSON không hoàn chỉnh hoặc có dữ liệu thừa.")
+       return self._result
+
+
+   def discard(self) -> None:
+       """Xóa các file tạm đã giải mã (khi request lỗi hoặc sẽ được gửi lại)."""
+       if self._string is not None and self._string.sink is not None:
+           self._string.sink.discard()
+           self._string = None
+       for path in self.files:
+           try:
+               os.remove(path)
+           except OSError:
+               pass
+       self.files = []
+
+
+   # --- Parser ---
+
+   def _skip_whitespace(self, pos: int) -> int:
+       buf = self._buf
+       while pos < len(buf) and buf[pos] in _WHITESPACE:
+           pos += 1
+       return pos
+
+
+   def _parse(self, pos: int) -> int:
+       buf = self._buf
+       while True:
+           if self._string is not None:
+               pos = self._read_string(pos)
+               if self._string is not None:
+                   return pos
+               continue
+           if self._scalar is not None:
+               match = _SCALAR_STOP.search(buf, pos)
+               if match is None:
+                   self._scalar += buf[pos:]
+                   return len(buf)
+               self._scalar += buf[pos:match.start()]
+               pos = match.start()
+               self._finish_scalar()
+               continue
+
+           pos = self._skip_whitespace(pos)
+           if pos >= len(buf):
+               return pos
+           if self._done:
+               raise ValueError("Dữ liệu thừa sau document JSON.")
+           char = buf[pos]
+
+           if self._expect == "colon":
+               if char != ord(":"):
+                   raise ValueError(f"Cần ':' tại vị trí {pos}.")
+               self._expect = "value"
+               pos += 1
+           elif self._expect == "comma":
+               if char == ord(","):
+                   self._expect = "key" if isinstance(self._stack[-1][0], dict) else "value"
+                   pos += 1
+               elif char in (ord("}"), ord("]")):
+                   pos = self._close_container(char, pos)
+               else:
+                   raise ValueError(f"Cần ',' tại vị trí {pos}.")
+           elif self._expect == "key":
+               if char == ord('"'):
+                   self._string = _String(True, None)
+                   pos += 1
+               elif char == ord("}") and not self._stack[-1][0]:
+                   pos = self._close_container(char, pos)
+               else:
+                   raise ValueError(f"Cần tên trường tại vị trí {pos}.")
+           else:
+               pos = self._start_value(char, pos)
+
+
+   def _start_value(self, char: int, pos: int) -> int:
+       if char == ord("{"):
+           self._stack.append([{}, None])
+           self._expect = "key"
+       elif char == ord("["):
+           self._stack.append([[], None])
+           self._expect = "value"
+       elif char == ord("]") and self._stack and isinstance(self._stack[-1][0], list) and not self._stack[-1][0]:
+           return self._close_container(char, pos)
+       elif char == ord('"'):
+           sink = None
+           if self._is_blob_field():
+               sink = _Base64Sink(self.decode_to)
+           self._string = _String(False, sink)
+       else:
+           self._scalar = bytearray()
+           return pos
+       return pos + 1
+
+
+   def _is_blob_field(self) -> bool:
+       if not self._stack or not isinstance(self._stack[-1][0], dict):
+           return False
+       key = self._stack[-1][1]
+       if key in _BASE64_KEYS:
+           return True
+       return key == "data" and len(self._stack) > 1 and self._stack[-2][1] == _INLINE_DATA_KEY
+
+
+   def _read_string(self, pos: int) -> int:
+       buf = self._buf
+       string = self._string
+       while True:
+           match = _STRING_STOP.search(buf, pos)
+           end = match.start() if match else len(buf)
+           if end > pos:
+               if string.sink is not None:
+                   string.sink.write(bytes(buf[pos:end]))
+               else:
+                   string.raw.append(bytes(buf[pos:end]))
+           if match is None:
+               return len(buf)
+           if buf[end] == ord('"'):
+               self._string = None
+               self._finish_string(string)
+               return end + 1
+           # Escape: cần đủ byte (\uXXXX là 6 byte) trước khi xử lý.
+           length = 6 if end + 1 < len(buf) and buf[end + 1] == ord("u") else 2
+           if end + length > len(buf):
+               return end
+           escape = bytes(buf[end:end + length])
+           if string.sink is not None:
+               string.sink.write(self._blob_escape(escape))
+           else:
+               string.raw.append(escape)
+           pos = end + length
+
+
+   @staticmethod
+   def _blob_escape(escape: bytes) -> bytes:
+       if escape[1] == ord("u"):
+           return chr(int(escape[2:], 16)).encode("ascii", "ignore")
+       return _SIMPLE_ESCAPES.get(escape[1], b"")
+
+
+   def _finish_string(self, string: _String) -> None:
+       if string.sink is not None:
+           value = string.sink.close()
+           self.files.append(value[FILE_REF])
+       else:
+           value = json.loads(b'"' + b"".join(string.raw) + b'"')
+       if string.is_key:
+           self._stack[-1][1] = value
+           self._expect = "colon"
+       else:
+           self._add_value(value)
+
+
+   def _finish_scalar(self) -> None:
+       value = json.loads(bytes(self._scalar))
+       self._scalar = None
+       self._add_value(value)
+
+
+   def _add_value(self, value: Any) -> None:
+       if not self._stack:
+           self._result = value
+           self._done = True
+           return
+       top = self._stack[-1]
+       if isinstance(top[0], dict):
+           top[0][top[1]] = value
+           top[1] = None
+       else:
+           top[0].append(value)
+       self._expect = "comma"
+
+
+   def _close_container(self, char: int, pos: int) -> int:
+       container, _ = self._stack.pop()
+       if (char == ord("}")) != isinstance(container, dict):
+           raise ValueError(f"Dấu đóng không khớp tại vị trí {pos}.")
+       self._add_value(container)
+       return pos + 1
@@ -0,0 +1,157 @@
+# File: src/model/tracing.py
+
+
+import contextlib
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from src.model.metrics import METRICS, SIZE_BUCKETS, Metrics
+from src.model.resilience import endpoint_key
+
+
+# Trace của request đang chạy trong thread hiện tại (client đồng bộ), để hook kết nối ghi vào.
+_active = threading.local()
+
+
+class RequestTrace:
+   """
+   Thu thập số liệu của một lần gọi API (tính cả các lần thử lại) rồi ghi vào Metrics.
+
+   Các phase được đo loại trừ lẫn nhau: phase lồng bên trong (ví dụ "connect" trong "ttfb",
+   "file_write" trong "transfer") được trừ khỏi phase bao ngoài, nên tổng các phase xấp xỉ
+   thời gian thực của lần gọi.
+
+   Phase: connect (DNS + TCP + TLS), ttfb (chờ header phản hồi), transfer (nhận body),
+   json_decode, file_write; các node ghi thêm b64_decode/file_write qua Metrics.timer.
+   """
+
+   def __init__(self, metrics: Metrics, method: str, endpoint: str, model: Optional[str] = None):
+       self.metrics = metrics
+       self.labels = {"endpoint": endpoint_key(method, endpoint), "model": model or ""}
+       self.started = time.perf_counter()
+       self.phases: Dict[str, float] = defaultdict(float)
+       self.attempts = 0
+       self.status: Optional[str] = None
+       self.request_bytes = 0
+       self.response_bytes = 0
+       # Mỗi phần tử: [tên phase, thời điểm bắt đầu, thời gian của các phase con]
+       self._stack: List[List[Any]] = []
+
+
+   def begin(self, name: str) -> None:
+       self._stack.append([name, time.perf_counter(), 0.0])
+
+
+   def end(self) -> None:
+       name, started, children = self._stack.pop()
+       elapsed = time.perf_counter() - started
+       self.phases[name] += elapsed - children
+       if self._stack:
+           self._stack[-1][2] += elapsed
+
+
+   @contextlib.contextmanager
+   def phase(self, name: str) -> Iterator[None]:
+       self.begin(name)
+       try:
+           yield
+       finally:
+           self.end()
+
+
+   @contextlib.contextmanager
+   def activate(self) -> Iterator[None]:
+       """Cho hook kết nối của urllib3 biết request nào đang chạy trong thread này."""
+       previous = getattr(_active, "trace", None)
+       _active.trace = self
+       try:
+           yield
+       finally:
+           _active.trace = previous
+
+
+   def record_attempt(self, status: Any) -> None:
+       """Ghi nhận kết quả một lần gửi (HTTP status hoặc loại lỗi)."""
+       self.attempts += 1
+       self.status = str(status)
+       self.metrics.inc("responses_total", status=self.status, **self.labels)
+
+
+   async def httpx_hook(self, event: str, info: Dict[str, Any]) -> None:
+       """Callback cho extension "trace" của httpx.AsyncClient (httpcore await hàm này)."""
+       if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+           self.begin("connect")
+       elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete",
+                      "connection.connect_tcp.failed", "connection.start_tls.failed"):
+           if self._stack and self._stack[-1][0] == "connect":
+               self.end()
+
+
+   def finish(self, status: Optional[str] = None) -> None:
+       """Ghi tổng thời gian, các phase, kích thước và số lần thử lại vào Metrics."""
+       while self._stack:
+           self.end()
+       status = status or self.status or "error"
+       self.metrics.observe("request_seconds", time.perf_counter() - self.started, status=status, **self.labels)
+       for name, seconds in self.phases.items():
+           self.metrics.observe("phase_seconds", seconds, phase=name, **self.labels)
+       if self.request_bytes:
+           self.metrics.observe("request_bytes", self.request_bytes, buckets=SIZE_BUCKETS, **self.labels)
+       if self.response_bytes:
+           self.metrics.observe("response_bytes", self.response_bytes, buckets=SIZE_BUCKETS, **self.labels)
+       if self.attempts > 1:
+           self.metrics.inc("retries_total", self.attempts - 1, **self.labels)
+
+
+def _timed_connect(connect):
+   def wrapper(self):
+       trace = getattr(_active, "trace", None)
+       if trace is None:
+           return connect(self)
+       with trace.phase("connect"):
+           return connect(self)
+   return wrapper
+
+
+class _TimedHTTPConnection(HTTPConnection):
+   connect = _timed_connect(HTTPConnection.connect)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+   connect = _timed_connect(HTTPSConnection.connect)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+   ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+   ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+   """HTTPAdapter đo thời gian mở kết nối mới (DNS + TCP + TLS) cho RequestTrace đang chạy."""
+
+   def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+       super().init_poolmanager(*args, **kwargs)
+       self.poolmanager.pool_classes_by_scheme = {
+           "http": _TimedHTTPConnectionPool,
+           "https": _TimedHTTPSConnectionPool,
+       }
+
+
+def mount_timed_adapter(session: requests.Session) -> None:
+   adapter = TimedHTTPAdapter()
+   session.mount("http://", adapter)
+   session.mount("https://", adapter)
+
+
+def default_metrics(bot: Any) -> Metrics:
+   """Registry mà node nên dùng: của bot nếu có, nếu không là METRICS."""
+   return getattr(bot, "metrics", None) or METRICS
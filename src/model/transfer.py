@@ -0,0 +1,169 @@
+# File: src/model/transfer.py
+
+
+import os
+import tempfile
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+
+# (connect, read) timeout tính bằng giây theo loại thao tác. Read timeout là thời gian tối đa
+# giữa hai lần nhận dữ liệu, không phải tổng thời gian của request.
+DEFAULT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+   "chat": (10.0, 120.0),
+   "generate": (10.0, 180.0),
+   "speech": (10.0, 180.0),
+   "video_submit": (10.0, 60.0),
+   "status": (10.0, 30.0),
+   "download": (10.0, 60.0),
+   "upload": (10.0, 120.0),
+   "default": (10.0, 120.0),
+}
+
+# Kích thước khối khi ghi file tải về.
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Hàm báo tiến độ: (số byte đã có, tổng số byte hoặc None nếu không biết).
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+
+def operation_type(method: str, endpoint: str) -> str:
+   """Phân loại request để chọn timeout, ví dụ 'download' cho /gemini/download/.../files/{id}:download."""
+   path = endpoint.split("?", 1)[0]
+   if path.startswith("/gemini/download/"):
+       return "download"
+   if path.startswith("/gemini/upload/"):
+       return "upload"
+   if method.upper() == "GET":
+       return "status"
+   if path.startswith("/chat/completions"):
+       return "chat"
+   if path.startswith("/audio/speech"):
+       return "speech"
+   if path.endswith(":predictLongRunning"):
+       return "video_submit"
+   if path.startswith("/images/") or path.endswith((":predict", ":generateContent")):
+       return "generate"
+   return "default"
+
+
+def resolve_timeouts(overrides: Optional[Mapping[str, Tuple[float, float]]] = None) -> Dict[str, Tuple[float, float]]:
+   """Gộp timeout người dùng truyền vào với DEFAULT_TIMEOUTS."""
+   timeouts = dict(DEFAULT_TIMEOUTS)
+   if overrides:
+       timeouts.update(overrides)
+   return timeouts
+
+
+class PartialDownload:
+   """
+   Ghi file tải về vào output_file + '.part' rồi đổi tên khi hoàn tất, để không bao giờ
+   để lại file hỏng ở output_file.
+
+   Khi server hỗ trợ Range (Accept-Ranges: bytes), lần gửi lại sau khi mất kết nối giữa chừng
+   sẽ yêu cầu phần còn thiếu ('Range: bytes=<đã có>-') và ghi nối vào file tạm.
+   """
+
+   def __init__(self, output_file: str, resumable: bool = True, progress: Optional[ProgressCallback] = None):
+       """
+       Args:
+           output_file (str): Đường dẫn file đích.
+           resumable (bool): Cho phép tải tiếp bằng Range (chỉ nên dùng cho GET).
+           progress (Optional[ProgressCallback]): Hàm báo tiến độ sau mỗi khối.
+       """
+       self.output_file = output_file
+       self.part_path = f"{output_file}.part"
+       self.resumable = resumable
+       self.progress = progress
+       self.server_ranges = False
+       self.validator: Optional[str] = None
+       self.received = 0
+       self.total: Optional[int] = None
+       self._file = None
+       directory = os.path.dirname(output_file)
+       if directory:
+           os.makedirs(directory, exist_ok=True)
+       # File .part còn sót từ lần chạy trước không chắc cùng nội dung: tải lại từ đầu.
+       self.discard()
+
+
+   def request_headers(self) -> Dict[str, str]:
+       """Header Range (và If-Range) cho lần gửi tiếp theo, rỗng nếu phải tải từ đầu."""
+       if not (self.resumable and self.server_ranges and self.received):
+           return {}
+       headers = {"Range": f"bytes={self.received}-"}
+       if self.validator:
+           headers["If-Range"] = self.validator
+       return headers
+
+
+   def begin(self, status_code: int, headers: Mapping[str, str]) -> bool:
+       """
+       Đọc header phản hồi và mở file tạm ở chế độ phù hợp.
+
+
+       Returns:
+           bool: False nếu phản hồi 206 không bắt đầu đúng vị trí đã có (cần tải lại từ đầu).
+       """
+       length = headers.get("Content-Length")
+       if status_code == 206 and self.received:
+           if not headers.get("Content-Range", "").startswith(f"bytes {self.received}-"):
+               self.server_ranges = False
+               self.discard()
+               return False
+           mode = "ab"
+           self.total = self.received + int(length) if length and length.isdigit() else None
+       else:
+           # 200: server gửi lại toàn bộ nội dung.
+           mode = "wb"
+           self.received = 0
+           self.total = int(length) if length and length.isdigit() else None
+           self.server_ranges = headers.get("Accept-Ranges", "").lower() == "bytes"
+           self.validator = headers.get("ETag") or headers.get("Last-Modified")
+       self._file = open(self.part_path, mode)
+       return True
+
+
+   def write(self, chunk: bytes) -> None:
+       self._file.write(chunk)
+       self.received += len(chunk)
+       if self.progress is not None:
+           self.progress(self.received, self.total)
+
+
+   def close(self) -> None:
+       """Đóng file tạm (giữ lại phần đã tải để có thể tải tiếp)."""
+       if self._file is not None and not self._file.closed:
+           self._file.close()
+
+
+   def commit(self) -> None:
+       """Đổi tên file tạm thành output_file (atomic trên cùng hệ thống file)."""
+       self.close()
+       os.replace(self.part_path, self.output_file)
+
+
+   def discard(self) -> None:
+       self.close()
+       self.received = 0
+       try:
+           os.remove(self.part_path)
+       except FileNotFoundError:
+           pass
+
+
+def write_file_atomic(path: str, data: bytes) -> None:
+   """
+   Ghi data vào file tạm cạnh path rồi đổi tên, tạo thư mục nếu chưa có.
+   File tạm có tên riêng cho mỗi lần ghi nên nhiều lần ghi đồng thời vào cùng path không giẫm lên nhau.
+   """
+   directory = os.path.dirname(path)
+   if directory:
+       os.makedirs(directory, exist_ok=True)
+   fd, partial = tempfile.mkstemp(dir=directory or ".", prefix=f"{os.path.basename(path)}.", suffix=".part")
+   try:
+       with os.fdopen(fd, "wb") as f:
+           f.write(data)
+       os.replace(partial, path)
+   except BaseException:
+       os.remove(partial)
+       raise
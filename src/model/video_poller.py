@@ -0,0 +1,272 @@
+# File: src/model/video_poller.py
+
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.model.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Mặc định của VideoOperationPoller và PollBackoff.
+DEFAULT_INITIAL_INTERVAL = 5.0
+DEFAULT_MAX_INTERVAL = 30.0
+DEFAULT_BACKOFF = 1.5
+DEFAULT_MAX_STATUS_ERRORS = 3
+
+
+class PollBackoff:
+   """
+   Lịch polling của một tác vụ: khoảng chờ tăng dần (initial_interval * backoff^k, tối đa
+   max_interval) và số lần lỗi liên tiếp khi lấy trạng thái. Dùng chung cho VideoOperationPoller
+   và AsyncThucChienAIBot (chờ bằng asyncio.sleep).
+   """
+
+   def __init__(
+       self,
+       max_interval: float,
+       initial_interval: float = DEFAULT_INITIAL_INTERVAL,
+       backoff: float = DEFAULT_BACKOFF,
+       max_status_errors: int = DEFAULT_MAX_STATUS_ERRORS
+   ):
+       # max_interval nhỏ hơn initial_interval thì lần kiểm tra đầu tiên cũng sớm hơn.
+       self.interval = min(initial_interval, max_interval)
+       self.max_interval = max_interval
+       self.backoff = backoff
+       self.max_status_errors = max_status_errors
+       self.status_errors = 0
+
+
+   def status_failed(self) -> bool:
+       """Ghi nhận một lần không lấy được trạng thái; trả về True nếu đã đến lúc bỏ cuộc."""
+       self.status_errors += 1
+       return self.status_errors >= self.max_status_errors
+
+
+   def status_received(self) -> None:
+       self.status_errors = 0
+
+
+   def next_interval(self) -> float:
+       """Tăng và trả về khoảng chờ trước lần kiểm tra tiếp theo."""
+       self.interval = min(self.interval * self.backoff, self.max_interval)
+       return self.interval
+
+
+class _PendingOperation:
+   """Trạng thái nội bộ của một tác vụ predictLongRunning đang được theo dõi."""
+
+   def __init__(self, operation_name: str, output_file: str, schedule: PollBackoff):
+       self.operation_name = operation_name
+       self.output_file = output_file
+       self.schedule = schedule
+       self.future: Future = Future()
+
+
+class VideoOperationPoller:
+   """
+   Theo dõi nhiều tác vụ sinh video (predictLongRunning) cùng lúc từ một thread polling duy nhất.
+
+   Mỗi tác vụ được kiểm tra theo khoảng thời gian tăng dần (initial_interval * backoff^k,
+   tối đa max_interval). Khi tác vụ hoàn thành, video được tải về trong một thread pool riêng
+   để không làm chậm việc polling các tác vụ khác; Future tương ứng được resolve với kết quả
+   của bot.download_video (dict 'status'/'file_path') hoặc None nếu thất bại.
+   """
+
+   def __init__(
+       self,
+       bot: Any,
+       initial_interval: float = DEFAULT_INITIAL_INTERVAL,
+       max_interval: float = DEFAULT_MAX_INTERVAL,
+       backoff: float = DEFAULT_BACKOFF,
+       max_status_errors: int = DEFAULT_MAX_STATUS_ERRORS,
+       download_workers: int = 4,
+       max_finished: int = 256
+   ):
+       """
+       Args:
+           bot: Client có các phương thức get_video_operation và download_video (ThucChienAIBot).
+           initial_interval (float): Thời gian chờ (giây) trước lần kiểm tra đầu tiên.
+           max_interval (float): Khoảng cách tối đa (giây) giữa hai lần kiểm tra.
+           backoff (float): Hệ số nhân khoảng chờ sau mỗi lần tác vụ chưa xong.
+           max_status_errors (int): Số lần lỗi liên tiếp khi lấy trạng thái trước khi bỏ cuộc.
+           download_workers (int): Số thread tải video song song.
+           max_finished (int): Số Future của tác vụ đã kết thúc được giữ lại cho future()/wait_for_video.
+       """
+       if initial_interval <= 0 or max_interval < initial_interval:
+           raise ValueError("Cần 0 < initial_interval <= max_interval.")
+       if backoff < 1:
+           raise ValueError("backoff phải lớn hơn hoặc bằng 1.")
+       self.bot = bot
+       self.initial_interval = initial_interval
+       self.max_interval = max_interval
+       self.backoff = backoff
+       self.max_status_errors = max_status_errors
+       self.max_finished = max_finished
+
+       self._cond = threading.Condition()
+       self._queue: List[Tuple[float, int, _PendingOperation]] = []
+       self._counter = itertools.count()
+       self._operations: Dict[str, _PendingOperation] = {}
+       # Tác vụ đã kết thúc được bỏ khỏi _operations; chỉ giữ Future của vài tác vụ gần nhất.
+       self._finished: "OrderedDict[str, Future]" = OrderedDict()
+       self._downloads = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="video-download")
+       self._thread: Optional[threading.Thread] = None
+       self._closed = False
+
+
+   def submit(
+       self,
+       operation_name: str,
+       output_file: str,
+       callback: Optional[Callable[[str, Optional[Dict[str, Any]]], None]] = None,
+       max_interval: Optional[float] = None
+   ) -> Future:
+       """
+       Đăng ký một tác vụ đã được khởi tạo để theo dõi.
+
+
+       Args:
+           operation_name (str): Tên tác vụ trả về từ predictLongRunning.
+           output_file (str): Đường dẫn lưu video khi tác vụ hoàn thành.
+           callback (Optional[Callable]): Hàm callback(operation_name, result) gọi khi hoàn tất.
+           max_interval (Optional[float]): Ghi đè khoảng chờ tối đa cho riêng tác vụ này.
+
+
+       Returns:
+           Future: Resolve với kết quả tải video (hoặc None nếu thất bại).
+       """
+       with self._cond:
+           if self._closed:
+               raise RuntimeError("VideoOperationPoller đã bị đóng.")
+           existing = self._operations.get(operation_name)
+           # Tác vụ đang được theo dõi: dùng chung Future. Tác vụ đã kết thúc (ví dụ tải lỗi) được theo dõi lại.
+           if existing is not None and not existing.future.done():
+               if callback is not None:
+                   existing.future.add_done_callback(lambda f: callback(operation_name, f.result()))
+               return existing.future
+
+           cap = self.max_interval if max_interval is None else max_interval
+           if cap <= 0:
+               raise ValueError("max_interval phải lớn hơn 0.")
+           schedule = PollBackoff(cap, self.initial_interval, self.backoff, self.max_status_errors)
+           op = _PendingOperation(operation_name, output_file, schedule)
+           if callback is not None:
+               op.future.add_done_callback(lambda f: callback(operation_name, f.result()))
+           self._operations[operation_name] = op
+           self._finished.pop(operation_name, None)
+           self._schedule(op, schedule.interval)
+           self._ensure_thread()
+           return op.future
+
+
+   def future(self, operation_name: str) -> Optional[Future]:
+       """Lấy Future của một tác vụ đã đăng ký (None nếu không tồn tại)."""
+       with self._cond:
+           op = self._operations.get(operation_name)
+           if op is not None:
+               return op.future
+           return self._finished.get(operation_name)
+
+
+   def pending(self) -> int:
+       """Số tác vụ chưa hoàn tất (đang polling hoặc đang tải)."""
+       with self._cond:
+           return sum(1 for op in self._operations.values() if not op.future.done())
+
+
+   def close(self, wait: bool = True) -> None:
+       """Dừng thread polling. Các tác vụ chưa xong được resolve với None."""
+       with self._cond:
+           self._closed = True
+           self._cond.notify_all()
+           thread = self._thread
+       if thread is not None and wait:
+           thread.join()
+       self._downloads.shutdown(wait=wait)
+       with self._cond:
+           operations = list(self._operations.values())
+       for op in operations:
+           self._finish(op, None)
+
+
+   # --- Vòng lặp polling ---
+
+   def _schedule(self, op: _PendingOperation, delay: float) -> None:
+       heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), op))
+       self._cond.notify()
+
+
+   def _ensure_thread(self) -> None:
+       if self._thread is None or not self._thread.is_alive():
+           self._thread = threading.Thread(target=self._run, name="video-poller", daemon=True)
+           self._thread.start()
+
+
+   def _run(self) -> None:
+       while True:
+           with self._cond:
+               while not self._closed and (not self._queue or self._queue[0][0] > time.monotonic()):
+                   timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                   self._cond.wait(timeout)
+               if self._closed:
+                   return
+               _, _, op = heapq.heappop(self._queue)
+           # Lỗi của một tác vụ không được làm dừng thread polling của các tác vụ khác.
+           try:
+               self._poll(op)
+           except Exception as e:
+               logger.error("Lỗi khi polling tác vụ %s: %s", op.operation_name, e)
+               self._finish(op, None)
+
+
+   def _poll(self, op: _PendingOperation) -> None:
+       try:
+           status_response = self.bot.get_video_operation(op.operation_name)
+       except Exception as e:
+           logger.warning("Lỗi khi lấy trạng thái tác vụ %s: %s", op.operation_name, e)
+           status_response = None
+
+       if not status_response:
+           if op.schedule.status_failed():
+               logger.error("Không thể lấy trạng thái tác vụ %s sau %d lần thử.", op.operation_name, op.schedule.status_errors)
+               self._finish(op, None)
+               return
+       else:
+           op.schedule.status_received()
+           if status_response.get('done'):
+               logger.info("Tác vụ %s đã hoàn thành, bắt đầu tải video...", op.operation_name)
+               self._downloads.submit(self._download, op, status_response)
+               return
+
+       delay = op.schedule.next_interval()
+       with self._cond:
+           self._schedule(op, delay)
+
+
+   def _download(self, op: _PendingOperation, status_response: Dict[str, Any]) -> None:
+       try:
+           result = self.bot.download_video(status_response, op.output_file)
+       except Exception as e:
+           logger.error("Lỗi khi tải video của tác vụ %s: %s", op.operation_name, e)
+           result = None
+       self._finish(op, result)
+
+
+   def _finish(self, op: _PendingOperation, result: Optional[Dict[str, Any]]) -> None:
+       with self._cond:
+           if self._operations.get(op.operation_name) is op:
+               del self._operations[op.operation_name]
+               self._finished[op.operation_name] = op.future
+               self._finished.move_to_end(op.operation_name)
+               while len(self._finished) > self.max_finished:
+                   self._finished.popitem(last=False)
+       if not op.future.done():
+           op.future.set_result(result)
@@ -3,12 +3,24 @@
 
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
+from ..model.log import get_logger
+from ..model.artifact_store import artifact_store, output_labels, unique_output_path
+from ..model.metrics import METRICS, Metrics
+from ..model.streaming_json import FILE_REF, is_file_ref
+from ..model.tracing import default_metrics
+from ..model.transfer import write_file_atomic
 from typing import List, Dict, Any
+import asyncio
 import base64
 import os
 import time
 
 
+logger = get_logger(__name__)
+
+OUTPUT_DIR = "output/images"
+
+
 SYSTEM_PROMPT_VI = """
 Bạn là một trợ lý hữu ích hãy tạo hình ảnh theo yêu cầu của người dùng.
 """
@@ -19,58 +31,68 @@ You are a helpful assistant, help generate image according to user demand.
 """
 
 
-def text2img(state: State, config: RunnableConfig) -> State:
-   """NODE: Tạo ảnh dựa trên yêu cầu."""
-   print("--- Thực hiện Node: text2img ---")
-
-
+def _image_request(state: State, config: RunnableConfig) -> Dict[str, Any]:
    # --- LẤY CÁC THAM SỐ TỪ STATE ---
    question = state["t2i_question"]
    num_images = state.get("t2i_num_images", 1)
    aspect_ratio = state.get("t2i_aspect_ratio", None) # Mặc định "1:1"
    size = state.get("t2i_size", None)                  # Mặc định không có size
    # ----------------------------------
-  
-   bot = config["configurable"]["bot"]
-  
-   # --- GỌI API VỚI ĐẦY ĐỦ THAM SỐ ---
-   print(f"Đang tạo ảnh với prompt: '{question}', Tỷ lệ: {aspect_ratio}, Kích thước: {size or 'Mặc định'}")
-   response_dict = bot.generate_image(
-       model=os.getenv("IMAGE_MODEL_NAME"),
-       prompt=question,
-       n=num_images,
-       size=size,
-       aspect_ratio=aspect_ratio,
-   )
-   # -----------------------------------
 
+   logger.debug("Đang tạo ảnh với prompt: '%s', Tỷ lệ: %s, Kích thước: %s", question, aspect_ratio, size or 'Mặc định')
+   store = artifact_store(config)
+   return {
+       "model": os.getenv("IMAGE_MODEL_NAME"),
+       "prompt": question,
+       "n": num_images,
+       "size": size,
+       "aspect_ratio": aspect_ratio,
+       # Ảnh được giải mã dần ra file tạm trong thư mục đích rồi chỉ cần đổi tên.
+       "decode_to": store.staging_dir if store else OUTPUT_DIR,
+   }
 
+
+def _save_images(state: State, response_dict: Dict[str, Any], config: RunnableConfig, started: float, metrics: Metrics = METRICS) -> State:
    if not response_dict or "data" not in response_dict:
-       print("Lỗi: Không nhận được dữ liệu ảnh hợp lệ từ API.")
+       logger.error("Lỗi: Không nhận được dữ liệu ảnh hợp lệ từ API.")
        state["t2i_output_path"] = "API call failed. No image generated."
        return state
 
 
+   store = artifact_store(config)
    saved_paths = []
    for i, image_obj in enumerate(response_dict["data"]):
        b64_data = image_obj.get("b64_json")
        if not b64_data:
-           print(f"Cảnh báo: Không tìm thấy 'b64_json' trong image object thứ {i+1}")
+           logger.warning("Cảnh báo: Không tìm thấy 'b64_json' trong image object thứ %s", i+1)
            continue
 
 
-       image_data = base64.b64decode(b64_data)
-      
-       output_dir = "output/images"
-       if not os.path.exists(output_dir):
-           os.makedirs(output_dir)
+       if store is not None:
+           # Lưu theo nội dung: ảnh trùng chỉ được lưu một lần, manifest ghi lại run/scene.
+           labels = dict(output_labels(config), mime="image/png", elapsed=time.perf_counter() - started)
+           with metrics.timer("node_phase_seconds", node="text2img", phase="artifact_store"):
+               if is_file_ref(b64_data):
+                   save_path = store.put_file(b64_data[FILE_REF], "text2img", **labels)
+               else:
+                   save_path = store.put_bytes(base64.b64decode(b64_data), "text2img", **labels)
+           logger.info("Image saved to %s", save_path)
+           saved_paths.append(save_path)
+           continue
+
 
+       save_path = unique_output_path(OUTPUT_DIR, "generated_image", ".png")
 
-       save_path = f"{output_dir}/generated_image_{int(time.time())}_{i+1}.png"
-      
-       with open(save_path, 'wb') as f:
-           f.write(image_data)
-       print(f"Image saved to {save_path}")
+       if is_file_ref(b64_data):
+           # Đã được StreamingJSONDecoder giải mã ra file trong OUTPUT_DIR.
+           with metrics.timer("node_phase_seconds", node="text2img", phase="file_move"):
+               os.replace(b64_data[FILE_REF], save_path)
+       else:
+           with metrics.timer("node_phase_seconds", node="text2img", phase="b64_decode"):
+               image_data = base64.b64decode(b64_data)
+           with metrics.timer("node_phase_seconds", node="text2img", phase="file_write"):
+               write_file_atomic(save_path, image_data)
+       logger.info("Image saved to %s", save_path)
        saved_paths.append(save_path)
   
    if saved_paths:
@@ -80,3 +102,30 @@ def text2img(state: State, config: RunnableConfig) -> State:
   
    return state
 
+
+def text2img(state: State, config: RunnableConfig) -> State:
+   """NODE: Tạo ảnh dựa trên yêu cầu."""
+   logger.debug("Thực hiện Node: text2img")
+  
+   bot = config["configurable"]["bot"]
+   started = time.perf_counter()
+  
+   # --- GỌI API VỚI ĐẦY ĐỦ THAM SỐ ---
+   response_dict = bot.generate_image(**_image_request(state, config))
+   # -----------------------------------
+
+   return _save_images(state, response_dict, config, started, default_metrics(bot))
+
+
+async def atext2img(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Tạo ảnh dựa trên yêu cầu bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(text2img, state, config)
+
+   logger.debug("Thực hiện Node: text2img (async)")
+
+   started = time.perf_counter()
+   response_dict = await bot.generate_image(**_image_request(state, config))
+
+   return _save_images(state, response_dict, config, started, default_metrics(bot))
@@ -4,10 +4,16 @@
 from langchain_core.messages import SystemMessage, BaseMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
-from typing import List, Dict, Any
+from ..model.context_cache import gemini_text
+from ..model.log import get_logger
+from typing import List, Dict, Any, Optional
+import asyncio
 import os
 
 
+logger = get_logger(__name__)
+
+
 SYSTEM_PROMPT_VI = """
 Bạn là một trợ lý hữu ích hãy trả lời theo yêu cầu của người dùng.
 """
@@ -18,29 +24,93 @@ You are a helpful assistant, help answer according to user demand.
 """
 
 
+def _system_prompt() -> str:
+   return SYSTEM_PROMPT_VI if os.getenv("LANGUAGE", "EN") == "VI" else SYSTEM_PROMPT_EN
+
+
+def _build_messages(question: str, context: Optional[str] = None) -> List[Dict[str, str]]:
+   return [
+       {"role": "developer", "content": _system_prompt()},
+       {"role": "user", "content": f"{context}\n\n{question}" if context else question},
+   ]
+
+
+def _use_context_cache(bot: Any, context: Optional[str]) -> bool:
+   # Context dài dùng chung (t2t_context) đi qua generateContent để được cache phía provider (xem src/model/context_cache.py).
+   return bool(context) and getattr(bot, "contexts", None) is not None
+
+
+def _store_answer(state: State, response: Optional[Dict[str, Any]]) -> State:
+   logger.debug("Trả lời: %s", response)
+
+   if not response:
+       answer = None
+   elif "candidates" in response:
+       answer = gemini_text(response)
+   else:
+       try:
+           answer = response['choices'][0]["message"]["content"]
+       except (KeyError, IndexError, TypeError):
+           answer = None
+
+   if answer is None:
+       logger.error("Lỗi: Không nhận được dữ liệu hợp lệ từ API.")
+       answer = "API call failed. No valid response received."
+   state["t2t_answer"] = answer
+   return state
+
+
 def text2text(state: State, config: RunnableConfig) -> State:
    """NODE: Trả lời câu hỏi."""
-   print("--- Thực hiện Node: text2text ---")
+   logger.debug("Thực hiện Node: text2text")
 
 
    question = state["t2t_question"]
-
-
-   prompt_messages = [
-       {"role": "developer", "content": SYSTEM_PROMPT_VI} if os.getenv("LANGUAGE", "EN") == "VI" else {"role": "developer", "content": SYSTEM_PROMPT_EN},
-       {"role": "user", "content": question},
-   ]
+   context = state.get("t2t_context")
   
    bot = config["configurable"]["bot"]
 
 
-   response = bot.create_chat_completion(
-       model=os.getenv("TEXT_MODEL_NAME"),
-       messages=prompt_messages,
-   )
+   if _use_context_cache(bot, context):
+       response = bot.generate_text_gemini(
+           model=os.getenv("TEXT_MODEL_NAME"),
+           prompt=question,
+           context=context,
+           system_instruction=_system_prompt(),
+       )
+   else:
+       response = bot.create_chat_completion(
+           model=os.getenv("TEXT_MODEL_NAME"),
+           messages=_build_messages(question, context),
+       )
       
-   print(f"Trả lời: {response}")
-  
-   state["t2t_answer"] = response['choices'][0]["message"]["content"]
-  
-   return state
+   return _store_answer(state, response)
+
+
+async def atext2text(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Trả lời câu hỏi bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(text2text, state, config)
+
+   logger.debug("Thực hiện Node: text2text (async)")
+
+
+   question = state["t2t_question"]
+   context = state.get("t2t_context")
+
+
+   if _use_context_cache(bot, context):
+       response = await bot.generate_text_gemini(
+           model=os.getenv("TEXT_MODEL_NAME"),
+           prompt=question,
+           context=context,
+           system_instruction=_system_prompt(),
+       )
+   else:
+       response = await bot.create_chat_completion(
+           model=os.getenv("TEXT_MODEL_NAME"),
+           messages=_build_messages(question, context),
+       )
+
+   return _store_answer(state, response)
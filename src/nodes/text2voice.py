@@ -3,11 +3,17 @@
 
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
-from typing import List, Dict, Any
+from ..model.artifact_store import artifact_store, output_labels, unique_output_path
+from ..model.log import get_logger
+from typing import List, Dict, Any, Optional
+import asyncio
 import os
 import time
 
 
+logger = get_logger(__name__)
+
+
 SYSTEM_PROMPT_VI = """
 Bạn là một trợ lý hữu ích, hãy chuyển đổi văn bản thành giọng nói theo yêu cầu của người dùng.
 """
@@ -18,11 +24,7 @@ You are a helpful assistant, help convert text to speech according to user deman
 """
 
 
-def text2voice(state: State, config: RunnableConfig) -> State:
-   """NODE: Chuyển đổi văn bản thành giọng nói (Text-to-Speech)."""
-   print("--- Thực hiện Node: text2voice ---")
-
-
+def _speech_request(state: State, config: RunnableConfig) -> Optional[Dict[str, Any]]:
    # Lấy thông tin cần thiết từ state
    question = state.get("t2s_question") # t2s = text-to-speech
    voice_name = state.get("t2s_voice", "Zephyr") # Tùy chọn, mặc định là giọng 'Zephyr'
@@ -30,41 +32,80 @@ def text2voice(state: State, config: RunnableConfig) -> State:
 
    # Kiểm tra đầu vào bắt buộc
    if not question:
-       print("Lỗi: Cần cung cấp 't2s_question' trong state.")
+       logger.error("Lỗi: Cần cung cấp 't2s_question' trong state.")
        state["t2s_output_path"] = "Error: Missing text input for speech generation."
-       return state
-
-
-   bot = config["configurable"]["bot"]
+       return None
 
 
    # --- Chuẩn bị đường dẫn để lưu file âm thanh ---
-   if not os.path.exists("output"):
-       os.makedirs("output")
-  
-   save_path = f"output/generated_audio_{int(time.time())}.mp3"
-  
-   # --- Gọi API để tạo file âm thanh ---
-   # Hàm này sẽ gọi API và lưu file trực tiếp vào save_path
-   audio_result = bot.generate_speech(
-       output_file=save_path,
-       model=os.getenv("TTS_MODEL_NAME"), # Ví dụ: gemini-2.5-flash-preview-tts
-       input_text=question,
-       voice=voice_name
-   )
+   # Có ArtifactStore: tải vào staging rồi _store_audio đưa vào kho (t2s_output_path, nếu có, là bản export).
+   store = artifact_store(config)
+   if store is not None:
+       save_path = store.staging_path(".mp3")
+   else:
+       save_path = state.get("t2s_output_path") or unique_output_path("output", "generated_audio", ".mp3")
+
+   return {
+       "output_file": save_path,
+       "model": os.getenv("TTS_MODEL_NAME"), # Ví dụ: gemini-2.5-flash-preview-tts
+       "input_text": question,
+       "voice": voice_name
+   }
 
 
+def _store_audio(state: State, audio_result: Optional[Dict[str, Any]], config: RunnableConfig, started: float) -> State:
    # --- Xử lý kết quả ---
    # bot.generate_speech trả về một dict có 'status' và 'file_path' nếu thành công, hoặc None nếu thất bại.
    if audio_result and audio_result.get("status") == "success":
        output_path = audio_result.get("file_path")
-       print(f"Quá trình tạo âm thanh hoàn tất. File được lưu tại: {output_path}")
+       store = artifact_store(config)
+       if store is not None:
+           output_path = store.put_file(
+               output_path, "text2voice", mime="audio/mpeg", elapsed=time.perf_counter() - started,
+               export_to=state.get("t2s_output_path"), **output_labels(config)
+           )
+       logger.info("Quá trình tạo âm thanh hoàn tất. File được lưu tại: %s", output_path)
        # Cập nhật state với đường dẫn file đã lưu
        state["t2s_output_path"] = output_path
    else:
-       print("Lỗi: Quá trình tạo âm thanh thất bại.")
+       logger.error("Lỗi: Quá trình tạo âm thanh thất bại.")
        # Cập nhật state với thông báo lỗi
        state["t2s_output_path"] = "API call failed. No audio generated."
   
    return state
 
+
+def text2voice(state: State, config: RunnableConfig) -> State:
+   """NODE: Chuyển đổi văn bản thành giọng nói (Text-to-Speech)."""
+   logger.debug("Thực hiện Node: text2voice")
+
+   started = time.perf_counter()
+   request = _speech_request(state, config)
+   if request is None:
+       return state
+
+   bot = config["configurable"]["bot"]
+  
+   # --- Gọi API để tạo file âm thanh ---
+   # Hàm này sẽ gọi API và lưu file trực tiếp vào save_path
+   audio_result = bot.generate_speech(**request)
+
+   return _store_audio(state, audio_result, config, started)
+
+
+async def atext2voice(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Chuyển đổi văn bản thành giọng nói bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(text2voice, state, config)
+
+   logger.debug("Thực hiện Node: text2voice (async)")
+
+   started = time.perf_counter()
+   request = _speech_request(state, config)
+   if request is None:
+       return state
+
+   audio_result = await bot.generate_speech(**request)
+
+   return _store_audio(state, audio_result, config, started)
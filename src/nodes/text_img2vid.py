@@ -3,11 +3,18 @@
 
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
-from typing import List, Dict, Any
+from ..model.artifact_store import artifact_store, output_labels, unique_output_path
+from ..model.job_queue import DEFAULT_WAIT_TIMEOUT
+from ..model.log import get_logger
+from typing import List, Dict, Any, Optional
+import asyncio
 import os
 import time
 
 
+logger = get_logger(__name__)
+
+
 SYSTEM_PROMPT_VI = """
 Bạn là một trợ lý hữu ích, hãy tạo video từ hình ảnh và yêu cầu của người dùng.
 """
@@ -18,11 +25,7 @@ You are a helpful assistant, help generate a video from an image and a user's de
 """
 
 
-def text_img2vid(state: State, config: RunnableConfig) -> State:
-   """NODE: Tạo video dựa trên ảnh đầu vào và yêu cầu (prompt)."""
-   print("--- Thực hiện Node: textimg2vid ---")
-
-
+def _video_request(state: State) -> Optional[Dict[str, Any]]:
    # Lấy thông tin cần thiết từ state
    question = state.get("ti2v_question")
    input_path = state.get("ti2v_image_path")
@@ -33,45 +36,147 @@ def text_img2vid(state: State, config: RunnableConfig) -> State:
 
    # Kiểm tra các đầu vào bắt buộc
    if not question or not input_path:
-       print("Lỗi: Cần cung cấp 'ti2v_question' và 'ti2v_image_path' trong state.")
+       logger.error("Lỗi: Cần cung cấp 'ti2v_question' và 'ti2v_image_path' trong state.")
        state["ti2v_output_path"] = "Error: Missing question or input image path."
-       return state
+       return None
 
 
    if not os.path.exists(input_path):
-       print(f"Lỗi: Không tìm thấy file ảnh đầu vào tại '{input_path}'.")
+       logger.error("Lỗi: Không tìm thấy file ảnh đầu vào tại '%s'.", input_path)
        state["ti2v_output_path"] = f"Error: Input file not found at {input_path}."
-       return state
-
-
-   bot = config["configurable"]["bot"]
+       return None
 
 
    # --- Chuẩn bị đường dẫn để lưu video ---
-   if not os.path.exists("output"):
-       os.makedirs("output")
-  
-   save_path = state.get("ti2v_output_path", f"output/videos/generated_video_from_image_{int(time.time())}.mp4")
-  
-   # --- Gọi API để tạo video từ ảnh và question ---
-   video_result = bot.generate_video(
-       output_file=save_path,
-       model=os.getenv("VIDEO_MODEL_NAME"), # Ví dụ: veo-3.0-generate-001
-       prompt=question,
-       image_path=input_path, # <-- Truyền đường dẫn ảnh vào đây
-       negative_prompt=negative_question,
-       aspect_ratio=aspect_ratio,
-       resolution=resolution
-   )
+   save_path = state.get("ti2v_output_path") or unique_output_path("output/videos", "generated_video_from_image", ".mp4")
 
+   return {
+       "output_file": save_path,
+       "model": os.getenv("VIDEO_MODEL_NAME"), # Ví dụ: veo-3.0-generate-001
+       "prompt": question,
+       "image_path": input_path, # <-- Truyền đường dẫn ảnh vào đây
+       "negative_prompt": negative_question,
+       "aspect_ratio": aspect_ratio,
+       "resolution": resolution
+   }
 
+
+def _store_video(state: State, video_result: Optional[Dict[str, Any]], config: Optional[RunnableConfig] = None, started: float = 0.0) -> State:
    # --- Xử lý kết quả ---
    if video_result and video_result.get("status") == "success":
        output_path = video_result.get("file_path")
-       print(f"Quá trình tạo video hoàn tất. File được lưu tại: {output_path}")
+       store = artifact_store(config)
+       if store is not None:
+           output_path = store.put_file(
+               output_path, "text_img2vid", mime="video/mp4", elapsed=time.perf_counter() - started,
+               export_to=state.get("ti2v_output_path"), **output_labels(config)
+           )
+       logger.info("Quá trình tạo video hoàn tất. File được lưu tại: %s", output_path)
        state["ti2v_output_path"] = output_path
    else:
-       print("Lỗi: Quá trình tạo video từ ảnh thất bại.")
+       logger.error("Lỗi: Quá trình tạo video từ ảnh thất bại.")
        state["ti2v_output_path"] = "API call failed. No video generated from the image."
   
-   return state
\ No newline at end of file
+   return state
+
+
+def _store_operation(state: State, operation_name: Optional[str], request: Dict[str, Any]) -> State:
+   # Kết quả của bot.submit_video (đồng bộ hoặc async): chỉ ghi tên tác vụ, bot sẽ polling và tải video sau.
+   if operation_name is None:
+       logger.error("Lỗi: Không thể khởi tạo tác vụ sinh video.")
+       state["ti2v_output_path"] = "API call failed. Video operation was not started."
+       return state
+
+   logger.info("Đã gửi tác vụ %s, video sẽ được lưu tại: %s", operation_name, request['output_file'])
+   state["ti2v_operation_name"] = operation_name
+   state["ti2v_output_path"] = request["output_file"]
+   return state
+
+
+def _enqueue_video(state: State, queue, request: Dict[str, Any]) -> str:
+   # Job được ghi vào hàng đợi bền (VideoJobQueue); một VideoJobWorker sẽ gửi, polling và tải video.
+   job_id = queue.enqueue(request)
+   logger.info("Đã đưa job video %s vào hàng đợi.", job_id)
+   state["ti2v_job_id"] = job_id
+   state["ti2v_output_path"] = request["output_file"]
+   return job_id
+
+
+def _queue_timeout(config: RunnableConfig) -> float:
+   return config["configurable"].get("video_queue_timeout", DEFAULT_WAIT_TIMEOUT)
+
+
+def _store_queued_video(state: State, queue, job_id: str, video_result: Optional[Dict[str, Any]], config: RunnableConfig, started: float) -> State:
+   state = _store_video(state, video_result, config, started)
+   # put_file chuyển file của job vào ArtifactStore: ghi lại đường dẫn mới để lần gửi lại sau vẫn dùng được kết quả.
+   if artifact_store(config) is not None and video_result and video_result.get("status") == "success":
+       if state["ti2v_output_path"] != video_result.get("file_path"):
+           queue.complete(job_id, {**video_result, "file_path": state["ti2v_output_path"]})
+   return state
+
+
+def text_img2vid(state: State, config: RunnableConfig) -> State:
+   """NODE: Tạo video dựa trên ảnh đầu vào và yêu cầu (prompt)."""
+   logger.debug("Thực hiện Node: textimg2vid")
+
+   started = time.perf_counter()
+   request = _video_request(state)
+   if request is None:
+       return state
+
+   bot = config["configurable"]["bot"]
+
+   # Có video_queue: chạy lại graph sau khi process chết sẽ tiếp tục tác vụ đã gửi thay vì gửi lại.
+   queue = config["configurable"].get("video_queue")
+   if queue is not None:
+       job_id = _enqueue_video(state, queue, request)
+       if not config["configurable"].get("wait_for_video", True):
+           return state
+       return _store_queued_video(state, queue, job_id, queue.wait(job_id, timeout=_queue_timeout(config)), config, started)
+
+   # Chế độ không chờ: chỉ khởi tạo tác vụ, video_poller của bot sẽ polling và tải video sau.
+   if not config["configurable"].get("wait_for_video", True):
+       return _store_operation(state, bot.submit_video(**request), request)
+  
+   # --- Gọi API để tạo video từ ảnh và question ---
+   # Có ArtifactStore: video được tải vào staging rồi _store_video đưa vào kho theo nội dung.
+   store = artifact_store(config)
+   if store is not None:
+       request["output_file"] = store.staging_path(".mp4")
+   video_result = bot.generate_video(**request)
+
+   return _store_video(state, video_result, config, started)
+
+
+async def atext_img2vid(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Tạo video từ ảnh và prompt bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(text_img2vid, state, config)
+
+   logger.debug("Thực hiện Node: textimg2vid (async)")
+
+   started = time.perf_counter()
+   request = _video_request(state)
+   if request is None:
+       return state
+
+   queue = config["configurable"].get("video_queue")
+   if queue is not None:
+       job_id = _enqueue_video(state, queue, request)
+       if not config["configurable"].get("wait_for_video", True):
+           return state
+       video_result = await queue.await_job(job_id, timeout=_queue_timeout(config))
+       return _store_queued_video(state, queue, job_id, video_result, config, started)
+
+   # Chế độ không chờ: chỉ khởi tạo tác vụ, Task của bot sẽ polling và tải video trên event loop này.
+   if not config["configurable"].get("wait_for_video", True):
+       return _store_operation(state, await bot.submit_video(**request), request)
+
+   # Có ArtifactStore: video được tải vào staging rồi _store_video đưa vào kho theo nội dung.
+   store = artifact_store(config)
+   if store is not None:
+       request["output_file"] = store.staging_path(".mp4")
+   video_result = await bot.generate_video(**request)
+
+   return _store_video(state, video_result, config, started)
@@ -3,17 +3,23 @@
 
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
-from typing import List, Dict, Any
+from ..model.log import get_logger
+from ..model.artifact_store import artifact_store, output_labels, unique_output_path
+from ..model.metrics import METRICS, Metrics
+from ..model.streaming_json import FILE_REF, is_file_ref
+from ..model.tracing import default_metrics
+from ..model.transfer import write_file_atomic
+from typing import List, Dict, Any, Optional
+import asyncio
 import base64
 import os
 import time
 
 
-def text_img2img(state: State, config: RunnableConfig) -> State:
-   """NODE: Chỉnh sửa hoặc phân tích dựa trên prompt và một hoặc nhiều ảnh đầu vào."""
-   print("--- Thực hiện Node: text_img2img ---")
+logger = get_logger(__name__)
 
 
+def _edit_request(state: State, config: RunnableConfig) -> Optional[Dict[str, Any]]:
    prompt = state.get("ti2i_question")
    # <-- THAY ĐỔI: Lấy danh sách đường dẫn thay vì một đường dẫn
    input_paths = state.get("ti2i_image_paths")
@@ -22,35 +28,46 @@ def text_img2img(state: State, config: RunnableConfig) -> State:
 
    # Kiểm tra đầu vào
    if not prompt or not input_paths:
-       print("Lỗi: Cần cung cấp 'ti2i_question' và 'ti2i_image_paths' (danh sách) trong state.")
+       logger.error("Lỗi: Cần cung cấp 'ti2i_question' và 'ti2i_image_paths' (danh sách) trong state.")
        state["ti2i_output_path"] = "Error: Missing prompt or image paths list."
-       return state
+       return None
   
    # <-- THAY ĐỔI: Kiểm tra sự tồn tại của từng file trong danh sách
    for path in input_paths:
        if not os.path.exists(path):
-           print(f"Lỗi: Không tìm thấy file ảnh đầu vào tại '{path}'.")
+           logger.error("Lỗi: Không tìm thấy file ảnh đầu vào tại '%s'.", path)
            state["ti2i_output_path"] = f"Error: Input file not found at {path}."
-           return state
-
+           return None
 
-   bot = config["configurable"]["bot"]
-  
    # <-- THAY ĐỔI: Truyền danh sách `input_paths` vào hàm
-   response_dict = bot.edit_image_gemini(
-       model=os.getenv("MULTIMODAL_MODEL_NAME"),
-       prompt=prompt,
-       image_paths=input_paths,
-       aspect_ratio=aspect_ratio
-   )
-
-
+   request = {
+       "model": os.getenv("MULTIMODAL_MODEL_NAME"),
+       "prompt": prompt,
+       "image_paths": input_paths,
+       "aspect_ratio": aspect_ratio
+   }
+   store = artifact_store(config)
+   if store is None and not state.get("ti2i_output_path"):
+       state["ti2i_output_path"] = unique_output_path("output/images", "edited_image", ".png")
+   # Ảnh kết quả được giải mã dần ra file tạm cạnh nơi lưu cuối cùng rồi chỉ cần đổi tên.
+   request["decode_to"] = store.staging_dir if store else os.path.dirname(state["ti2i_output_path"]) or "."
+   return request
+
+
+def _save_outputs(
+   state: State,
+   response_dict: Optional[Dict[str, Any]],
+   config: RunnableConfig,
+   started: float,
+   metrics: Metrics = METRICS
+) -> State:
    if not response_dict or "candidates" not in response_dict:
-       print("Lỗi: Không nhận được dữ liệu hợp lệ từ API.")
+       logger.error("Lỗi: Không nhận được dữ liệu hợp lệ từ API.")
        state["ti2i_output_path"] = "API call failed. No valid response received."
        return state
 
 
+   store = artifact_store(config)
    saved_paths = []
    text_responses = []
 
@@ -59,7 +76,7 @@ def text_img2img(state: State, config: RunnableConfig) -> State:
        try:
            part = candidate["content"]["parts"][0]
        except (KeyError, IndexError, TypeError):
-           print(f"Cảnh báo: Cấu trúc không hợp lệ trong candidate thứ {i+1}")
+           logger.warning("Cảnh báo: Cấu trúc không hợp lệ trong candidate thứ %s", i+1)
            continue
 
 
@@ -68,17 +85,29 @@ def text_img2img(state: State, config: RunnableConfig) -> State:
            if not b64_data:
                continue
           
-           image_data = base64.b64decode(b64_data)
-          
            save_path = state.get("ti2i_output_path")
-           with open(save_path, 'wb') as f:
-               f.write(image_data)
-           print(f"Ảnh kết quả được lưu tại: {save_path}")
+           if store is not None:
+               # Lưu theo nội dung; ti2i_output_path (nếu có, vd. scene_i.png của storyboard) là bản export.
+               labels = dict(output_labels(config), mime="image/png", elapsed=time.perf_counter() - started, export_to=save_path or None)
+               with metrics.timer("node_phase_seconds", node="text_img2img", phase="artifact_store"):
+                   if is_file_ref(b64_data):
+                       save_path = store.put_file(b64_data[FILE_REF], "text_img2img", **labels)
+                   else:
+                       save_path = store.put_bytes(base64.b64decode(b64_data), "text_img2img", **labels)
+           elif is_file_ref(b64_data):
+               with metrics.timer("node_phase_seconds", node="text_img2img", phase="file_move"):
+                   os.replace(b64_data[FILE_REF], save_path)
+           else:
+               with metrics.timer("node_phase_seconds", node="text_img2img", phase="b64_decode"):
+                   image_data = base64.b64decode(b64_data)
+               with metrics.timer("node_phase_seconds", node="text_img2img", phase="file_write"):
+                   write_file_atomic(save_path, image_data)
+           logger.info("Ảnh kết quả được lưu tại: %s", save_path)
            saved_paths.append(save_path)
       
        elif "text" in part:
            text_response = part["text"]
-           print(f"API đã trả về văn bản: '{text_response}'")
+           logger.debug("API đã trả về văn bản: '%s'", text_response)
            text_responses.append(text_response)
 
 
@@ -92,3 +121,36 @@ def text_img2img(state: State, config: RunnableConfig) -> State:
   
    return state
 
+
+def text_img2img(state: State, config: RunnableConfig) -> State:
+   """NODE: Chỉnh sửa hoặc phân tích dựa trên prompt và một hoặc nhiều ảnh đầu vào."""
+   logger.debug("Thực hiện Node: text_img2img")
+
+   started = time.perf_counter()
+   request = _edit_request(state, config)
+   if request is None:
+       return state
+
+   bot = config["configurable"]["bot"]
+  
+   response_dict = bot.edit_image_gemini(**request)
+
+   return _save_outputs(state, response_dict, config, started, default_metrics(bot))
+
+
+async def atext_img2img(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Chỉnh sửa hoặc phân tích ảnh bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(text_img2img, state, config)
+
+   logger.debug("Thực hiện Node: text_img2img (async)")
+
+   started = time.perf_counter()
+   request = _edit_request(state, config)
+   if request is None:
+       return state
+
+   response_dict = await bot.edit_image_gemini(**request)
+
+   return _save_outputs(state, response_dict, config, started, default_metrics(bot))
@@ -3,15 +3,16 @@
 
 from langchain_core.runnables import RunnableConfig
 from ..graph.state import State
-from typing import List, Dict, Any
+from ..model.log import get_logger
+from typing import List, Dict, Any, Optional
+import asyncio
 import os
 
 
-def textimg2text(state: State, config: RunnableConfig) -> State:
-   """NODE: Trả lời câu hỏi hoặc mô tả ảnh dựa trên ảnh và prompt đầu vào."""
-   print("--- Thực hiện Node: textimg2text ---")
+logger = get_logger(__name__)
 
 
+def _describe_request(state: State) -> Optional[Dict[str, Any]]:
    # Lấy thông tin cần thiết từ state (ti2t = text-image-to-text)
    prompt = state.get("ti2t_question")
    input_path = state.get("ti2t_image_path")
@@ -19,29 +20,27 @@ def textimg2text(state: State, config: RunnableConfig) -> State:
 
    # Kiểm tra các đầu vào bắt buộc
    if not prompt or not input_path:
-       print("Lỗi: Cần cung cấp 'ti2t_question' và 'ti2t_image_path' trong state.")
+       logger.error("Lỗi: Cần cung cấp 'ti2t_question' và 'ti2t_image_path' trong state.")
        state["ti2t_answer"] = "Error: Missing prompt or input image path."
-       return state
+       return None
       
    if not os.path.exists(input_path):
-       print(f"Lỗi: Không tìm thấy file ảnh đầu vào tại '{input_path}'.")
+       logger.error("Lỗi: Không tìm thấy file ảnh đầu vào tại '%s'.", input_path)
        state["ti2t_answer"] = f"Error: Input file not found at {input_path}."
-       return state
-
+       return None
 
-   bot = config["configurable"]["bot"]
-  
    # Chúng ta có thể tái sử dụng hàm edit_image_gemini vì nó gọi đến endpoint đa năng.
    # Endpoint này sẽ trả về text nếu prompt mang tính câu hỏi/mô tả.
-   response_dict = bot.edit_image_gemini(
-       model=os.getenv("MULTIMODAL_MODEL_NAME"), # Ví dụ: gemini-2.5-flash-image-preview
-       prompt=prompt,
-       image_path=input_path
-   )
+   return {
+       "model": os.getenv("MULTIMODAL_MODEL_NAME"), # Ví dụ: gemini-2.5-flash-image-preview
+       "prompt": prompt,
+       "image_paths": [input_path]
+   }
 
 
+def _store_answer(state: State, response_dict: Optional[Dict[str, Any]]) -> State:
    if not response_dict or "candidates" not in response_dict:
-       print("Lỗi: Không nhận được dữ liệu hợp lệ từ API.")
+       logger.error("Lỗi: Không nhận được dữ liệu hợp lệ từ API.")
        state["ti2t_answer"] = "API call failed. No valid response received."
        return state
 
@@ -53,18 +52,18 @@ def textimg2text(state: State, config: RunnableConfig) -> State:
        try:
            part = candidate["content"]["parts"][0]
        except (KeyError, IndexError, TypeError):
-           print(f"Cảnh báo: Cấu trúc không hợp lệ trong candidate thứ {i+1}")
+           logger.warning("Cảnh báo: Cấu trúc không hợp lệ trong candidate thứ %s", i+1)
            continue
 
 
        # Chúng ta chỉ quan tâm đến phần 'text' trong phản hồi
        if "text" in part:
            text_response = part["text"]
-           print(f"API đã trả về văn bản: '{text_response}'")
+           logger.debug("API đã trả về văn bản: '%s'", text_response)
            text_responses.append(text_response)
        else:
            # Ghi lại nếu API trả về một hình ảnh thay vì văn bản
-           print(f"Cảnh báo: API đã trả về một hình ảnh thay vì văn bản cho candidate {i+1}")
+           logger.warning("Cảnh báo: API đã trả về một hình ảnh thay vì văn bản cho candidate %s", i+1)
 
 
    # Gộp tất cả các phản hồi văn bản thành một chuỗi duy nhất
@@ -75,3 +74,34 @@ def textimg2text(state: State, config: RunnableConfig) -> State:
   
    return state
 
+
+def textimg2text(state: State, config: RunnableConfig) -> State:
+   """NODE: Trả lời câu hỏi hoặc mô tả ảnh dựa trên ảnh và prompt đầu vào."""
+   logger.debug("Thực hiện Node: textimg2text")
+
+   request = _describe_request(state)
+   if request is None:
+       return state
+
+   bot = config["configurable"]["bot"]
+  
+   response_dict = bot.edit_image_gemini(**request)
+
+   return _store_answer(state, response_dict)
+
+
+async def atextimg2text(state: State, config: RunnableConfig) -> State:
+   """NODE (async): Trả lời câu hỏi về ảnh bằng AsyncThucChienAIBot."""
+   bot = config["configurable"]["bot"]
+   if not getattr(bot, "is_async", False):
+       return await asyncio.to_thread(textimg2text, state, config)
+
+   logger.debug("Thực hiện Node: textimg2text (async)")
+
+   request = _describe_request(state)
+   if request is None:
+       return state
+
+   response_dict = await bot.edit_image_gemini(**request)
+
+   return _store_answer(state, response_dict)
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+
+from src.model.budget import CostAccountant
+
+
+def _key_info(spend: float) -> dict:
+    return {"info": {"spend": spend, "max_budget": None}}
+
+
+def test_refresh_error_clears_flag_and_retries():
+    accountant = CostAccountant(budget=10.0, refresh_interval=0.0)
+
+    def broken_refresh() -> None:
+        raise RuntimeError("/key/info unavailable")
+
+    with pytest.raises(RuntimeError):
+        accountant.reserve("gemini-2.5-flash", "chat", broken_refresh)
+    assert not accountant._refreshing
+
+    refreshed = []
+
+    def refresh() -> None:
+        refreshed.append(True)
+        accountant.reconcile(_key_info(1.0), time.time())
+
+    reservation = accountant.reserve("gemini-2.5-flash", "chat", refresh)
+    assert reservation is not None
+    assert refreshed == [True]
+    assert accountant.stats()["synced_spend"] == 1.0
+
+
+def test_refresh_without_spend_keeps_estimates():
+    accountant = CostAccountant(budget=10.0, refresh_interval=60.0)
+    reservation = accountant.reserve(
+        "gemini-2.5-flash", "chat", lambda: accountant.reconcile({"error": "unauthorized"}, time.time())
+    )
+    assert reservation is not None
+    assert not accountant._refreshing
+    # Lần đối chiếu lỗi vẫn được tính: không gọi lại /key/info trước refresh_interval.
+    assert not accountant.needs_refresh()
+
+
+def test_cancelled_async_refresh_clears_flag():
+    accountant = CostAccountant(budget=10.0, refresh_interval=0.0)
+
+    async def slow_refresh() -> None:
+        await asyncio.sleep(5)
+
+    async def scenario() -> None:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(accountant.areserve("gemini-2.5-flash", "chat", slow_refresh), timeout=0.05)
+        assert not accountant._refreshing
+
+        async def refresh() -> None:
+            accountant.reconcile(_key_info(2.0), time.time())
+
+        assert await accountant.areserve("gemini-2.5-flash", "chat", refresh) is not None
+        assert accountant.stats()["synced_spend"] == 2.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+from src.model.job_queue import VideoJobQueue, VideoJobWorker
+
+
+class _SlowSubmitBot:
+    """Bot giả: predictLongRunning chậm hơn lease, polling được ghi lại thay vì gọi API."""
+
+    def __init__(self, submit_seconds: float):
+        self.submit_seconds = submit_seconds
+        self.submits: List[Dict[str, Any]] = []
+        self.polled: List[str] = []
+        self.video_poller = self
+
+    def start_video_operation(self, **request: Any) -> str:
+        self.submits.append(request)
+        time.sleep(self.submit_seconds)
+        return f"operations/{len(self.submits)}"
+
+    def submit(self, operation_name: str, output_file: str, callback: Any = None) -> None:
+        self.polled.append(operation_name)
+
+
+def test_lease_survives_slow_submit(tmp_path):
+    queue = VideoJobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.enqueue({"output_file": str(tmp_path / "video.mp4"), "model": "veo", "prompt": "cat"})
+
+    bot = _SlowSubmitBot(submit_seconds=1.5)
+    worker = VideoJobWorker(queue, bot, worker_id="slow", lease_seconds=0.7, idle_interval=0.2)
+
+    worker.start()
+    while worker.in_flight() == 0:
+        time.sleep(0.01)
+    # Một worker khác liên tục thử lấy job trong lúc worker đầu đang gửi (lâu hơn lease_seconds).
+    deadline = time.monotonic() + 2.0
+    stolen = []
+    while time.monotonic() < deadline:
+        job = queue.lease("other", 0.7)
+        if job is not None:
+            stolen.append(job["id"])
+        time.sleep(0.05)
+    worker.stop(drain=False)
+
+    assert stolen == []
+    assert len(bot.submits) == 1
+    assert bot.polled == ["operations/1"]
+    assert queue.get(job_id)["operation_name"] == "operations/1"
+    queue.close()
+
+
+def test_lost_lease_drops_submitted_operation(tmp_path):
+    queue = VideoJobQueue(str(tmp_path / "jobs.sqlite"))
+    queue.enqueue({"output_file": str(tmp_path / "video.mp4"), "model": "veo", "prompt": "cat"})
+
+    bot = _SlowSubmitBot(submit_seconds=0.5)
+    worker = VideoJobWorker(queue, bot, worker_id="slow", lease_seconds=0.7, idle_interval=0.2)
+    job = queue.lease("slow", 0.7)
+
+    # Heartbeat báo job đã thuộc worker khác trong lúc đang gửi: kết quả gửi không được ghi lại.
+    starter = threading.Thread(target=worker._start_job, args=(job,))
+    starter.start()
+    time.sleep(0.1)
+    with worker._lock:
+        worker._in_flight.clear()
+    starter.join()
+
+    assert bot.polled == []
+    assert queue.get(job["id"])["operation_name"] is None
+    queue.close()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import httpx
+
+from src.model.async_bot import AsyncThucChienAIBot
+from src.model.resilience import CircuitBreaker, Resilience
+
+
+KEY = "GET /key/info"
+
+
+def _open_breaker(resilience: Resilience) -> CircuitBreaker:
+    for _ in range(resilience.failure_threshold):
+        assert resilience.before_attempt(KEY)
+        with resilience.outcome(KEY) as outcome:
+            outcome.failure(503)
+    breaker = resilience.breaker(KEY)
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    resilience = Resilience(failure_threshold=3, recovery_timeout=60.0)
+    _open_breaker(resilience)
+    assert not resilience.before_attempt(KEY)
+
+
+def test_client_errors_do_not_open_breaker():
+    resilience = Resilience(failure_threshold=2, recovery_timeout=60.0)
+    for _ in range(5):
+        assert resilience.before_attempt(KEY)
+        with resilience.outcome(KEY) as outcome:
+            outcome.failure(404)
+    assert resilience.breaker(KEY).state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_single_probe_and_success_closes():
+    resilience = Resilience(failure_threshold=1, recovery_timeout=0.05)
+    breaker = _open_breaker(resilience)
+    time.sleep(0.06)
+
+    assert resilience.before_attempt(KEY)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Chỉ một request thử trong lúc half-open.
+    assert not resilience.before_attempt(KEY)
+
+    with resilience.outcome(KEY) as outcome:
+        outcome.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert resilience.before_attempt(KEY)
+
+
+def test_failed_probe_reopens():
+    resilience = Resilience(failure_threshold=1, recovery_timeout=0.05)
+    breaker = _open_breaker(resilience)
+    time.sleep(0.06)
+
+    assert resilience.before_attempt(KEY)
+    with resilience.outcome(KEY) as outcome:
+        outcome.failure(503)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not resilience.before_attempt(KEY)
+
+
+def test_probe_without_result_counts_as_failure():
+    resilience = Resilience(failure_threshold=1, recovery_timeout=0.05)
+    breaker = _open_breaker(resilience)
+    time.sleep(0.06)
+
+    assert resilience.before_attempt(KEY)
+    try:
+        with resilience.outcome(KEY):
+            raise OSError("upload file disappeared")
+    except OSError:
+        pass
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert resilience.before_attempt(KEY)
+
+
+def test_cancelled_async_probe_releases_breaker():
+    resilience = Resilience(failure_threshold=1, recovery_timeout=0.05)
+    breaker = _open_breaker(resilience)
+    slow = True
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if slow:
+            await asyncio.sleep(5)
+        return httpx.Response(200, json={"info": {"spend": 0.0}})
+
+    async def scenario() -> None:
+        nonlocal slow
+        bot = AsyncThucChienAIBot("test-key", base_url="http://test", resilience=resilience)
+        bot.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            await asyncio.sleep(0.06)
+            # Request thử của breaker half-open bị hủy giữa chừng.
+            try:
+                await asyncio.wait_for(bot.get_key_info(), timeout=0.05)
+            except asyncio.TimeoutError:
+                pass
+            assert breaker.state == CircuitBreaker.OPEN
+            assert not breaker._probe_in_flight
+
+            slow = False
+            await asyncio.sleep(0.06)
+            assert await bot.get_key_info() == {"info": {"spend": 0.0}}
+            assert breaker.state == CircuitBreaker.CLOSED
+        finally:
+            await bot.aclose()
+
+    asyncio.run(scenario())